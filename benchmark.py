@@ -0,0 +1,248 @@
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+import metriccomputations
+import zhang
+
+# Benchmark suite for the simulation and metric hot paths.
+#   python benchmark.py --out bench.json                  run and save results
+#   python benchmark.py --compare baseline.json           run and flag regressions
+#   python benchmark.py --plot scaling.png bench.json     plot saved scaling curves
+# Cases:
+#   next_step        one Grid.next_step on a fresh random grid
+#   converge         Grid.next_step until no improving move is left
+#   compute_metrics  metriccomputations.compute_metrics at several K
+#   simulate_step    the standalone simulate_step of each visual script
+# Within a case family sizes run in increasing order. --budget bounds each
+# case: repeats stop once their total passes it, and a size is skipped when
+# the time of the size before it, scaled by N**SCALING[family], predicts more
+# than the budget (a call cannot be stopped once started).
+
+SIZES = [10, 25, 50, 100]
+# converge runs a whole simulation, far slower than one step
+CONVERGE_SIZES = [5, 10, 15]
+RACES = [2, 4, 6, 8, 10]
+DENSITIES = [0.05, 0.1, 0.2]
+KS = [1, 3, 5]
+
+# growth exponent in N of each family's time on the python backend: a step
+# scans every pair of cells (N**4), a run to convergence takes O(N**2) steps,
+# the metrics search up to every cell from every cell
+SCALING = {"next_step": 4, "converge": 6, "compute_metrics": 4, "simulate_step": 4}
+
+RACE_NAMES = ["white", "black", "orange", "red", "blue", "green", "brown", "yellow", "purple", "pink"]
+
+SCRIPTS = ["zhang-segregation-threshold", "measureaveragedistance",
+           "measurekneighborhooddiversity", "printallmetrics"]
+
+
+def make_grid(n, num_races, density, seed=0, backend="python"):
+    # Random grid with equal race sizes, a fraction density of vacant cells and
+    # p = +1 for the own race, -1 for every other race
+    races = RACE_NAMES[:num_races]
+    agents = int(round(n * n * (1 - density)))
+    colors = {r: agents // num_races for r in races}
+    p = [[1 if i == j else -1 for j in range(num_races)] for i in range(num_races)]
+    random.seed(seed)
+    return zhang.Grid(N=n, p=p, color_dict={r: i for i, r in enumerate(races)}, colors=colors, backend=backend)
+
+
+def load_script(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{name}.py")
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def script_grid(module, n, density, seed=0):
+    # Random grid of the script's own agent codes (every non-vacant COLORS key)
+    codes = [c for c in sorted(module.COLORS) if c != module.VACANT]
+    rng = random.Random(seed)
+    agents = int(round(n * n * (1 - density)))
+    cells = [codes[k % len(codes)] for k in range(agents)] + [module.VACANT] * (n * n - agents)
+    rng.shuffle(cells)
+    module.GRID_SIZE = n
+    return [cells[i * n:(i + 1) * n] for i in range(n)]
+
+
+def time_call(setup, fn, min_time=0.2, max_repeats=5, budget=None):
+    # Median wall time of fn(setup()) over repeats, excluding setup; no
+    # repeat starts once the repeats so far took longer than budget
+    times = []
+    while len(times) < max_repeats and (not times or sum(times) < min_time) and \
+            (budget is None or sum(times) <= budget):
+        arg = setup()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            fn(arg)
+            times.append(time.perf_counter() - start)
+    return {"seconds": statistics.median(times), "min": min(times), "repeats": len(times)}
+
+
+def run_until_converged(g):
+    while g.next_step():
+        pass
+
+
+def cases(sizes, races, densities, ks, families, backend="python", converge_sizes=CONVERGE_SIZES):
+    # (family, params, setup, fn) in increasing size within each family; Grid
+    # cases on a non-default backend carry it in their params
+    tag = {} if backend == "python" else {"backend": backend}
+    if "next_step" in families:
+        for r in races:
+            for d in densities:
+                for n in sizes:
+                    yield "next_step", {"N": n, "races": r, "density": d, **tag}, \
+                        (lambda n=n, r=r, d=d: make_grid(n, r, d, backend=backend)), (lambda g: g.next_step())
+    if "converge" in families:
+        for r in races:
+            for d in densities:
+                for n in converge_sizes:
+                    yield "converge", {"N": n, "races": r, "density": d, **tag}, \
+                        (lambda n=n, r=r, d=d: make_grid(n, r, d, backend=backend)), run_until_converged
+    if "compute_metrics" in families:
+        for r in races:
+            for k in ks:
+                for n in sizes:
+                    names = RACE_NAMES[:r]
+                    yield "compute_metrics", {"N": n, "races": r, "K": k, **tag}, \
+                        (lambda n=n, r=r: make_grid(n, r, 0.1, backend=backend)), \
+                        (lambda g, names=names, k=k: metriccomputations.compute_metrics(g, names, k))
+    if "simulate_step" in families:
+        for name in SCRIPTS:
+            module = load_script(name)
+            for d in densities:
+                for n in sizes:
+                    yield "simulate_step", {"script": name, "N": n, "density": d}, \
+                        (lambda module=module, n=n, d=d: script_grid(module, n, d)), module.simulate_step
+
+
+def family_key(family, params):
+    # the sizes of one family member, whose times predict each other
+    return (family,) + tuple(sorted((k, v) for k, v in params.items() if k != "N"))
+
+
+def run_benchmarks(sizes=SIZES, races=RACES, densities=DENSITIES, ks=KS, families=None, budget=60.0, backend="python",
+                   converge_sizes=CONVERGE_SIZES):
+    families = families or ["next_step", "converge", "compute_metrics", "simulate_step"]
+    results = []
+    # family member -> (N, seconds) of its last timed size
+    last = {}
+    for family, params, setup, fn in cases(sizes, races, densities, ks, families, backend, converge_sizes):
+        key = family_key(family, params)
+        if key in last:
+            n, seconds = last[key]
+            predicted = seconds * (params["N"] / n) ** SCALING[family]
+            if predicted > budget:
+                results.append({"case": family, "params": params, "skipped": True, "predicted": predicted})
+                continue
+        timing = time_call(setup, fn, budget=budget)
+        results.append({"case": family, "params": params, **timing})
+        print(f"{family:16s} {json.dumps(params):60s} {timing['seconds']:.6f}s", file=sys.stderr)
+        last[key] = (params["N"], timing["seconds"])
+    return {
+        "meta": {"python": platform.python_version(), "numpy": np.__version__,
+                 "platform": platform.platform(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+    }
+
+
+def _case_id(result):
+    return result["case"] + " " + json.dumps(result["params"], sort_keys=True)
+
+
+def compare(current, baseline, threshold=0.2):
+    # Returns (case id, baseline seconds, current seconds) for every case that
+    # got slower than baseline by more than threshold (a fraction)
+    base = {_case_id(r): r for r in baseline["results"] if not r.get("skipped")}
+    regressions = []
+    for r in current["results"]:
+        if r.get("skipped") or _case_id(r) not in base:
+            continue
+        before = base[_case_id(r)]["seconds"]
+        if r["seconds"] > before * (1 + threshold):
+            regressions.append((_case_id(r), before, r["seconds"]))
+    return regressions
+
+
+def plot_scaling(results, path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    families = sorted({r["case"] for r in results["results"]})
+    fig, axes = plt.subplots(1, len(families), figsize=(6 * len(families), 5), squeeze=False)
+    for ax, family in zip(axes[0], families):
+        curves = {}
+        for r in results["results"]:
+            if r["case"] != family or r.get("skipped"):
+                continue
+            label = ", ".join(f"{k}={v}" for k, v in sorted(r["params"].items()) if k != "N")
+            curves.setdefault(label, []).append((r["params"]["N"], r["seconds"]))
+        for label, points in sorted(curves.items()):
+            points.sort()
+            ax.plot([p[0] for p in points], [p[1] for p in points], marker='o', linewidth=0.8, markersize=3, label=label)
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel("N")
+        ax.set_ylabel("seconds")
+        ax.set_title(family)
+        ax.legend(fontsize=6)
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation and metric hot paths")
+    parser.add_argument("saved", nargs="?", help="saved results to plot instead of running")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--converge-sizes", type=int, nargs="+", default=CONVERGE_SIZES)
+    parser.add_argument("--races", type=int, nargs="+", default=RACES)
+    parser.add_argument("--densities", type=float, nargs="+", default=DENSITIES)
+    parser.add_argument("--K", type=int, nargs="+", default=KS)
+    parser.add_argument("--only", nargs="+", choices=["next_step", "converge", "compute_metrics", "simulate_step"])
+    parser.add_argument("--backend", choices=zhang.BACKENDS, default="python", help="Grid backend for the Grid cases")
+    parser.add_argument("--budget", type=float, default=60.0,
+                        help="seconds per case: stop repeating past it, skip sizes predicted to exceed it")
+    parser.add_argument("--out", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before flagging (fraction)")
+    parser.add_argument("--plot", help="write scaling curves to this image")
+    args = parser.parse_args()
+
+    if args.saved:
+        with open(args.saved) as f:
+            results = json.load(f)
+    else:
+        results = run_benchmarks(args.sizes, args.races, args.densities, args.K, args.only, args.budget, args.backend,
+                                 args.converge_sizes)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.plot:
+        plot_scaling(results, args.plot)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for case, before, after in regressions:
+            print(f"REGRESSION {case}: {before:.6f}s -> {after:.6f}s ({after / before - 1:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import os
+import queue
+import struct
+import threading
+import zipfile
+import zlib
+
+import numpy as np
+
+# Headless capture of grid snapshots straight from a type-code array.
+# Frames are handed to a background writer thread, so the simulation only pays
+# for an array copy. Two output modes:
+#   "png" - a directory of frame_<step>.png images colored through a palette
+#   "npz" - a single compressed archive with one frame_<step> array of type
+#           codes per captured step, readable lazily with np.load
+
+
+def write_png(path, rgb):
+    # Minimal RGB PNG encoder (8 bit, no filtering), so capture needs no display
+    height, width, _ = rgb.shape
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgb.reshape(height, width * 3)
+
+    def chunk(tag, data):
+        body = tag + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xffffffff)
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)))
+        f.write(chunk(b"IEND", b""))
+
+
+class FrameCapture:
+    def __init__(self, path, every=1, mode="npz", palette=None, cell_size=1, max_queue=64):
+        if mode not in ("png", "npz"):
+            raise ValueError(f"Unknown capture mode {mode}")
+        if mode == "png" and palette is None:
+            raise ValueError("PNG capture needs a palette")
+        self.path = path
+        self.every = every
+        self.mode = mode
+        self.lut = None if palette is None else np.array(palette, dtype=np.uint8)
+        self.cell_size = cell_size
+        self.steps = []
+        # bounded so a slow disk applies back-pressure instead of growing memory
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._error = None
+
+        if mode == "png":
+            os.makedirs(path, exist_ok=True)
+            self._archive = None
+        else:
+            self._archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def capture(self, step, types):
+        if step % self.every:
+            return
+        if self._error is not None:
+            raise self._error
+        self.steps.append(step)
+        self._queue.put((step, np.array(types, dtype=np.int8)))
+
+    def _write_frame(self, step, types):
+        if self.mode == "png":
+            rgb = self.lut[types]
+            if self.cell_size > 1:
+                rgb = rgb.repeat(self.cell_size, axis=0).repeat(self.cell_size, axis=1)
+            write_png(os.path.join(self.path, f"frame_{step:08d}.png"), rgb)
+        else:
+            with self._archive.open(f"frame_{step:08d}.npy", "w") as f:
+                np.lib.format.write_array(f, types)
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is None:
+                try:
+                    self._write_frame(*item)
+                except Exception as e:
+                    self._error = e
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        if self._archive is not None:
+            with self._archive.open("steps.npy", "w") as f:
+                np.lib.format.write_array(f, np.array(self.steps, dtype=np.int64))
+            if self.lut is not None:
+                with self._archive.open("palette.npy", "w") as f:
+                    np.lib.format.write_array(f, self.lut)
+            self._archive.close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_frames(path):
+    # (steps, frames) from an npz capture archive
+    with np.load(path) as data:
+        steps = data["steps"]
+        frames = np.stack([data[f"frame_{s:08d}"] for s in steps]) if len(steps) else None
+    return steps, frames
@@ -0,0 +1,200 @@
+import random
+
+import numpy as np
+
+import kernels
+import policies
+import profiling
+from vacancies import VacancySet, VacancyHeaps
+
+# The Zhang utility model on arbitrary networks. Agents live on the nodes of an
+# undirected graph stored as CSR adjacency (Adjacency: indptr, indices), and an
+# agent's utility is the p_ij sum over its occupied neighbors, as on the grid.
+# GraphModel mirrors Grid's simulation interface (next_step, swap_cells,
+# types, last_move, total_utility, compute_metrics via metriccomputations) and
+# runs the same kernels.py machinery: neighbor counts kept up to date by
+# swap_cells and the best-move search over every pair of nodes p < q
+# (branch and bound by default, see kernels.best_move).
+#
+# Graphs come from an edge list (from_edges, load_edge_list for road networks
+# and block adjacency files), a random geometric graph, or a grid topology.
+# Building a graph, the neighbor counts and the metrics are O(nodes + edges);
+# the best-move search is linear per agent it has to evaluate.
+
+
+class Adjacency:
+    def __init__(self, indptr, indices, name="graph"):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.name = name
+        self.num_nodes = len(self.indptr) - 1
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def neighbors(self, v):
+        return self.indices[self.indptr[v]:self.indptr[v + 1]]
+
+    def save(self, path):
+        np.savez_compressed(path, indptr=self.indptr, indices=self.indices, name=self.name)
+
+
+def from_edges(num_nodes, edges, name="graph"):
+    # Undirected CSR adjacency from an (E, 2) array of node pairs; duplicate
+    # edges and self loops are dropped, neighbors are sorted
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    both = np.concatenate([edges, edges[:, ::-1]])
+    keys = np.unique(both[:, 0] * num_nodes + both[:, 1])
+    src, dst = np.divmod(keys, num_nodes)
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(src, minlength=num_nodes))
+    return Adjacency(indptr, dst, name)
+
+
+def load_edge_list(path, name=None):
+    # Whitespace separated "u v" lines, '#' comments (the SNAP road network
+    # format). Node ids are relabeled 0..n-1 in sorted order; returns
+    # (adjacency, original ids)
+    edges = np.loadtxt(path, dtype=np.int64, comments="#", ndmin=2)[:, :2]
+    ids, flat = np.unique(edges, return_inverse=True)
+    return from_edges(len(ids), flat.reshape(-1, 2), name or path), ids
+
+
+def load_adjacency(path):
+    with np.load(path) as data:
+        return Adjacency(data["indptr"], data["indices"], str(data["name"]))
+
+
+def random_geometric(num_nodes, radius, seed=0):
+    # Nodes uniform in the unit square, joined when closer than radius.
+    # Points are binned into cells of side radius so only the 3 x 3 block of
+    # cells around each point is compared. Returns (adjacency, positions).
+    rng = np.random.default_rng(seed)
+    pos = rng.random((num_nodes, 2))
+    side = max(int(1 / radius), 1)
+    cell = np.minimum((pos / (1 / side)).astype(np.int64), side - 1)
+    key = cell[:, 0] * side + cell[:, 1]
+    order = np.argsort(key, kind="stable")
+    sorted_key = key[order]
+    starts = np.searchsorted(sorted_key, np.arange(side * side))
+    ends = np.searchsorted(sorted_key, np.arange(side * side), side="right")
+    edges = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            cx, cy = cell[:, 0] + dx, cell[:, 1] + dy
+            ok = (cx >= 0) & (cx < side) & (cy >= 0) & (cy < side)
+            src = np.nonzero(ok)[0]
+            other = cx[ok] * side + cy[ok]
+            count = ends[other] - starts[other]
+            owner = np.repeat(src, count)
+            first = np.repeat(starts[other] - np.cumsum(count) + count, count)
+            dst = order[first + np.arange(len(owner))]
+            close = (owner < dst) & (((pos[owner] - pos[dst]) ** 2).sum(axis=1) < radius * radius)
+            edges.append(np.stack([owner[close], dst[close]], axis=1))
+    return from_edges(num_nodes, np.concatenate(edges), f"geometric({num_nodes},{radius})"), pos
+
+
+def from_topology(topology):
+    # the grid topology's cells as a graph (node i * N + j)
+    return Adjacency(topology.indptr, topology.indices, topology.name)
+
+
+def build(spec):
+    # Adjacency from a config dict:
+    #   {"edges": path}                                  edge list file
+    #   {"adjacency": path}                              saved Adjacency (.npz)
+    #   {"geometric": nodes, "radius": r, "seed": s}     random geometric graph
+    #   {"topology": name, "N": N}                       grid topology
+    if "edges" in spec:
+        return load_edge_list(spec["edges"])[0]
+    if "adjacency" in spec:
+        return load_adjacency(spec["adjacency"])
+    if "geometric" in spec:
+        return random_geometric(spec["geometric"], spec["radius"], spec.get("seed", 0))[0]
+    if "topology" in spec:
+        from topology import get_topology
+        return from_topology(get_topology(spec["N"], spec["topology"]))
+    raise ValueError(f"Unknown graph spec {spec}")
+
+
+class GraphModel:
+    def __init__(self, adjacency, p, color_dict, colors, backend="numpy", verbose=False, prune=True, policy="best"):
+        if backend not in ("numpy", "numba"):
+            raise ValueError(f"Unknown graph backend {backend}")
+        if backend == "numba" and not kernels.HAVE_NUMBA:
+            backend = "numpy"
+        self.adjacency = adjacency
+        self.N = adjacency.num_nodes
+        self.p = p
+        self.color_dict = color_dict
+        self.colors = colors
+        self.backend = backend
+        self.verbose = verbose
+        # branch-and-bound best move (kernels.best_move) instead of the full scan
+        self.prune = prune
+        # (from, to) nodes of the last swap applied by next_step
+        self.last_move = None
+
+        num_vacant = self.N - sum(colors.values())
+        if num_vacant < 0:
+            raise ValueError("There are no vacant nodes!")
+        # same placement as Grid: shuffle the list of agents and vacancies
+        cells = [color_dict[c] + 1 for c in colors for _ in range(colors[c])] + [0] * num_vacant
+        random.shuffle(cells)
+        self.types = np.array(cells, dtype=np.int8)
+        self.P = kernels.padded_p(p)
+        self.counts = kernels.neighbor_counts(self.types, adjacency.indptr, adjacency.indices, len(color_dict) + 1)
+        # vacant nodes and the per-type heaps of the best ones, as on Grid
+        self.vacancies = VacancySet(self.types)
+        self.vacancy_heaps = VacancyHeaps(self.vacancies, len(self.P), lambda v: self.P @ self.counts[:, v]) \
+            if prune else None
+        # move-selection policy, see policies.py
+        self.policy = policies.get_policy(policy)
+
+    def swap_cells(self, v, w):
+        a, b = int(self.types[v]), int(self.types[w])
+        if a == b:
+            return
+        self.types[v], self.types[w] = b, a
+        kernels.update_counts(self.counts, self.adjacency.indptr, self.adjacency.indices, v, a, b)
+        kernels.update_counts(self.counts, self.adjacency.indptr, self.adjacency.indices, w, b, a)
+        self.vacancies.update(v, b)
+        self.vacancies.update(w, a)
+        if self.vacancy_heaps is not None:
+            self.vacancy_heaps.refresh(np.concatenate([[v, w], self.adjacency.neighbors(v), self.adjacency.neighbors(w)]))
+
+    def utility(self, v):
+        # utility of the agent at node v
+        a = int(self.types[v])
+        return float(self.P[a] @ self.counts[:, v]) if a else 0.0
+
+    def total_utility(self):
+        return float((self.P[self.types.astype(np.intp)] * self.counts.T).sum())
+
+    def next_step(self):
+        prof = profiling.active
+        if prof is not None:
+            t = prof.begin()
+        U = kernels.utilities(self.counts, self.P)
+        args = (self.types, U, self.P, self.adjacency.indptr, self.adjacency.indices, self.backend == "numba")
+        if self.policy.name != "best":
+            count, delta_u, u_old, u_new, v, w = policies.kernel_select(self.policy, *args[:5])
+        elif self.prune:
+            count, delta_u, u_old, u_new, v, w, evaluated = kernels.best_move(
+                *args, vacant=self.vacancies.cells(), vacancy_best=self.vacancy_heaps.best_utilities())
+        else:
+            count, delta_u, u_old, u_new, v, w = kernels.scan(*args)
+        if prof is not None:
+            prof.lap("step.scan", t)
+            prof.count("step.calls")
+            prof.count("step.candidates", count)
+            if self.policy.name == "best" and self.prune:
+                prof.count("step.agents_evaluated", evaluated)
+        if v < 0:
+            return False
+        if self.verbose:
+            print(f"Move from {v} to {w} | Previous Utility: {u_old:.2f}, New Utility: {u_new:.2f}, Change: {delta_u:.2f}")
+        self.swap_cells(v, w)
+        self.last_move = (v, w)
+        return True
@@ -0,0 +1,699 @@
+import numpy as np
+
+# Integer-array kernels for the step scan and the metric loops, used by Grid
+# when it is built with backend="numba" or backend="numpy".
+# Cells are flat indices (i * N + j) holding type codes (0 = vacant,
+# color_dict index + 1 = race); neighbors come from a topology.Topology as CSR
+# arrays (indptr, indices). P is the p_ij matrix padded with a zero row and
+# column for vacant cells, so P[a, b] is what a neighbor of type b adds to the
+# utility of an agent of type a.
+#
+# The loop-shaped kernels (*_loops) are compiled with numba.njit when numba is
+# installed. Without numba the same results come from the vectorized NumPy
+# versions, so backend="numba" falls back to them.
+
+try:
+    import numba
+    HAVE_NUMBA = True
+except ImportError:
+    numba = None
+    HAVE_NUMBA = False
+
+# pairs per block in scan_numpy
+SCAN_BLOCK = 1 << 20
+
+
+def jit(fn):
+    if HAVE_NUMBA:
+        return numba.njit(cache=True)(fn)
+    return fn
+
+
+def padded_p(p):
+    P = np.zeros((len(p) + 1, len(p) + 1))
+    P[1:, 1:] = p
+    return P
+
+
+def neighbor_counts(types, indptr, indices, num_types):
+    # counts[t, c] = number of type-t neighbors of cell c
+    owners = np.repeat(np.arange(len(types)), np.diff(indptr))
+    flat = types[indices].astype(np.intp) * len(types) + owners
+    return np.bincount(flat, minlength=num_types * len(types)).astype(np.int32).reshape(num_types, len(types))
+
+
+@jit
+def update_counts(counts, indptr, indices, c, old, new):
+    # cell c changed from type old to type new
+    for k in range(indptr[c], indptr[c + 1]):
+        counts[old, indices[k]] -= 1
+        counts[new, indices[k]] += 1
+
+
+def utilities(counts, P):
+    # U[a, c] = utility of an agent of type a placed at cell c
+    return P @ counts
+
+
+# Best improving move, in the scan order of Grid.improving_move_then_swap:
+# every pair of cells p < q, and with width > 0 only the pairs in Grid's scan
+# window, q % width > p % width (on an N x N board, width = N: (k, l) with
+# k >= i and l > j); graphs scan every pair. An agent moving into a vacancy improves when its
+# utility there beats its utility now (not counting itself as a neighbor); two
+# agents trading places are a candidate only when both improve, and the
+# candidate's delta is that of the agent at p. Ties go to the first pair in
+# scan order. Returns (number of candidates, delta, u_old, u_new, p, q), with
+# p = -1 when nothing improves.
+
+@jit
+def scan_loops(types, U, P, indptr, indices, width):
+    m = types.shape[0]
+    count = 0
+    best_delta, best_old, best_new = 0.0, 0.0, 0.0
+    best_p, best_q = -1, -1
+    # mark[q] == p while scanning p marks the neighbors of p
+    mark = np.full(m, -1, dtype=np.int64)
+    for p in range(m):
+        a = types[p]
+        for k in range(indptr[p], indptr[p + 1]):
+            mark[indices[k]] = p
+        for q in range(p + 1, m):
+            b = types[q]
+            if a == 0 and b == 0:
+                continue
+            if width and q % width <= p % width:
+                continue
+            adj = mark[q] == p
+            if b == 0:
+                u_stay = U[a, p]
+                u_move = U[a, q] - (P[a, a] if adj else 0.0)
+                improves = u_move > u_stay
+            elif a == 0:
+                u_stay = U[b, q]
+                u_move = U[b, p] - (P[b, b] if adj else 0.0)
+                improves = u_move > u_stay
+            else:
+                u_stay = U[a, p]
+                u_move = U[a, q] + ((P[a, b] - P[a, a]) if adj else 0.0)
+                u_move_2 = U[b, p] + ((P[b, a] - P[b, b]) if adj else 0.0)
+                improves = u_move > u_stay and u_move_2 > U[b, q]
+            if improves:
+                count += 1
+                if best_p < 0 or u_move - u_stay > best_delta:
+                    best_delta, best_old, best_new = u_move - u_stay, u_stay, u_move
+                    best_p, best_q = p, q
+    return count, best_delta, best_old, best_new, best_p, best_q
+
+
+def _scan_block(types, U, P, indptr, indices, p0, p1, width):
+    # rows p0 <= p < p1 of scan_loops against every q > p0: (improves, stay,
+    # move) arrays of shape (p1 - p0, m - p0 - 1), q = p0 + 1 + column
+    m = len(types)
+    diag = np.diag(P)
+    degree = np.diff(indptr)
+    ps = np.arange(p0, p1)[:, None]
+    qs = np.arange(p0 + 1, m)[None, :]
+    A = types[p0:p1][:, None]
+    B = types[p0 + 1:][None, :]
+    adj = np.zeros((p1 - p0, m - p0 - 1), dtype=bool)
+    rows = np.repeat(np.arange(p1 - p0), degree[p0:p1])
+    cols = indices[indptr[p0]:indptr[p1]] - (p0 + 1)
+    keep = cols >= 0
+    adj[rows[keep], cols[keep]] = True
+
+    u_a_here = U[A, ps]
+    u_a_there = U[A, qs]
+    u_b_here = U[B, ps]
+    u_b_there = U[B, qs]
+    stay = np.where(A != 0, u_a_here, u_b_there)
+    move = np.where(B == 0, u_a_there - adj * diag[A],
+                    np.where(A == 0, u_b_here - adj * diag[B], u_a_there + adj * (P[A, B] - diag[A])))
+    improves = (qs > ps) & ((A != 0) | (B != 0)) & (move > stay)
+    both = (A != 0) & (B != 0)
+    improves &= ~both | (u_b_here + adj * (P[B, A] - diag[B]) > u_b_there)
+    if width:
+        improves &= qs % width > ps % width
+    return improves, stay, move
+
+
+def _blocks(m, grow=False):
+    # row ranges [p0, p1) of about SCAN_BLOCK pairs; with grow, starting from
+    # one row and doubling, for scans that usually stop early
+    block = max(1, SCAN_BLOCK // max(m, 1))
+    size = 1 if grow else block
+    p0 = 0
+    while p0 < m - 1:
+        p1 = min(p0 + size, m - 1)
+        yield p0, p1
+        p0 = p1
+        size = min(2 * size, block)
+
+
+def scan_numpy(types, U, P, indptr, indices, width=0):
+    # scan_loops vectorized over blocks of rows p, against every q > p
+    types = types.astype(np.intp)
+    count = 0
+    best = (0.0, 0.0, 0.0, -1, -1)
+    for p0, p1 in _blocks(len(types)):
+        improves, stay, move = _scan_block(types, U, P, indptr, indices, p0, p1, width)
+        block_count = int(improves.sum())
+        if not block_count:
+            continue
+        count += block_count
+        delta = np.where(improves, move - stay, -np.inf)
+        first = int(np.argmax(delta))
+        if best[3] < 0 or delta.flat[first] > best[0]:
+            r, c = np.unravel_index(first, delta.shape)
+            best = (float(delta.flat[first]), float(stay.flat[first]), float(move.flat[first]), p0 + int(r), p0 + 1 + int(c))
+    return (count,) + best
+
+
+def scan(types, U, P, indptr, indices, use_numba=HAVE_NUMBA, width=0):
+    if use_numba:
+        return scan_loops(types.astype(np.int64), U, P, indptr, indices, width)
+    return scan_numpy(types, U, P, indptr, indices, width)
+
+
+# The other move-selection policies of policies.py over the same candidates,
+# in the same scan order and window (vectorized by blocks of rows; backend="numba" uses
+# these too):
+#   first_move   the first improving pair, stopping at the block holding it
+#                (blocks start at one row and double)
+#   random_move  a uniform improving pair by reservoir sampling: candidate n
+#                replaces the kept one when rng.random() < 1 / n, with one
+#                draw per candidate in scan order, as the python backend does
+#   pair_moves   the given pairs (p < q) only: (improves, delta, stay, move)
+# first_move and random_move return (candidates seen, delta, u_old, u_new, p, q)
+# like scan.
+
+def first_move(types, U, P, indptr, indices, width=0):
+    types = types.astype(np.intp)
+    for p0, p1 in _blocks(len(types), grow=True):
+        improves, stay, move = _scan_block(types, U, P, indptr, indices, p0, p1, width)
+        if improves.any():
+            first = int(np.argmax(improves))
+            r, c = np.unravel_index(first, improves.shape)
+            return 1, float(move.flat[first] - stay.flat[first]), float(stay.flat[first]), float(move.flat[first]), \
+                p0 + int(r), p0 + 1 + int(c)
+    return 0, 0.0, 0.0, 0.0, -1, -1
+
+
+def random_move(types, U, P, indptr, indices, rng, width=0):
+    types = types.astype(np.intp)
+    count = 0
+    best = (0.0, 0.0, 0.0, -1, -1)
+    for p0, p1 in _blocks(len(types)):
+        improves, stay, move = _scan_block(types, U, P, indptr, indices, p0, p1, width)
+        found = np.flatnonzero(improves)
+        if not len(found):
+            continue
+        draws = rng.random(len(found))
+        kept = np.flatnonzero(draws * np.arange(count + 1, count + len(found) + 1) < 1.0)
+        count += len(found)
+        if len(kept):
+            k = int(found[kept[-1]])
+            r, c = np.unravel_index(k, improves.shape)
+            best = (float(move.flat[k] - stay.flat[k]), float(stay.flat[k]), float(move.flat[k]), p0 + int(r), p0 + 1 + int(c))
+    return (count,) + best
+
+
+def pair_moves(types, U, P, indptr, indices, ps, qs):
+    types = types.astype(np.intp)
+    diag = np.diag(P)
+    A, B = types[ps], types[qs]
+    # q in the neighbor list of p
+    starts, ends = indptr[ps], indptr[ps + 1]
+    adj = np.zeros(len(ps), dtype=bool)
+    for k in range(int((ends - starts).max(initial=0))):
+        has = starts + k < ends
+        adj[has] |= indices[starts[has] + k] == qs[has]
+    stay = np.where(A != 0, U[A, ps], U[B, qs])
+    move = np.where(B == 0, U[A, qs] - adj * diag[A],
+                    np.where(A == 0, U[B, ps] - adj * diag[B], U[A, qs] + adj * (P[A, B] - diag[A])))
+    improves = ((A != 0) | (B != 0)) & (move > stay)
+    both = (A != 0) & (B != 0)
+    improves &= ~both | (U[B, ps] + adj * (P[B, A] - diag[B]) > U[B, qs])
+    return improves, move - stay, stay, move
+
+
+# Best move of the "vacancy" policy: agents only move into vacancies, every
+# agent is tried in every vacancy (no scan window, no trades), the largest
+# delta wins, ties to the first agent and then the first vacancy. Moving an
+# agent vacates its cell, so a vacancy next to it counts the agent's own type
+# once less; every other vacancy keeps its utility, and the best of those is
+# among the (largest degree + 1) best vacancies overall. Each agent is scored
+# against those and its vacant neighbors, and the candidates are counted from
+# the sorted vacancy utilities. Returns (candidates, delta, u_old, u_new, p, q)
+# with p the agent's cell and q the vacancy, p = -1 when nothing improves.
+
+def vacancy_move(types, U, P, indptr, indices):
+    types = types.astype(np.intp)
+    vacant = np.flatnonzero(types == 0)
+    best = (0.0, 0.0, 0.0, -1, -1)
+    count = 0
+    if not len(vacant):
+        return (count,) + best
+    degree = np.diff(indptr)
+    width = max(int(degree.max(initial=0)), 1)
+    for a in range(1, P.shape[0]):
+        cells = np.flatnonzero(types == a)
+        if not len(cells):
+            continue
+        u_old = U[a, cells]
+        u_vacant = U[a, vacant]
+        # neighbors of every agent, padded with -1
+        k = np.arange(width)
+        has = k[None, :] < degree[cells][:, None]
+        near = np.where(has, indices[np.minimum(indptr[cells][:, None] + k, len(indices) - 1)], -1)
+        near_vacant = has & (types[np.maximum(near, 0)] == 0)
+        u_near = np.where(near_vacant, U[a, np.maximum(near, 0)] - P[a, a], -np.inf)
+
+        ranked = np.sort(u_vacant)
+        count += int((len(vacant) - np.searchsorted(ranked, u_old, side="right")).sum())
+        u_unadjusted = np.where(near_vacant, U[a, np.maximum(near, 0)], -np.inf)
+        count += int(((u_near > u_old[:, None]).sum() - (u_unadjusted > u_old[:, None]).sum()))
+
+        order = np.lexsort((vacant, -u_vacant))[:width + 1]
+        top = vacant[order]
+        adjacent = (near[:, :, None] == top[None, None, :]).any(axis=1)
+        values = np.concatenate([np.where(adjacent, -np.inf, u_vacant[order]), u_near], axis=1)
+        targets = np.concatenate([np.broadcast_to(top, adjacent.shape), np.where(near_vacant, near, len(types))], axis=1)
+        u_new = values.max(axis=1)
+        to = np.where(values == u_new[:, None], targets, len(types)).min(axis=1)
+        delta = u_new - u_old
+        i = int(np.argmax(delta))
+        if delta[i] > 0 and (best[3] < 0 or delta[i] > best[0] or (delta[i] == best[0] and cells[i] < best[3])):
+            best = (float(delta[i]), float(u_old[i]), float(u_new[i]), int(cells[i]), int(to[i]))
+    return (count,) + best
+
+
+# Branch-and-bound version of scan: the same best move, found by visiting
+# agents in descending order of an upper bound on their gain and stopping once
+# the bound drops below the best delta found. Every candidate pair is owned by
+# one agent (the mover into a vacancy, or the agent at p when agents at p < q
+# trade places) and is ranked by (delta, then earliest pair), so the order in
+# which agents are visited does not change the result. An agent of type a at
+# p gains at most
+#   best vacancy utility for a + max(0, -P[a, a]) - U[a, p]          moving
+#   best occupied-cell utility for a + max(0, max_b P[a, b] - P[a, a]) - U[a, p]
+#                                                                   trading
+# (the slack terms cover the agent leaving its own neighborhood). An agent's
+# moves are evaluated over the vacant cells only, and its trades only while
+# the trade bound can still reach the best delta. vacant is the array of
+# vacant cells (a vacancies.VacancySet keeps it) and vacancy_best the best
+# vacancy utility per type (from vacancies.VacancyHeaps); both are computed
+# from types and U when not given. Returns (candidates among the pairs
+# evaluated, delta, u_old, u_new, p, q, agents evaluated) like scan, with
+# p < q the cells of the pair; width restricts the pairs as in scan.
+
+def gain_bounds(types, U, P, vacant, vacancy_best=None):
+    # per-cell upper bounds on the gain of the agent there from moving and
+    # from trading, -inf for vacancies
+    num_types = P.shape[0]
+    occupied = types != 0
+    move_bound = np.full(num_types, -np.inf)
+    trade_bound = np.full(num_types, -np.inf)
+    for a in range(1, num_types):
+        if vacancy_best is not None:
+            move_bound[a] = vacancy_best[a] + max(0.0, -P[a, a])
+        elif len(vacant):
+            move_bound[a] = U[a, vacant].max() + max(0.0, -P[a, a])
+        if occupied.any():
+            trade_bound[a] = U[a, occupied].max() + max(0.0, P[a, 1:].max() - P[a, a])
+    codes = types.astype(np.intp)
+    here = U[codes, np.arange(len(types))]
+    move_gains = np.where(occupied, move_bound[codes] - here, -np.inf)
+    trade_gains = np.where(occupied, trade_bound[codes] - here, -np.inf)
+    return move_gains, trade_gains
+
+
+@jit
+def best_move_loops(types, U, P, indptr, indices, order, gains, trade_gains, vacant, width):
+    m = types.shape[0]
+    count = 0
+    evaluated = 0
+    best_delta, best_old, best_new = 0.0, 0.0, 0.0
+    best_p, best_q, best_key = -1, -1, -1
+    mark = np.full(m, -1, dtype=np.int64)
+    for p in order:
+        if gains[p] <= 0.0 or (best_p >= 0 and gains[p] < best_delta):
+            break
+        evaluated += 1
+        a = types[p]
+        u_stay = U[a, p]
+        for k in range(indptr[p], indptr[p + 1]):
+            mark[indices[k]] = p
+        for q in vacant:
+            if width and max(p, q) % width <= min(p, q) % width:
+                continue
+            u_move = U[a, q] - (P[a, a] if mark[q] == p else 0.0)
+            if u_move > u_stay:
+                count += 1
+                delta = u_move - u_stay
+                key = min(p, q) * m + max(p, q)
+                if best_p < 0 or delta > best_delta or (delta == best_delta and key < best_key):
+                    best_delta, best_old, best_new = delta, u_stay, u_move
+                    best_p, best_q, best_key = min(p, q), max(p, q), key
+        if trade_gains[p] <= 0.0 or (best_p >= 0 and trade_gains[p] < best_delta):
+            continue
+        for q in range(p + 1, m):
+            b = types[q]
+            if b == 0 or (width and q % width <= p % width):
+                continue
+            adj = mark[q] == p
+            u_move = U[a, q] + ((P[a, b] - P[a, a]) if adj else 0.0)
+            if u_move > u_stay and U[b, p] + ((P[b, a] - P[b, b]) if adj else 0.0) > U[b, q]:
+                count += 1
+                delta = u_move - u_stay
+                key = p * m + q
+                if best_p < 0 or delta > best_delta or (delta == best_delta and key < best_key):
+                    best_delta, best_old, best_new = delta, u_stay, u_move
+                    best_p, best_q, best_key = p, q, key
+    return count, best_delta, best_old, best_new, best_p, best_q, evaluated
+
+
+def _best_of(best, best_key, p, q, delta, u_stay, move, m):
+    # fold the candidates (q, delta, move) of the agent at p into best
+    top = delta.max()
+    if best[3] >= 0 and (top < best[0]):
+        return best, best_key
+    ties = np.nonzero(delta == top)[0]
+    keys = np.minimum(q[ties], p) * m + np.maximum(q[ties], p)
+    k = int(ties[np.argmin(keys)])
+    key = int(keys.min())
+    if best[3] < 0 or top > best[0] or key < best_key:
+        qk = int(q[k])
+        return (float(top), float(u_stay), float(move[k]), min(p, qk), max(p, qk)), key
+    return best, best_key
+
+
+def best_move_numpy(types, U, P, indptr, indices, order, gains, trade_gains, vacant, width=0):
+    m = len(types)
+    types = types.astype(np.intp)
+    cells = np.arange(m)
+    diag = np.diag(P)
+    vacant = np.asarray(vacant, dtype=np.int64)
+    count = 0
+    evaluated = 0
+    best = (0.0, 0.0, 0.0, -1, -1)
+    best_key = -1
+    for p in order:
+        if gains[p] <= 0 or (best[3] >= 0 and gains[p] < best[0]):
+            break
+        evaluated += 1
+        p = int(p)
+        a = types[p]
+        u_stay = U[a, p]
+        adj = np.zeros(m, dtype=bool)
+        adj[indices[indptr[p]:indptr[p + 1]]] = True
+        move = U[a, vacant] - adj[vacant] * P[a, a]
+        improves = move > u_stay
+        if width:
+            improves &= np.maximum(vacant, p) % width > np.minimum(vacant, p) % width
+        found = int(improves.sum())
+        if found:
+            count += found
+            best, best_key = _best_of(best, best_key, p, vacant[improves], move[improves] - u_stay, u_stay,
+                                      move[improves], m)
+        if trade_gains[p] <= 0 or (best[3] >= 0 and trade_gains[p] < best[0]):
+            continue
+        q = cells[p + 1:]
+        b = types[p + 1:]
+        nb = adj[p + 1:]
+        move = U[a, q] + nb * (P[a, b] - P[a, a])
+        improves = (b != 0) & (move > u_stay) & (U[b, p] + nb * (P[b, a] - diag[b]) > U[b, q])
+        if width:
+            improves &= q % width > p % width
+        found = int(improves.sum())
+        if found:
+            count += found
+            best, best_key = _best_of(best, best_key, p, q[improves], move[improves] - u_stay, u_stay,
+                                      move[improves], m)
+    return (count,) + best + (evaluated,)
+
+
+def best_move(types, U, P, indptr, indices, use_numba=HAVE_NUMBA, vacant=None, vacancy_best=None, width=0):
+    if vacant is None:
+        vacant = np.flatnonzero(types == 0)
+    move_gains, trade_gains = gain_bounds(types, U, P, vacant, vacancy_best)
+    gains = np.maximum(move_gains, trade_gains)
+    order = np.argsort(-gains, kind="stable")
+    if use_numba:
+        return best_move_loops(types.astype(np.int64), U, P, indptr, indices, order, gains, trade_gains,
+                               np.asarray(vacant, dtype=np.int64), width)
+    return best_move_numpy(types, U, P, indptr, indices, order, gains, trade_gains, vacant, width)
+
+
+# Per-cell values behind metriccomputations.compute_metrics, on the N x N
+# board of types. offsets are the (dx, dy, distance) rows of the topology's
+# distance_offsets, k_offsets its K-neighborhood, neighbors its neighbor
+# offsets and codes the type codes of the races asked about; cells off a
+# bounded board (wrap False) count as vacant. For every occupied cell:
+#   nearest   distance to the nearest agent of another race, -1 if none
+#   furthest  largest distance over the other races to their nearest agent (0 if absent)
+#   diversity fraction of occupied K-neighbors of another race
+#   least     fraction of occupied K-neighbors of the rarest other race
+#   inter, total  interracial and occupied neighbors
+
+@jit
+def _at(types, x, y, wrap):
+    n = types.shape[0]
+    if wrap:
+        return types[x % n, y % n]
+    if 0 <= x < n and 0 <= y < n:
+        return types[x, y]
+    return 0
+
+
+@jit
+def cell_metrics_loops(types, offsets, k_offsets, neighbors, codes, wrap, r0, r1):
+    # per-cell metrics of rows r0..r1 - 1 (the rows of the returned arrays)
+    n = types.shape[0]
+    nearest = np.full((r1 - r0, n), -1.0)
+    furthest = np.zeros((r1 - r0, n))
+    diversity = np.zeros((r1 - r0, n))
+    least = np.zeros((r1 - r0, n))
+    inter = np.zeros((r1 - r0, n), dtype=np.int64)
+    total = np.zeros((r1 - r0, n), dtype=np.int64)
+    race_counts = np.zeros(max(types.max(), codes.max()) + 1, dtype=np.int64)
+    for x in range(r0, r1):
+        r = x - r0
+        for y in range(n):
+            current = types[x, y]
+            if current == 0:
+                continue
+            for o in range(offsets.shape[0]):
+                t = _at(types, x + int(offsets[o, 0]), y + int(offsets[o, 1]), wrap)
+                if t != 0 and t != current:
+                    nearest[r, y] = offsets[o, 2]
+                    break
+            far = 0.0
+            for c in codes:
+                if c == current:
+                    continue
+                dist = 0.0
+                for o in range(offsets.shape[0]):
+                    if _at(types, x + int(offsets[o, 0]), y + int(offsets[o, 1]), wrap) == c:
+                        dist = offsets[o, 2]
+                        break
+                far = max(far, dist)
+            furthest[r, y] = far
+            race_counts[:] = 0
+            occupied = 0
+            diff = 0
+            for o in range(k_offsets.shape[0]):
+                t = _at(types, x + k_offsets[o, 0], y + k_offsets[o, 1], wrap)
+                if t != 0:
+                    occupied += 1
+                    race_counts[t] += 1
+                    if t != current:
+                        diff += 1
+            if occupied > 0:
+                rarest = -1
+                for c in codes:
+                    if c != current and (rarest < 0 or race_counts[c] < rarest):
+                        rarest = race_counts[c]
+                diversity[r, y] = diff / occupied
+                least[r, y] = rarest / occupied
+            for o in range(neighbors.shape[0]):
+                t = _at(types, x + neighbors[o, 0], y + neighbors[o, 1], wrap)
+                if t != 0:
+                    total[r, y] += 1
+                    if t != current:
+                        inter[r, y] += 1
+    return nearest, furthest, diversity, least, inter, total
+
+
+def _shifted(types, dx, dy, wrap, rows=None):
+    # shifted[x, y] = type at (x + dx, y + dy), 0 off a bounded board; with
+    # rows = (r0, r1) only rows r0..r1 - 1 of it
+    dx, dy = int(dx), int(dy)
+    n = types.shape[0]
+    if rows is not None:
+        source = np.arange(*rows) + dx
+        if wrap:
+            return np.roll(types[source % n], -dy, axis=1)
+        out = np.zeros((len(source), n), dtype=types.dtype)
+        inside = (source >= 0) & (source < n)
+        if abs(dy) < n:
+            out[inside, max(-dy, 0):n - max(dy, 0)] = types[source[inside], max(dy, 0):n - max(-dy, 0)]
+        return out
+    if wrap:
+        return np.roll(types, (-dx, -dy), axis=(0, 1))
+    out = np.zeros_like(types)
+    if abs(dx) < n and abs(dy) < n:
+        out[max(-dx, 0):n - max(dx, 0), max(-dy, 0):n - max(dy, 0)] = \
+            types[max(dx, 0):n - max(-dx, 0), max(dy, 0):n - max(-dy, 0)]
+    return out
+
+
+def _first_hit(types, offsets, match, wrap, rows=None):
+    # distance of the first offset whose cell satisfies match(shifted), -1 where none does
+    own = types if rows is None else types[rows[0]:rows[1]]
+    found = np.full(own.shape, -1.0)
+    todo = own != 0
+    for dx, dy, dist in offsets:
+        hit = todo & match(_shifted(types, dx, dy, wrap, rows))
+        if hit.any():
+            found[hit] = dist
+            todo &= ~hit
+            if not todo.any():
+                break
+    return found
+
+
+def cell_metrics_numpy(types, offsets, k_offsets, neighbors, codes, wrap, rows=None):
+    # every cell's metrics, or with rows = (r0, r1) those of rows r0..r1 - 1
+    # (each cell's values are the same either way)
+    types = types.astype(np.intp)
+    own = types if rows is None else types[rows[0]:rows[1]]
+    nearest = _first_hit(types, offsets, lambda t: (t != 0) & (t != own), wrap, rows)
+    furthest = np.zeros(own.shape)
+    for c in codes:
+        dist = np.maximum(_first_hit(types, offsets, lambda t: t == c, wrap, rows), 0.0)
+        furthest = np.where(own == c, furthest, np.maximum(furthest, dist))
+
+    occupied = np.zeros(own.shape, dtype=np.int64)
+    diff = np.zeros(own.shape, dtype=np.int64)
+    race_counts = np.zeros((max(types.max(), max(codes)) + 1,) + own.shape, dtype=np.int64)
+    for dx, dy in k_offsets:
+        t = _shifted(types, dx, dy, wrap, rows)
+        occupied += t != 0
+        diff += (t != 0) & (t != own)
+        for c in codes:
+            race_counts[c] += t == c
+    others = np.stack([np.where(own == c, np.iinfo(np.int64).max, race_counts[c]) for c in codes])
+    rarest = others.min(axis=0)
+    safe = np.maximum(occupied, 1)
+    diversity = np.where(occupied > 0, diff / safe, 0.0)
+    least = np.where(occupied > 0, rarest / safe, 0.0)
+
+    inter = np.zeros(own.shape, dtype=np.int64)
+    total = np.zeros(own.shape, dtype=np.int64)
+    for dx, dy in neighbors:
+        t = _shifted(types, dx, dy, wrap, rows)
+        total += t != 0
+        inter += (t != 0) & (t != own)
+    return nearest, furthest, diversity, least, inter, total
+
+
+def metric_offsets(topology, K):
+    # offset tables of cell_metrics: (dx, dy, distance) nearest first, the
+    # K-neighborhood and the neighbors
+    return (np.asarray(topology.distance_offsets(), dtype=np.float64).reshape(-1, 3),
+            np.asarray(topology.k_offsets(K), dtype=np.int64).reshape(-1, 2),
+            np.asarray(topology.offsets, dtype=np.int64).reshape(-1, 2))
+
+
+def band_metrics(types, offsets, k_offsets, neighbors, codes, wrap, rows=None, use_numba=HAVE_NUMBA):
+    # cell_metrics over metric_offsets tables, of every row or of rows = (r0, r1)
+    codes = np.asarray(codes, dtype=np.int64)
+    if use_numba:
+        r0, r1 = rows if rows is not None else (0, types.shape[0])
+        return cell_metrics_loops(types.astype(np.int64), offsets, k_offsets, neighbors, codes, wrap, r0, r1)
+    return cell_metrics_numpy(types, offsets, k_offsets, neighbors, codes, wrap, rows)
+
+
+def cell_metrics(types, topology, K, codes, use_numba=HAVE_NUMBA):
+    return band_metrics(types, *metric_offsets(topology, K), codes, topology.wrap, use_numba=use_numba)
+
+
+# Hop-distance kernels for graphs (graph.py), on CSR adjacency.
+
+def _expand(indptr, indices, nodes):
+    # (position in nodes, neighbor) for every neighbor of every node in nodes
+    degree = indptr[nodes + 1] - indptr[nodes]
+    owner = np.repeat(np.arange(len(nodes)), degree)
+    starts = np.repeat(indptr[nodes] - np.cumsum(degree) + degree, degree)
+    return owner, indices[starts + np.arange(len(owner))]
+
+
+def bfs_distances(indptr, indices, sources):
+    # hops from the nearest of sources to every node, -1 where unreachable
+    dist = np.full(len(indptr) - 1, -1, dtype=np.int64)
+    frontier = np.unique(np.asarray(sources, dtype=np.int64))
+    dist[frontier] = 0
+    hops = 0
+    while len(frontier):
+        hops += 1
+        _, reached = _expand(indptr, indices, frontier)
+        frontier = np.unique(reached[dist[reached] < 0])
+        dist[frontier] = hops
+    return dist
+
+
+@jit
+def k_hop_counts_loops(indptr, indices, types, K, num_types):
+    # counts[v, t] = type-t nodes within K hops of v, v itself excluded
+    n = types.shape[0]
+    counts = np.zeros((n, num_types), dtype=np.int64)
+    seen = np.full(n, -1, dtype=np.int64)
+    frontier = np.empty(n, dtype=np.int64)
+    following = np.empty(n, dtype=np.int64)
+    for v in range(n):
+        seen[v] = v
+        frontier[0] = v
+        size = 1
+        for hop in range(K):
+            next_size = 0
+            for f in range(size):
+                u = frontier[f]
+                for k in range(indptr[u], indptr[u + 1]):
+                    w = indices[k]
+                    if seen[w] != v:
+                        seen[w] = v
+                        counts[v, types[w]] += 1
+                        following[next_size] = w
+                        next_size += 1
+            frontier, following = following, frontier
+            size = next_size
+    return counts
+
+
+def k_hop_counts_numpy(indptr, indices, types, K, num_types, batch=4096):
+    # k_hop_counts_loops as a breadth-first search from batch nodes at a time,
+    # over (source, node) pairs encoded as source * n + node
+    n = len(types)
+    counts = np.zeros((n, num_types), dtype=np.int64)
+    for s0 in range(0, n, batch):
+        sources = np.arange(s0, min(s0 + batch, n), dtype=np.int64)
+        visited = sources * n + sources
+        frontier_src, frontier = sources, sources
+        for hop in range(K):
+            owner, reached = _expand(indptr, indices, frontier)
+            keys = np.unique(frontier_src[owner] * n + reached)
+            keys = keys[~np.isin(keys, visited, assume_unique=True)]
+            if not len(keys):
+                break
+            visited = np.union1d(visited, keys)
+            frontier_src, frontier = np.divmod(keys, n)
+        src, node = np.divmod(visited, n)
+        keep = src != node
+        np.add.at(counts, (src[keep], types[node[keep]].astype(np.intp)), 1)
+    return counts
+
+
+def k_hop_counts(indptr, indices, types, K, num_types, use_numba=HAVE_NUMBA):
+    if use_numba:
+        return k_hop_counts_loops(indptr, indices, types.astype(np.int64), K, num_types)
+    return k_hop_counts_numpy(indptr, indices, types, K, num_types)
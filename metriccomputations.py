@@ -1,3 +1,12 @@
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import kernels
+import profiling
+from topology import get_topology
+
 VACANT = 'vacant'
 def calculate_multiracial_edge_fractions(g,races):
     grid = g.grid
@@ -34,30 +43,28 @@ def calculate_multiracial_edge_fractions(g,races):
     
     return fractions
 
+def topology_of(g):
+    # the topology.Topology metrics use for g; objects without one (such as
+    # trajectory snapshots of old recordings) get Grid's default
+    topo = getattr(g, "topology", None)
+    return topo if topo is not None else get_topology(g.N, "bounded")
+
 def compute_metrics(g,races,K):
+    # One fused pass over the occupied cells; while a profiling.Profiler is
+    # running each metric is its own pass instead, so that it can time them
+    # separately (see profiling.py). Both give the same sums.
+    if hasattr(g, "adjacency"):
+        return graph_metrics(g, races, K)
+    prof = profiling.active
+    if prof is not None:
+        t = prof.begin()
     grid = g.grid
     GRID_SIZE = g.N
-    #Compute k-neighborhood offsets
-    k_neighborhood = []
-    for dx in range(-K, K+1):
-        for dy in range(-K, K+1):
-            if dx == 0 and dy == 0:
-                continue
-            distance = (dx**2 + dy**2)**0.5
-            if distance <= K:
-                k_neighborhood.append((dx, dy))
-
-    # Compute sorted offsets for nearest neighbor distances
-    sorted_dxdy_dist = []
-    for dx in range(-GRID_SIZE//2, GRID_SIZE//2 + 1):
-        for dy in range(-GRID_SIZE//2, GRID_SIZE//2 + 1):
-            if dx == 0 and dy == 0:
-                continue
-            min_dx = min(abs(dx), GRID_SIZE - abs(dx))
-            min_dy = min(abs(dy), GRID_SIZE - abs(dy))
-            distance = (min_dx**2 + min_dy**2)**0.5
-            sorted_dxdy_dist.append((dx, dy, distance))
-    sorted_dxdy_dist.sort(key=lambda x: x[2])
+    # K-neighborhood offsets and the sorted offsets for nearest neighbor
+    # distances come from the grid's topology
+    topo = topology_of(g)
+    k_neighborhood = topo.k_offsets(K)
+    sorted_dxdy_dist = topo.distance_offsets()
 
     race_data = {}
     for race in races:
@@ -70,95 +77,165 @@ def compute_metrics(g,races,K):
                            'leastracediv_sum': 0,
                            'leastracediv_count':0
                            }
-    
-    
-    for x in range(GRID_SIZE):
-        for y in range(GRID_SIZE):
-            current_race = grid[x][y]
-            if current_race == VACANT:
-                continue
 
-            # Calculate nearest different race distance
+    occupied = [(x, y, grid[x][y]) for x in range(GRID_SIZE) for y in range(GRID_SIZE) if grid[x][y] != VACANT]
+    if prof is not None:
+        t = prof.lap("metrics.setup", t)
+    if getattr(g, "backend", "python") != "python":
+        return _kernel_metrics(g, races, occupied, topo, K)
+
+    if prof is None:
+        _fused_pass(grid, GRID_SIZE, topo.wrap, races, race_data, occupied, sorted_dxdy_dist, k_neighborhood)
+    else:
+        # Calculate nearest different race distance
+        for x, y, current_race in occupied:
             min_distance = None
             for dx, dy, dist in sorted_dxdy_dist:
-                nx = (x + dx) % GRID_SIZE
-                ny = (y + dy) % GRID_SIZE
-                neighbor_race = grid[nx][ny]
+                cell = topo.shift(x, y, dx, dy)
+                if cell is None:
+                    continue
+                neighbor_race = grid[cell[0]][cell[1]]
                 if neighbor_race != VACANT and neighbor_race != current_race:
                     min_distance = dist
                     break
+            if min_distance is not None:
+                race_data[current_race]['distance_sum'] += min_distance
+                race_data[current_race]['distance_count'] += 1
+        t = prof.lap("metrics.nearest_distance", t)
 
-            #Calculate nearest member of furthest away race
+        #Calculate nearest member of furthest away race
+        for x, y, current_race in occupied:
             racedists = {}
             for target_race in races:
                 if(target_race != current_race):
                     racedists[target_race] = 0
                     for dx, dy, dist in sorted_dxdy_dist:
-                        nx = (x + dx) % GRID_SIZE
-                        ny = (y + dy) % GRID_SIZE
-                        neighbor_race = grid[nx][ny]
+                        cell = topo.shift(x, y, dx, dy)
+                        if cell is None:
+                            continue
+                        neighbor_race = grid[cell[0]][cell[1]]
                         if neighbor_race != VACANT and neighbor_race == target_race:
                             racedists[target_race] = dist
                             break
             furthestracedist = max(racedists.values())
+            if furthestracedist is not None:
+                race_data[current_race]['furthestracedist_sum'] += furthestracedist
+                race_data[current_race]['furthestracedist_count'] += 1
+        t = prof.lap("metrics.furthest_race", t)
 
-            # Calculate K-radius diversity
+        # Calculate K-radius diversity
+        for x, y, current_race in occupied:
             diff_count = 0
             total_count = 0
             for dx, dy in k_neighborhood:
-                nx = (x + dx) % GRID_SIZE
-                ny = (y + dy) % GRID_SIZE
-                neighbor_race = grid[nx][ny]
+                cell = topo.shift(x, y, dx, dy)
+                if cell is None:
+                    continue
+                neighbor_race = grid[cell[0]][cell[1]]
                 if neighbor_race != VACANT:
                     total_count += 1
                     if neighbor_race != current_race:
                         diff_count += 1
-            
-            # Calculate K-radius leastrace diversity
+            if(total_count > 0):
+                fraction = diff_count / total_count
+            else: 
+                fraction = 0
+            race_data[current_race]['diversity_sum'] += fraction
+            race_data[current_race]['diversity_count'] += 1
+        t = prof.lap("metrics.k_diversity", t)
+
+        # Calculate K-radius leastrace diversity
+        for x, y, current_race in occupied:
             total_count = 0
             racetotals = {}
             for race in races:
                 if(race != current_race):
                     racetotals[race] = 0
             for dx, dy in k_neighborhood:
-                nx = (x + dx) % GRID_SIZE
-                ny = (y + dy) % GRID_SIZE
-                neighbor_race = grid[nx][ny]
+                cell = topo.shift(x, y, dx, dy)
+                if cell is None:
+                    continue
+                neighbor_race = grid[cell[0]][cell[1]]
                 if neighbor_race != VACANT:
                     total_count += 1
                     if neighbor_race != current_race:
                         racetotals[neighbor_race] += 1
             leastracetotal = min(racetotals.values())
-            #print(racetotals.keys())
-            #print(racetotals.values())
-
-            # Update race data
-            if min_distance is not None:
-                race_data[current_race]['distance_sum'] += min_distance
-                race_data[current_race]['distance_count'] += 1
-                
-        
-            if(total_count > 0):
-                fraction = diff_count / total_count
-            else: 
-                fraction = 0
-            race_data[current_race]['diversity_sum'] += fraction
-            race_data[current_race]['diversity_count'] += 1
-
-            if furthestracedist is not None:
-                race_data[current_race]['furthestracedist_sum'] += furthestracedist
-                race_data[current_race]['furthestracedist_count'] += 1
             if(total_count > 0):
                 fraction = leastracetotal / total_count
             else:
                 fraction = 0
-                #print(leastracetotal)
-                #print(total_count)
-                #print('PROBLEM!')
             race_data[current_race]['leastracediv_sum'] += fraction
             race_data[current_race]['leastracediv_count'] += 1
+        t = prof.lap("metrics.least_race", t)
+
+    metrics = averages(races, race_data)
+    
+    # Add edge fractions
+    edge_fractions = calculate_multiracial_edge_fractions(g,races)
+    for race in races:
+        metrics[race]['edge_fraction'] = edge_fractions[race]
+    if prof is not None:
+        prof.lap("metrics.edge_fractions", t)
+        prof.count("metrics.calls")
+        prof.count("metrics.cells", len(occupied))
+    
+    return metrics
+
+def _fused_pass(grid, N, wrap, races, race_data, occupied, sorted_dxdy_dist, k_neighborhood):
+    # the four per-cell metrics of compute_metrics in one pass, with the
+    # topology's shift inlined: a single walk of the sorted offsets finds the
+    # nearest agent of another race and the nearest member of every other
+    # race, a single walk of the K-neighborhood counts every race
+    for x, y, current_race in occupied:
+        targets = [race for race in races if race != current_race]
+        racedists = dict.fromkeys(targets, 0)
+        min_distance = None
+        missing = len(targets)
+        for dx, dy, dist in sorted_dxdy_dist:
+            nx, ny = x + dx, y + dy
+            if wrap:
+                nx, ny = nx % N, ny % N
+            elif not (0 <= nx < N and 0 <= ny < N):
+                continue
+            neighbor_race = grid[nx][ny]
+            if neighbor_race == VACANT or neighbor_race == current_race:
+                continue
+            if min_distance is None:
+                min_distance = dist
+            if neighbor_race in racedists and racedists[neighbor_race] == 0:
+                racedists[neighbor_race] = dist
+                missing -= 1
+                if not missing:
+                    break
+        data = race_data[current_race]
+        if min_distance is not None:
+            data['distance_sum'] += min_distance
+            data['distance_count'] += 1
+        data['furthestracedist_sum'] += max(racedists.values())
+        data['furthestracedist_count'] += 1
 
-    # Calculate averages
+        total_count = 0
+        diff_count = 0
+        racetotals = dict.fromkeys(targets, 0)
+        for dx, dy in k_neighborhood:
+            nx, ny = x + dx, y + dy
+            if wrap:
+                nx, ny = nx % N, ny % N
+            elif not (0 <= nx < N and 0 <= ny < N):
+                continue
+            neighbor_race = grid[nx][ny]
+            if neighbor_race != VACANT:
+                total_count += 1
+                if neighbor_race != current_race:
+                    diff_count += 1
+                    racetotals[neighbor_race] += 1
+        data['diversity_sum'] += diff_count / total_count if total_count > 0 else 0
+        data['diversity_count'] += 1
+        data['leastracediv_sum'] += min(racetotals.values()) / total_count if total_count > 0 else 0
+        data['leastracediv_count'] += 1
+
+def averages(races, race_data):
     metrics = {}
     for race in races:
         metrics[race] = {
@@ -167,26 +244,178 @@ def compute_metrics(g,races,K):
             'WORST_avg_distance': race_data[race]['furthestracedist_sum'] / race_data[race]['furthestracedist_count'] if race_data[race]['furthestracedist_count'] > 0 else 0,
             'WORST_diversity': race_data[race]['leastracediv_sum'] / race_data[race]['leastracediv_count'] if race_data[race]['leastracediv_count'] > 0 else 0
         }
-    
-    # Add edge fractions
-    edge_fractions = calculate_multiracial_edge_fractions(g,races)
+    return metrics
+
+def _kernel_metrics(g, races, occupied, topo, K):
+    # compute_metrics for Grids built with a kernel backend: the per-cell values
+    # come from kernels.cell_metrics and are summed per race in the same
+    # row-major order as the loops above, so the averages are identical
+    prof = profiling.active
+    if prof is not None:
+        t = prof.begin()
+    codes = [g.color_dict[race] + 1 for race in races]
+    values = kernels.cell_metrics(g.types, topo, K, codes, g.backend == "numba")
+    if prof is not None:
+        t = prof.lap("metrics.kernel", t)
+    metrics = _reduce_cells(g.types, races, codes, *values)
+    if prof is not None:
+        prof.lap("metrics.reduce", t)
+        prof.count("metrics.calls")
+        prof.count("metrics.cells", len(occupied))
+    return metrics
+
+def _reduce_cells(types, races, codes, nearest, furthest, diversity, least, inter, total):
+    # per-race averages of per-cell values, each float sum taken left to right
+    # over the race's cells in row-major order like the += of the loops above
+    race_data = {}
+    edges = {}
+    for race, c in zip(races, codes):
+        mine = types == c
+        near = nearest[mine]
+        near = near[near >= 0]
+        count = int(mine.sum())
+        race_data[race] = {'distance_sum': _sequential_sum(near), 'distance_count': len(near),
+                           'diversity_sum': _sequential_sum(diversity[mine]), 'diversity_count': count,
+                           'furthestracedist_sum': _sequential_sum(furthest[mine]), 'furthestracedist_count': count,
+                           'leastracediv_sum': _sequential_sum(least[mine]), 'leastracediv_count': count}
+        edges[race] = (int(inter[mine].sum()), int(total[mine].sum()))
+    metrics = averages(races, race_data)
     for race in races:
-        metrics[race]['edge_fraction'] = edge_fractions[race]
-    
+        interracial, total_edges = edges[race]
+        metrics[race]['edge_fraction'] = interracial / total_edges if total_edges > 0 else 0.0
+    return metrics
+
+def _band_worker(job):
+    # One row band of parallel_metrics in a worker process: reads the types
+    # and distance offsets from shared memory and writes the band's per-cell
+    # values into the shared output
+    names, N, num_offsets, k_offsets, neighbors, codes, wrap, rows, use_numba = job
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    try:
+        types = np.ndarray((N, N), dtype=np.int8, buffer=blocks[0].buf)
+        offsets = np.ndarray((num_offsets, 3), dtype=np.float64, buffer=blocks[1].buf)
+        out = np.ndarray((6, N, N), dtype=np.float64, buffer=blocks[2].buf)
+        for k, values in enumerate(kernels.band_metrics(types, offsets, k_offsets, neighbors, codes, wrap, rows, use_numba)):
+            out[k, rows[0]:rows[1]] = values
+        # the views must go before the blocks can close
+        del types, offsets, out
+    finally:
+        for block in blocks:
+            block.close()
+
+def parallel_metrics(g, races, K, workers=None, bands=None, pool=None):
+    # compute_metrics with the per-cell values computed by worker processes
+    # (pool, or a pool of workers made for the call), one task per row band
+    # (bands, 4 per worker by default). The type array and distance offsets
+    # reach the workers through shared memory, and each worker writes its
+    # band's per-cell values into a shared output array. The per-race sums are
+    # then reduced in row-major order, the order compute_metrics adds in, so
+    # the result is bit-for-bit the serial one; adding up per-worker float
+    # partial sums instead would round differently.
+    if hasattr(g, "adjacency"):
+        return graph_metrics(g, races, K)
+    from concurrent.futures import ProcessPoolExecutor
+    prof = profiling.active
+    if prof is not None:
+        t = prof.begin()
+    N = g.N
+    topo = topology_of(g)
+    offsets, k_offsets, neighbors = kernels.metric_offsets(topo, K)
+    codes = [g.color_dict[race] + 1 for race in races]
+    types = np.ascontiguousarray(g.types, dtype=np.int8)
+    workers = workers or os.cpu_count()
+    cuts = np.unique(np.linspace(0, N, min(bands or 4 * workers, N) + 1).astype(int))
+    arrays = (types, offsets, np.zeros((6, N, N)))
+    blocks = [shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1)) for a in arrays]
+    try:
+        for block, a in zip(blocks, arrays):
+            np.ndarray(a.shape, dtype=a.dtype, buffer=block.buf)[...] = a
+        names = [block.name for block in blocks]
+        jobs = [(names, N, len(offsets), k_offsets, neighbors, codes, topo.wrap, (int(r0), int(r1)),
+                 getattr(g, "backend", "python") == "numba") for r0, r1 in zip(cuts[:-1], cuts[1:])]
+        if pool is None:
+            with ProcessPoolExecutor(max_workers=workers) as own_pool:
+                list(own_pool.map(_band_worker, jobs))
+        else:
+            list(pool.map(_band_worker, jobs))
+        shared = np.ndarray((6, N, N), dtype=np.float64, buffer=blocks[2].buf)
+        values = shared.copy()
+        del shared
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    if prof is not None:
+        t = prof.lap("metrics.parallel", t)
+    metrics = _reduce_cells(types, races, codes, *values)
+    if prof is not None:
+        prof.lap("metrics.reduce", t)
+        prof.count("metrics.calls")
+    return metrics
+
+def _sequential_sum(values):
+    # left-to-right float sum, like the += accumulation of the loops above
+    return np.cumsum(values)[-1].item() if len(values) else 0
+
+def graph_metrics(g, races, K):
+    # compute_metrics for a graph.GraphModel. Distances are hops: the nearest
+    # agent of another race and the furthest race's nearest member come from a
+    # breadth-first search per race, the K-neighborhood is every node within
+    # K hops and the edge fraction counts graph edges.
+    prof = profiling.active
+    if prof is not None:
+        t = prof.begin()
+    adj = g.adjacency
+    types = g.types.astype(np.intp)
+    num_types = len(g.color_dict) + 1
+    codes = [g.color_dict[race] + 1 for race in races]
+    hops = np.stack([kernels.bfs_distances(adj.indptr, adj.indices, np.nonzero(types == c)[0])
+                     for c in range(1, num_types)]).astype(np.float64)
+    own = types[None, :] == np.arange(1, num_types)[:, None]
+    reachable = np.where(own | (hops < 0), np.inf, hops)
+    nearest = reachable.min(axis=0)
+    asked = np.isin(np.arange(1, num_types), codes)[:, None]
+    furthest = np.where(own | (hops < 0) | ~asked, 0.0, hops).max(axis=0)
+    if prof is not None:
+        t = prof.lap("metrics.distances", t)
+
+    ball = kernels.k_hop_counts(adj.indptr, adj.indices, types, K, num_types, g.backend == "numba")
+    occupied = ball[:, 1:].sum(axis=1)
+    nodes = np.arange(len(types))
+    others = np.where(np.arange(num_types)[None, :] == types[:, None], np.iinfo(np.int64).max, ball)[:, codes]
+    safe = np.maximum(occupied, 1)
+    diversity = np.where(occupied > 0, (occupied - ball[nodes, types]) / safe, 0.0)
+    least = np.where(occupied > 0, others.min(axis=1) / safe, 0.0)
+    if prof is not None:
+        t = prof.lap("metrics.k_neighborhood", t)
+
+    total = g.counts[1:].sum(axis=0).astype(np.int64)
+    inter = total - g.counts[types, nodes]
+    race_data = {}
+    edges = {}
+    for race, c in zip(races, codes):
+        mine = types == c
+        near = nearest[mine]
+        near = near[np.isfinite(near)]
+        count = int(mine.sum())
+        race_data[race] = {'distance_sum': _sequential_sum(near), 'distance_count': len(near),
+                           'diversity_sum': _sequential_sum(diversity[mine]), 'diversity_count': count,
+                           'furthestracedist_sum': _sequential_sum(furthest[mine]), 'furthestracedist_count': count,
+                           'leastracediv_sum': _sequential_sum(least[mine]), 'leastracediv_count': count}
+        edges[race] = (int(inter[mine].sum()), int(total[mine].sum()))
+    metrics = averages(races, race_data)
+    for race in races:
+        interracial, total_edges = edges[race]
+        metrics[race]['edge_fraction'] = interracial / total_edges if total_edges > 0 else 0.0
+    if prof is not None:
+        prof.lap("metrics.reduce", t)
+        prof.count("metrics.calls")
     return metrics
 
 # Original simulation functions
 def get_neighbors(x, y, g):
     grid = g.grid
-    GRID_SIZE = g.N
-    neighbors = []
-    for dx in [-1, 0, 1]:
-        for dy in [-1, 0, 1]:
-            if dx == 0 and dy == 0:
-                continue
-            nx, ny = (x + dx) % GRID_SIZE, (y + dy) % GRID_SIZE
-            neighbors.append(grid[nx][ny])
-    return neighbors
+    return [grid[i][j] for i, j in topology_of(g).cells[x * g.N + y]]
 
 def bothoccupied(edge):
     return (edge[0] != VACANT) and (edge[1] != VACANT)
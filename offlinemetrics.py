@@ -0,0 +1,83 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import metriccomputations
+from trajectory import Trajectory
+
+# Computes metriccomputations.compute_metrics time series from a recorded
+# trajectory (see trajectory.py) outside of the simulation loop. The requested
+# steps are split into contiguous chunks, one per worker process; each worker
+# rebuilds its first grid from the nearest keyframe and rolls forward.
+
+METRICS = ['avg_distance', 'diversity', 'WORST_avg_distance', 'WORST_diversity', 'edge_fraction']
+
+
+def _metrics_for_steps(path, races, K, steps):
+    traj = Trajectory(path)
+    rows = []
+    for step, snap in traj.replay(steps):
+        metrics = metriccomputations.compute_metrics(snap, races, K)
+        for race in races:
+            rows.append((step, race, [metrics[race][m] for m in METRICS]))
+    return rows
+
+
+def split_steps(steps, workers):
+    steps = sorted(set(steps))
+    size = -(-len(steps) // workers) if steps else 0
+    return [steps[i:i + size] for i in range(0, len(steps), size)] if size else []
+
+
+def compute_metric_series(path, K, steps=None, every=1, races=None, workers=None):
+    # Returns a columnar dict: 'step', 'race' and one float array per metric,
+    # with one row per (step, race).
+    traj = Trajectory(path)
+    if races is None:
+        races = traj.races
+    if steps is None:
+        steps = list(range(0, traj.num_steps + 1, every))
+        if steps[-1] != traj.num_steps:
+            steps.append(traj.num_steps)
+    if workers is None:
+        workers = 1
+    chunks = split_steps(steps, workers)
+
+    rows = []
+    if workers == 1:
+        for chunk in chunks:
+            rows.extend(_metrics_for_steps(path, races, K, chunk))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_metrics_for_steps, path, races, K, chunk) for chunk in chunks]
+            for f in futures:
+                rows.extend(f.result())
+
+    series = {
+        'step': np.array([r[0] for r in rows], dtype=np.int64),
+        'race': np.array([r[1] for r in rows]),
+    }
+    values = np.array([r[2] for r in rows], dtype=np.float64).reshape(-1, len(METRICS))
+    for idx, m in enumerate(METRICS):
+        series[m] = values[:, idx]
+    return series
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute metric time series from a recorded trajectory")
+    parser.add_argument("trajectory")
+    parser.add_argument("--K", type=int, default=5)
+    parser.add_argument("--every", type=int, default=1, help="compute metrics every this many steps")
+    parser.add_argument("--steps", type=int, nargs="*", help="explicit steps (overrides --every)")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--out", default="metric_series.npz")
+    args = parser.parse_args()
+
+    series = compute_metric_series(args.trajectory, args.K, steps=args.steps, every=args.every, workers=args.workers)
+    np.savez(args.out, **series)
+    print(f"Wrote {len(series['step'])} rows to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import itertools
+import json
+
+import numpy as np
+
+import runner
+import sweepmanifest
+from tipping import PARAMETERS, SCRIPT_DEFAULTS, script_config
+
+# Phase diagrams of the equilibrium metrics of zhang-segregation-threshold.py's
+# model (tipping.script_config: its preferences and vacancy-only dynamics)
+# over two or three of its parameters (ALPHA, BETA, PREFERENCE), refined
+# where a metric changes sharply instead of sampled uniformly.
+#
+# Parameter points sit on an integer lattice: axis k runs from lo to hi in
+# (coarse - 1) * 2**max_depth steps, so every refinement level lands on
+# lattice points and a point is run once however many cells share it. The
+# diagram starts from coarse cells of 2**max_depth steps per side and splits
+# a cell into its 2**d children (quadtree in 2-D, octree in 3-D) while the
+# refinement metric differs by more than threshold across its corners and
+# it is larger than one step. Each point's runs are replicas seeded
+# seed..seed + replicas - 1, run in a worker pool through the sweep cache
+# (sweepmanifest.run_cached), so rebuilding or extending a diagram only runs
+# the points that are new.
+#
+# Every point stores the replica mean of every result column, averaged over
+# the races ("K_div") and per race ("K_div:orange"). value() interpolates
+# multilinearly inside the leaf cell holding a parameter point, grid() samples
+# that on a uniform lattice, and save / load_diagram keep a diagram as .npz.
+
+
+def metric_names(races):
+    return [column + suffix for column in runner.METRIC_COLUMNS for suffix in [""] + [f":{r}" for r in races]]
+
+
+def row_metrics(rows, races):
+    # metric name -> value for one job's cached result columns
+    values = {}
+    for column in runner.METRIC_COLUMNS:
+        per_race = {str(r): float(v) for r, v in zip(rows["race"], rows[column])}
+        values[column] = sum(per_race[r] for r in races) / len(races)
+        for r in races:
+            values[f"{column}:{r}"] = per_race[r]
+    return values
+
+
+class PhaseDiagram:
+    def __init__(self, axes, metric="K_div", base=None, coarse=5, max_depth=3, threshold=0.05, replicas=2, seed=0,
+                 cache_dir=sweepmanifest.CACHE_DIR):
+        # axes: parameter -> (lo, hi) for two or three of tipping.PARAMETERS;
+        # base: values of the other parameters and the script_config options
+        if not 2 <= len(axes) <= 3 or any(name not in PARAMETERS for name in axes):
+            raise ValueError(f"Phase diagram axes must be two or three of {PARAMETERS}")
+        self.axes = {name: tuple(map(float, span)) for name, span in axes.items()}
+        self.names = list(self.axes)
+        self.metric = metric
+        self.base = dict(SCRIPT_DEFAULTS, **(base or {}))
+        self.coarse = coarse
+        self.max_depth = max_depth
+        self.threshold = threshold
+        self.replicas = replicas
+        self.seed = seed
+        self.cache_dir = cache_dir
+        self.steps = (coarse - 1) * 2 ** max_depth
+        self.races = list(script_config(**self._params((0,) * len(self.names)))["colors"])
+        if metric not in metric_names(self.races):
+            raise ValueError(f"Unknown metric {metric}")
+        # lattice point -> {metric name: replica mean}
+        self.points = {}
+        # leaf cells as (lowest corner, side) in lattice steps
+        self.leaves = set()
+
+    def _params(self, point):
+        params = dict(self.base)
+        for name, k in zip(self.names, point):
+            lo, hi = self.axes[name]
+            params[name] = lo + (hi - lo) * k / self.steps
+        return params
+
+    def _jobs(self, point):
+        jobs = []
+        for r in range(self.replicas):
+            config = sweepmanifest.normalize(script_config(**self._params(point), seed=self.seed + r))
+            jobs.append((sweepmanifest.job_key(config), config, {}))
+        return jobs
+
+    def _evaluate(self, points, pool):
+        points = [p for p in points if p not in self.points]
+        jobs = {p: self._jobs(p) for p in points}
+        sweepmanifest.run_cached([job for p in points for job in jobs[p]], cache_dir=self.cache_dir, pool=pool)
+        for p in points:
+            runs = [row_metrics(sweepmanifest.load_job(key, self.cache_dir), self.races) for key, _, _ in jobs[p]]
+            self.points[p] = {name: sum(run[name] for run in runs) / len(runs) for name in runs[0]}
+
+    def _corners(self, cell):
+        corner, side = cell
+        return [tuple(c + side * bit for c, bit in zip(corner, bits))
+                for bits in itertools.product((0, 1), repeat=len(corner))]
+
+    def _sharp(self, cell):
+        values = [self.points[p][self.metric] for p in self._corners(cell)]
+        return max(values) - min(values) > self.threshold
+
+    def build(self, workers=None):
+        # Runs the coarse lattice and refines it; returns the number of points
+        from concurrent.futures import ProcessPoolExecutor
+        side = 2 ** self.max_depth
+        pending = [(corner, side) for corner in itertools.product(range(0, self.steps, side), repeat=len(self.names))]
+        self.leaves = set()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while pending:
+                self._evaluate({p for cell in pending for p in self._corners(cell)}, pool)
+                split = []
+                for cell in pending:
+                    corner, side = cell
+                    if side > 1 and self._sharp(cell):
+                        half = side // 2
+                        split.extend((tuple(c + half * bit for c, bit in zip(corner, bits)), half)
+                                     for bits in itertools.product((0, 1), repeat=len(corner)))
+                    else:
+                        self.leaves.add(cell)
+                pending = split
+        return len(self.points)
+
+    def _lattice(self, params):
+        # parameter values -> fractional lattice coordinates
+        coords = []
+        for name in self.names:
+            lo, hi = self.axes[name]
+            x = (params[name] - lo) / (hi - lo) * self.steps
+            if not 0 <= x <= self.steps:
+                raise ValueError(f"{name}={params[name]} is outside the diagram")
+            coords.append(x)
+        return coords
+
+    def leaf(self, **params):
+        # the leaf cell holding a parameter point
+        coords = self._lattice(params)
+        side = 2 ** self.max_depth
+        while True:
+            corner = tuple(min(int(x // side) * side, self.steps - side) for x in coords)
+            if (corner, side) in self.leaves or side == 1:
+                return corner, side
+            side //= 2
+
+    def value(self, metric=None, **params):
+        # metric at a parameter point, interpolated inside its leaf cell
+        metric = metric or self.metric
+        coords = self._lattice(params)
+        corner, side = self.leaf(**params)
+        t = [(x - c) / side for x, c in zip(coords, corner)]
+        total = 0.0
+        for bits in itertools.product((0, 1), repeat=len(corner)):
+            weight = np.prod([f if bit else 1 - f for f, bit in zip(t, bits)])
+            if weight:
+                point = tuple(c + side * bit for c, bit in zip(corner, bits))
+                total += weight * self.points[point][metric]
+        return total
+
+    def grid(self, resolution=101, metric=None):
+        # (axis values, array of value() over the uniform lattice of those values)
+        values = [np.linspace(*self.axes[name], resolution) for name in self.names]
+        out = np.zeros((resolution,) * len(self.names))
+        for index in itertools.product(range(resolution), repeat=len(self.names)):
+            out[index] = self.value(metric, **{name: values[k][i] for k, (name, i) in enumerate(zip(self.names, index))})
+        return values, out
+
+    def save(self, path):
+        points = sorted(self.points)
+        names = metric_names(self.races)
+        leaves = sorted(self.leaves)
+        settings = {"axes": self.axes, "metric": self.metric, "base": self.base, "coarse": self.coarse,
+                    "max_depth": self.max_depth, "threshold": self.threshold, "replicas": self.replicas,
+                    "seed": self.seed, "cache_dir": self.cache_dir}
+        np.savez_compressed(path, settings=json.dumps(settings), metrics=np.array(names),
+                            points=np.array(points, dtype=np.int64).reshape(-1, len(self.names)),
+                            values=np.array([[self.points[p][n] for n in names] for p in points]).reshape(-1, len(names)),
+                            leaf_corners=np.array([c for c, _ in leaves], dtype=np.int64).reshape(-1, len(self.names)),
+                            leaf_sides=np.array([s for _, s in leaves], dtype=np.int64))
+
+
+def load_diagram(path):
+    with np.load(path) as data:
+        settings = json.loads(str(data["settings"]))
+        diagram = PhaseDiagram(**settings)
+        names = [str(n) for n in data["metrics"]]
+        for point, row in zip(data["points"], data["values"]):
+            diagram.points[tuple(int(k) for k in point)] = dict(zip(names, row.tolist()))
+        diagram.leaves = {(tuple(int(k) for k in c), int(s)) for c, s in zip(data["leaf_corners"], data["leaf_sides"])}
+    return diagram
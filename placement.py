@@ -0,0 +1,124 @@
+import random
+
+import numpy as np
+
+# Initial placements for Grid: an N x N int8 board of type codes (0 = vacant,
+# race index + 1) drawn straight into the array. counts[r] is the number of
+# agents with code r + 1; every other cell is vacant.
+#   shuffle   the original placement: random.shuffle of the cell list, so a
+#             given random.seed gives the same board as it always did
+#             (O(N^2) in Python; Grid's default)
+#   uniform   a uniform random permutation drawn by NumPy
+#   blocks    vacancies uniform at random, agents filled block by block
+#             (size x size blocks in random order), each race in one run of
+#             blocks: a pre-clustered start
+#   stripes   vacancies uniform at random, agents filled stripe by stripe
+#             (width columns each, or rows with axis=0), the races taking
+#             stripes in turn
+#   array     a given board of codes
+#   image     an N x N image, each pixel the code of the nearest palette color
+# The random kinds take a numpy Generator, which Grid seeds from the random
+# module, so random.seed fixes every start.
+
+KINDS = ("shuffle", "uniform", "blocks", "stripes", "array", "image")
+
+
+def _codes(counts):
+    return np.repeat(np.arange(1, len(counts) + 1, dtype=np.int8), counts)
+
+
+def _vacancies(N, counts, rng):
+    cells = N * N
+    if sum(counts) > cells:
+        raise ValueError("There are no vacant cells!")
+    return np.sort(rng.choice(cells, cells - sum(counts), replace=False))
+
+
+def shuffle(N, counts):
+    cells = _codes(counts).tolist() + [0] * (N * N - sum(counts))
+    random.shuffle(cells)
+    return np.array(cells, dtype=np.int8).reshape(N, N)
+
+
+def uniform(N, counts, rng):
+    cells = np.zeros(N * N, dtype=np.int8)
+    cells[:sum(counts)] = _codes(counts)
+    return rng.permutation(cells).reshape(N, N)
+
+
+def _fill(N, counts, rng, order):
+    # vacancies at random, then agents in race order along the cells sorted by order
+    types = np.zeros(N * N, dtype=np.int8)
+    occupied = np.ones(N * N, dtype=bool)
+    occupied[_vacancies(N, counts, rng)] = False
+    cells = np.flatnonzero(occupied)
+    return cells[np.argsort(order[cells], kind="stable")], types
+
+
+def blocks(N, counts, rng, size=5):
+    i, j = np.divmod(np.arange(N * N), N)
+    per_row = -(-N // size)
+    block = (i // size) * per_row + j // size
+    rank = np.empty(per_row * per_row, dtype=np.int64)
+    rank[rng.permutation(per_row * per_row)] = np.arange(per_row * per_row)
+    cells, types = _fill(N, counts, rng, rank[block])
+    types[cells] = _codes(counts)
+    return types.reshape(N, N)
+
+
+def stripes(N, counts, rng, width=1, axis=1):
+    i, j = np.divmod(np.arange(N * N), N)
+    stripe = (j if axis == 1 else i) // width
+    cells, types = _fill(N, counts, rng, stripe * N * N + np.arange(N * N))
+    lengths = np.bincount(stripe[cells])
+    remaining = list(counts)
+    sequence = np.empty(len(cells), dtype=np.int8)
+    pos, r = 0, 0
+    for length in lengths:
+        end = pos + length
+        while pos < end:
+            while remaining[r] == 0:
+                r = (r + 1) % len(counts)
+            take = min(end - pos, remaining[r])
+            sequence[pos:pos + take] = r + 1
+            remaining[r] -= take
+            pos += take
+        r = (r + 1) % len(counts)
+    types[cells] = sequence
+    return types.reshape(N, N)
+
+
+def array(N, counts, types):
+    types = np.asarray(types, dtype=np.int8)
+    if types.shape != (N, N):
+        raise ValueError(f"Start array has shape {types.shape}, expected {(N, N)}")
+    found = np.bincount(types.ravel(), minlength=len(counts) + 1)[1:]
+    if found.tolist() != list(counts):
+        raise ValueError(f"Start array has {found.tolist()} agents per race, expected {list(counts)}")
+    return types.copy()
+
+
+def image(N, counts, path, palette):
+    # palette: RGB per code, as from zhang.palette
+    import matplotlib.image
+    pixels = matplotlib.image.imread(path)[..., :3].astype(float)
+    if pixels.max() <= 1.0:
+        pixels = pixels * 255
+    colors = np.asarray(palette, dtype=float)
+    distance = ((pixels[:, :, None, :] - colors[None, None, :, :]) ** 2).sum(axis=-1)
+    return array(N, counts, distance.argmin(axis=-1))
+
+
+def place(start, N, counts):
+    # start is a kind name or a dict {"kind": name, **options}; random kinds
+    # draw their generator's seed from the random module
+    spec = {"kind": start} if isinstance(start, str) else dict(start)
+    kind = spec.pop("kind")
+    if kind not in KINDS:
+        raise ValueError(f"Unknown start {kind}")
+    if kind == "shuffle":
+        return shuffle(N, counts)
+    if kind in ("array", "image"):
+        return globals()[kind](N, counts, **spec)
+    rng = np.random.default_rng(random.getrandbits(64))
+    return globals()[kind](N, counts, rng, **spec)
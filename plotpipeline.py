@@ -0,0 +1,124 @@
+import os
+import pickle
+import sys
+
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.colors as mcolors
+
+import resultsstore
+
+# Batch plotting for the experiment results.
+# Each experiment's results are loaded once, reduced to a per (parameter, race)
+# table of mean/std/95% CI over replicas with a pandas groupby, and every metric
+# figure is rendered from that table. The aggregated table is cached next to
+# the inputs and reused until the results change.
+
+METRICS = ["avg_dist", "K_div", "multi_racial_fraction", "dist_to_furthest", "fraction_of_rarest"]
+
+CACHE_DIR = ".plotcache"
+
+EXPERIMENTS = {
+    "experiment1": {
+        "source": "./results1",
+        "param": "num_orange",
+        "races": None,   # every race in the data
+        "colors": list(mcolors.TABLEAU_COLORS.keys()),
+        "label": "{}",
+    },
+    "experiment2": {
+        "source": "./results2",
+        "param": "num_of_races",
+        "races": ["white", "black"],
+        "colors": ["r", "b"],
+        "label": "{} agents",
+    },
+}
+
+
+def _source_path(source):
+    # columnar store written by the experiments, falling back to the old CSV
+    return source if os.path.isdir(source) else source + ".csv"
+
+
+def _signature(path):
+    if os.path.isdir(path):
+        files = resultsstore.list_parts(path)
+    else:
+        files = [path]
+    return [(f, os.path.getsize(f), os.path.getmtime(f)) for f in files]
+
+
+def aggregate(df, param, metrics=METRICS):
+    grouped = df.groupby([param, "race"], sort=True)[metrics]
+    mean = grouped.mean()
+    std = grouped.std(ddof=1).fillna(0.0)
+    n = grouped.size()
+    ci = std.mul(1.96 / np.sqrt(n), axis=0)
+    table = pd.concat({"mean": mean, "std": std, "ci": ci}, axis=1)
+    table["n"] = n
+    return table
+
+
+def load_aggregated(name, spec=None):
+    spec = spec or EXPERIMENTS[name]
+    path = _source_path(spec["source"])
+    signature = _signature(path)
+    cache_file = os.path.join(CACHE_DIR, f"{name}.pkl")
+    if os.path.exists(cache_file):
+        with open(cache_file, "rb") as f:
+            cached = pickle.load(f)
+        if cached["signature"] == signature:
+            return cached["table"]
+
+    columns = [spec["param"], "race"] + METRICS
+    df = pd.DataFrame(resultsstore.load_results(path, columns=columns))
+    table = aggregate(df, spec["param"])
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(cache_file, "wb") as f:
+        pickle.dump({"signature": signature, "table": table}, f)
+    return table
+
+
+def render_experiment(name, spec=None, outdir="."):
+    spec = spec or EXPERIMENTS[name]
+    table = load_aggregated(name, spec)
+    races = spec["races"]
+    if races is None:
+        races = list(dict.fromkeys(table.index.get_level_values("race")))
+
+    matplotlib.rcParams.update({'font.size': 18})
+    paths = []
+    for metric in METRICS:
+        fig, ax = plt.subplots()
+        for idx, race in enumerate(races):
+            rows = table.xs(race, level="race")
+            x = rows.index.values
+            mean = rows[("mean", metric)].values
+            ci = rows[("ci", metric)].values
+            color = spec["colors"][idx % len(spec["colors"])]
+            ax.plot(x, mean, label=spec["label"].format(race), color=color, marker='o', linestyle='-', markersize=4, linewidth=0.8)
+            if (rows["n"] > 1).any():
+                ax.fill_between(x, mean - ci, mean + ci, color=color, alpha=0.2, linewidth=0)
+        fig.tight_layout()
+        ax.legend(loc="upper right")
+        path = os.path.join(outdir, f"plot_{name}_{metric}.png")
+        fig.savefig(path)
+        plt.close(fig)
+        paths.append(path)
+    return paths
+
+
+def render_all(names=None, outdir="."):
+    paths = []
+    for name in names or EXPERIMENTS:
+        paths.extend(render_experiment(name, outdir=outdir))
+    return paths
+
+
+if __name__ == '__main__':
+    for path in render_all(sys.argv[1:] or None):
+        print(path)
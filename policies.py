@@ -0,0 +1,134 @@
+import random
+
+import numpy as np
+
+# Move-selection policies: which improving move a step applies. Candidates
+# (delta, u_old, u_new, p, q) are offered one at a time in scan order (pairs
+# of flat cells p < q, see Grid.improving_move_then_swap) and each policy
+# keeps O(1) state instead of a list of every improving pair:
+#   best     the largest delta, ties to the first in scan order (the model's
+#            rule, and what the scan always did)
+#   first    the first improving pair; the scan stops there
+#   random   a uniform improving pair by reservoir sampling
+#   sampled  the best of SAMPLE_K random pairs; when none of them improves,
+#            the first improving pair of a full scan, so a run still stops
+#            only at equilibrium
+#   vacancy  the dynamics of zhang-segregation-threshold.py: agents only move
+#            into vacancies (no trades), every agent is tried in every
+#            vacancy (no scan window), and the largest delta wins, ties to
+#            the first agent and then the first vacancy in row-major order.
+#            Candidates are offered as (agent, vacancy) instead of p < q.
+# random and sampled draw from a numpy Generator seeded when the policy is
+# made, so runs are reproducible and the same on every backend.
+
+# pairs drawn per step by the sampled policy
+SAMPLE_K = 64
+
+
+class Policy:
+    name = None
+    # whether offer or sample_pairs draw from rng
+    randomized = False
+
+    def __init__(self, rng=None):
+        self.rng = rng
+        self.start()
+
+    def start(self):
+        self.move = None
+        self.count = 0
+
+    def offer(self, delta, u_old, u_new, p, q):
+        # the scan stops once this returns True
+        raise NotImplementedError
+
+    def sample_pairs(self, m, width=0):
+        # pairs (p, q), p < q, to evaluate instead of the full scan, or None;
+        # with width only pairs in the scan window (see kernels.scan)
+        return None
+
+
+class BestImproving(Policy):
+    name = "best"
+
+    def offer(self, delta, u_old, u_new, p, q):
+        self.count += 1
+        if self.move is None or delta > self.move[0]:
+            self.move = (delta, u_old, u_new, p, q)
+        return False
+
+
+class FirstImproving(Policy):
+    name = "first"
+
+    def offer(self, delta, u_old, u_new, p, q):
+        self.count += 1
+        self.move = (delta, u_old, u_new, p, q)
+        return True
+
+
+class RandomImproving(Policy):
+    name = "random"
+    randomized = True
+
+    def offer(self, delta, u_old, u_new, p, q):
+        # candidate n replaces the kept one with probability 1 / n
+        self.count += 1
+        if self.rng.random() * self.count < 1.0:
+            self.move = (delta, u_old, u_new, p, q)
+        return False
+
+
+class SampledBest(BestImproving):
+    name = "sampled"
+    randomized = True
+
+    def __init__(self, rng=None, k=SAMPLE_K):
+        self.k = k
+        super().__init__(rng)
+
+    def sample_pairs(self, m, width=0):
+        pairs = np.sort(self.rng.integers(0, m, size=(self.k, 2)), axis=1)
+        if width:
+            return pairs[pairs[:, 1] % width > pairs[:, 0] % width]
+        return pairs[pairs[:, 0] != pairs[:, 1]]
+
+
+class VacancyBest(BestImproving):
+    name = "vacancy"
+
+
+POLICIES = {cls.name: cls for cls in (BestImproving, FirstImproving, RandomImproving, SampledBest, VacancyBest)}
+
+
+def get_policy(policy):
+    # a Policy from its name (or an existing Policy); randomized policies are
+    # seeded from the random module, so random.seed before building the Grid
+    # fixes them as it fixes the placement
+    if isinstance(policy, Policy):
+        return policy
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown policy {policy}")
+    cls = POLICIES[policy]
+    return cls(np.random.default_rng(random.getrandbits(64)) if cls.randomized else None)
+
+
+def kernel_select(policy, types, U, P, indptr, indices, width=0):
+    # the policy's move from the kernels.py selectors (every policy but
+    # "best", which Grid and GraphModel run through kernels.best_move or
+    # kernels.scan); returns (candidates seen, delta, u_old, u_new, p, q)
+    import kernels
+    if policy.name == "first":
+        return kernels.first_move(types, U, P, indptr, indices, width)
+    if policy.name == "random":
+        return kernels.random_move(types, U, P, indptr, indices, policy.rng, width)
+    if policy.name == "sampled":
+        pairs = policy.sample_pairs(len(types), width)
+        improves, delta, stay, move = kernels.pair_moves(types, U, P, indptr, indices, pairs[:, 0], pairs[:, 1])
+        if improves.any():
+            k = int(np.argmax(np.where(improves, delta, -np.inf)))
+            return int(improves.sum()), float(delta[k]), float(stay[k]), float(move[k]), int(pairs[k, 0]), int(pairs[k, 1])
+        return kernels.first_move(types, U, P, indptr, indices, width)
+    if policy.name == "vacancy":
+        return kernels.vacancy_move(types, U, P, indptr, indices)
+    raise ValueError(f"No kernel selection for policy {policy.name}")
@@ -1,11 +1,16 @@
 import pygame
 import random
+import numpy as np
+from renderer import MAX_WINDOW, Viewport
+from simthread import SimulationThread, handle_key, status
 
 # Constants
 FPS = 30
+# moves per second, None runs as fast as possible
+SPEED = None
 GRID_SIZE = 25
 CELL_SIZE = 20
-WIDTH = HEIGHT = GRID_SIZE * CELL_SIZE
+WIDTH = HEIGHT = min(GRID_SIZE * CELL_SIZE, MAX_WINDOW)
 PREFERENCE = 100  # homophilic preference for orange agents
 ALPHA = 0.25  # fraction of orange among white + orange
 BETA = 0.1 # fraction of vacant cells
@@ -279,26 +284,17 @@ def simulate_step(grid):
         return True
     return False
 
-def draw_grid(screen, grid):
-    for i in range(GRID_SIZE):
-        for j in range(GRID_SIZE):
-            pygame.draw.rect(screen, COLORS[grid[i][j]], 
-                           (j*CELL_SIZE, i*CELL_SIZE, CELL_SIZE, CELL_SIZE))
-
 def main():
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
     pygame.display.set_caption("Enhanced Segregation Model")
     clock = pygame.time.Clock()
+    renderer = Viewport(GRID_SIZE, [COLORS[c] for c in sorted(COLORS)], (WIDTH, HEIGHT), zoom=CELL_SIZE, grid_lines=False)
     grid = initialize_grid()
     step = 0
-    
-    running = True
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
 
+    def advance():
+        nonlocal step
         # Simulation step
         moved = simulate_step(grid)
         
@@ -317,14 +313,29 @@ def main():
             print(f"  Avg distance to nearest different race: {data['avg_distance']:.2f}")
             print(f"  K={K} neighborhood diversity: {data['diversity']:.2%}")
             print(f"  Multiracial edge fraction: {data['edge_fraction']:.2%}\n")
+        step += 1
+        return moved
+
+    # the simulation runs on its own thread; FPS only paces the display
+    sim = SimulationThread(advance, lambda: np.array(grid, dtype=np.int8), rate=SPEED)
+    sim.start()
 
-        # Drawing
-        screen.fill((0, 0, 0))
-        draw_grid(screen, grid)
-        pygame.display.flip()
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif renderer.handle_event(event):
+                pass
+            elif event.type == pygame.KEYDOWN:
+                handle_key(sim, event.key, FPS)
+
+        snapshot, _ = sim.latest()
+        pygame.display.update(renderer.draw(screen, snapshot))
+        pygame.display.set_caption(f"Enhanced Segregation Model | {status(sim, FPS)}")
         clock.tick(FPS)
-        step += 1
 
+    sim.stop()
     pygame.quit()
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+import json
+import time
+import tracemalloc
+
+# Optional per-phase instrumentation for the step and metric hot paths.
+# Instrumented code reads profiling.active once per call and only times or
+# counts anything when it is not None, so with no profiler running the hooks
+# are a single attribute lookup per call.
+#
+#   with profiling.Profiler(trace_memory=True) as prof:
+#       run(g)
+#   print(prof.report())
+
+active = None
+
+
+class Profiler:
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.timers = {}
+        self.laps = {}
+        self.counters = {}
+        self.memory_peaks = {}
+        self.memory_peak = None
+        self.wall_time = None
+        self._started = None
+
+    def start(self):
+        global active
+        if self.trace_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+        self._started = time.perf_counter()
+        active = self
+        return self
+
+    def stop(self):
+        global active
+        active = None
+        self.wall_time = time.perf_counter() - self._started
+        if self.trace_memory:
+            self.memory_peak = max([tracemalloc.get_traced_memory()[1]] + list(self.memory_peaks.values()))
+            tracemalloc.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def begin(self):
+        # Start of an instrumented section: returns the time to pass to lap
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        return time.perf_counter()
+
+    def lap(self, name, since):
+        # Adds the time since `since` to timer name and returns the current
+        # time, so consecutive phases can be chained. With memory tracing on,
+        # also records the allocation peak of the phase.
+        now = time.perf_counter()
+        self.timers[name] = self.timers.get(name, 0.0) + (now - since)
+        self.laps[name] = self.laps.get(name, 0) + 1
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            self.memory_peaks[name] = max(self.memory_peaks.get(name, 0), peak)
+            tracemalloc.reset_peak()
+        return time.perf_counter()
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        phases = {}
+        for name, total in sorted(self.timers.items()):
+            phases[name] = {"seconds": total, "calls": self.laps[name], "mean": total / self.laps[name]}
+            if name in self.memory_peaks:
+                phases[name]["memory_peak"] = self.memory_peaks[name]
+        return {"wall_time": self.wall_time, "phases": phases, "counters": dict(sorted(self.counters.items())),
+                "memory_peak": self.memory_peak}
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=1)
+
+    def report(self):
+        summary = self.summary()
+        lines = [f"{'phase':28s} {'seconds':>10s} {'calls':>8s} {'mean':>10s}" + (f" {'peak KiB':>10s}" if self.trace_memory else "")]
+        for name, phase in summary["phases"].items():
+            line = f"{name:28s} {phase['seconds']:10.4f} {phase['calls']:8d} {phase['mean']:10.6f}"
+            if self.trace_memory:
+                line += f" {phase.get('memory_peak', 0) / 1024:10.1f}"
+            lines.append(line)
+        for name, value in summary["counters"].items():
+            lines.append(f"{name:28s} {value:10d}")
+        if summary["wall_time"] is not None:
+            lines.append(f"{'wall time':28s} {summary['wall_time']:10.4f}")
+        if summary["memory_peak"] is not None:
+            lines.append(f"{'memory peak KiB':28s} {summary['memory_peak'] / 1024:10.1f}")
+        return "\n".join(lines)
@@ -0,0 +1,227 @@
+import math
+
+import numpy as np
+import pygame
+
+# Array-based grid renderer for the pygame front ends.
+# The type-code array is mapped through a color lookup table into a pixel
+# buffer, which is scaled to the zoom in one call and blitted once.
+# Between frames only cells whose type changed are repainted, so after a swap
+# a frame costs two small fills instead of a draw call per cell.
+#
+# Viewport shows grids larger than the window: zoom is in screen pixels per
+# cell and (x0, y0) is the cell position (column, row) at the window's top
+# left. Only the visible cells are mapped through the lookup table and scaled,
+# so a frame costs about one window of pixels however large the grid. Below
+# one pixel per cell the viewport draws mipmap level L instead, the smallest
+# whose 2**L x 2**L cell blocks fit in a pixel: each level holds per-block
+# counts of every type, built on first use and then kept up to date from the
+# cells that changed between frames, and a block takes the color of its
+# majority type ("majority") or the count-weighted mean color ("blend").
+# The mouse wheel zooms around the pointer, dragging with the middle button
+# pans and Home fits the whole grid in the window.
+
+GRID_LINE_COLOR = (100, 100, 100)
+
+# largest window side the front ends open
+MAX_WINDOW = 800
+MAX_ZOOM = 64
+ZOOM_STEP = 1.25
+# cell borders are drawn from this many pixels per cell
+GRID_LINE_ZOOM = 6
+BACKGROUND_COLOR = (40, 40, 40)
+
+
+class Viewport:
+    def __init__(self, N, palette, size, zoom=None, mode="majority", grid_lines=True, full_redraw_fraction=0.1):
+        # palette[c] is the RGB color of type code c; zoom (pixels per cell)
+        # defaults to, and never starts larger than, fitting the grid in size
+        if mode not in ("majority", "blend"):
+            raise ValueError(f"Unknown mipmap mode {mode}")
+        self.N = N
+        self.lut = np.array(palette, dtype=np.uint8)
+        self.size = size
+        self.mode = mode
+        self.grid_lines = grid_lines
+        self.full_redraw_fraction = full_redraw_fraction
+        self.surface = pygame.Surface(size)
+        self.fit()
+        if zoom is not None:
+            self.zoom = min(zoom, self.zoom)
+        self.levels = None
+        self.prev = None
+        self.moved = True
+        self.dragging = False
+
+    def fit(self):
+        self.zoom = min(self.size) / self.N
+        self.x0 = self.y0 = 0.0
+        self.moved = True
+
+    def _clamp(self):
+        # the grid can be moved anywhere inside a larger window, and a grid
+        # larger than the window cannot leave it
+        for axis, extent in (("x0", self.size[0]), ("y0", self.size[1])):
+            slack = self.N - extent / self.zoom
+            setattr(self, axis, min(max(getattr(self, axis), min(0.0, slack)), max(0.0, slack)))
+
+    def zoom_by(self, factor, around=(0, 0)):
+        # keeps the cell under the window pixel around in place
+        px, py = around
+        x, y = self.x0 + px / self.zoom, self.y0 + py / self.zoom
+        self.zoom = min(max(self.zoom * factor, min(self.size) / self.N / 2), MAX_ZOOM)
+        self.x0, self.y0 = x - px / self.zoom, y - py / self.zoom
+        self._clamp()
+        self.moved = True
+
+    def pan(self, dx, dy):
+        # by window pixels
+        self.x0 -= dx / self.zoom
+        self.y0 -= dy / self.zoom
+        self._clamp()
+        self.moved = True
+
+    def cell_at(self, px, py):
+        # (row, column) of the cell under window pixel (px, py), or None
+        row, col = int(math.floor(self.y0 + py / self.zoom)), int(math.floor(self.x0 + px / self.zoom))
+        if 0 <= row < self.N and 0 <= col < self.N:
+            return row, col
+        return None
+
+    def handle_event(self, event, pos=(0, 0)):
+        # returns True when the event was a zoom or pan
+        if event.type == pygame.MOUSEWHEEL:
+            x, y = pygame.mouse.get_pos()
+            self.zoom_by(ZOOM_STEP ** event.y, (x - pos[0], y - pos[1]))
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 2:
+            self.dragging = True
+        elif event.type == pygame.MOUSEBUTTONUP and event.button == 2:
+            self.dragging = False
+        elif event.type == pygame.MOUSEMOTION and self.dragging:
+            self.pan(*event.rel)
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_HOME:
+            self.fit()
+        else:
+            return False
+        return True
+
+    def _build_levels(self, types):
+        # levels[L] has shape (types, ceil(N / 2**L), ceil(N / 2**L)); level 0 is unused
+        k = len(self.lut)
+        counts = np.zeros((k, self.N, self.N), dtype=np.int32)
+        for t in range(k):
+            counts[t] = types == t
+        self.levels = [None]
+        while counts.shape[1] > 1:
+            m = -(-counts.shape[1] // 2)
+            padded = np.zeros((k, 2 * m, 2 * m), dtype=np.int32)
+            padded[:, :counts.shape[1], :counts.shape[2]] = counts
+            counts = padded.reshape(k, m, 2, m, 2).sum(axis=(2, 4))
+            self.levels.append(counts)
+
+    def _update_levels(self, types, rows, cols):
+        old, new = self.prev[rows, cols], types[rows, cols]
+        for level in range(1, len(self.levels)):
+            r, c = rows >> level, cols >> level
+            np.add.at(self.levels[level], (old, r, c), -1)
+            np.add.at(self.levels[level], (new, r, c), 1)
+
+    def _edge(self, k, axis0):
+        # first window pixel of cell k along an axis whose window edge is at cell axis0
+        return int(math.ceil((k - axis0) * self.zoom))
+
+    def _indices(self, scale, limit):
+        # per window row and column, the index of the array entry (scale cells
+        # wide) it shows, as (first row, rows, first column, columns) of the
+        # pixels that show one
+        w, h = self.size
+        spans = []
+        for extent, axis0 in ((h, self.y0), (w, self.x0)):
+            index = np.floor((axis0 + np.arange(extent) / self.zoom) / scale).astype(np.int64)
+            inside = np.flatnonzero((index >= 0) & (index < limit))
+            spans.append((int(inside[0]) if len(inside) else 0, index[inside]))
+        (top, rows), (left, cols) = spans
+        return top, rows, left, cols
+
+    def _render(self, types):
+        self.surface.fill(BACKGROUND_COLOR)
+        scale, colors = 1, None
+        if self.zoom < 1:
+            level = min(int(math.ceil(math.log2(1 / self.zoom))), len(self.levels) - 1)
+            counts, scale = self.levels[level], 2 ** level
+        top, rows, left, cols = self._indices(scale, self.N if scale == 1 else counts.shape[1])
+        if not len(rows) or not len(cols):
+            return
+        r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        if scale == 1:
+            colors = self.lut[types[r0:r1, c0:c1]]
+        elif self.mode == "majority":
+            colors = self.lut[counts[:, r0:r1, c0:c1].argmax(axis=0)]
+        else:
+            block = counts[:, r0:r1, c0:c1]
+            total = np.maximum(block.sum(axis=0), 1)[..., None]
+            colors = (np.tensordot(block, self.lut.astype(np.float64), axes=(0, 0)) / total).astype(np.uint8)
+        # surfarray is indexed [x][y], i.e. [column][row]
+        pixels = colors[(rows - r0)[:, None], (cols - c0)[None, :]]
+        self.surface.blit(pygame.surfarray.make_surface(pixels.transpose(1, 0, 2)), (left, top))
+        if scale == 1 and self.grid_lines and self.zoom >= GRID_LINE_ZOOM:
+            self._draw_lines(r0, r1, c0, c1)
+
+    def _draw_lines(self, r0, r1, c0, c1):
+        # borders on the last pixel of every visible cell
+        top, bottom = self._edge(r0, self.y0), self._edge(r1, self.y0) - 1
+        left, right = self._edge(c0, self.x0), self._edge(c1, self.x0) - 1
+        for c in range(c0, c1):
+            x = self._edge(c + 1, self.x0) - 1
+            pygame.draw.line(self.surface, GRID_LINE_COLOR, (x, top), (x, bottom))
+        for r in range(r0, r1):
+            y = self._edge(r + 1, self.y0) - 1
+            pygame.draw.line(self.surface, GRID_LINE_COLOR, (left, y), (right, y))
+
+    def _redraw_cells(self, types, rows, cols):
+        # repaints single cells at zoom >= 1, inside their borders when drawn
+        inset = 1 if self.grid_lines and self.zoom >= GRID_LINE_ZOOM else 0
+        bounds = self.surface.get_rect()
+        rects = []
+        for i, j in zip(rows.tolist(), cols.tolist()):
+            x, y = self._edge(j, self.x0), self._edge(i, self.y0)
+            rect = pygame.Rect(x, y, self._edge(j + 1, self.x0) - x - inset, self._edge(i + 1, self.y0) - y - inset)
+            if rect.colliderect(bounds):
+                rect = rect.clip(bounds)
+                self.surface.fill(self.lut[types[i, j]], rect)
+                rects.append(rect)
+        return rects
+
+    def draw(self, screen, types, pos=(0, 0)):
+        # Draws the visible part of types (N x N array of type codes) at pos
+        # and returns the list of screen rects that changed, for
+        # pygame.display.update
+        types = np.asarray(types)
+        changed = None
+        if self.prev is not None:
+            rows, cols = np.nonzero(types != self.prev)
+            changed = len(rows)
+        if self.levels is not None:
+            if changed is None or changed > self.full_redraw_fraction * self.N * self.N:
+                self._build_levels(types)
+            elif changed:
+                self._update_levels(types, rows, cols)
+        elif self.zoom < 1:
+            self._build_levels(types)
+        moved, self.moved = self.moved, False
+
+        if not moved and changed == 0:
+            areas = []
+        elif not moved and changed is not None and self.zoom >= 1 and changed <= self.full_redraw_fraction * self.N * self.N:
+            areas = self._redraw_cells(types, rows, cols)
+        else:
+            self._render(types)
+            areas = [self.surface.get_rect()]
+        self.prev = types.copy()
+
+        x0, y0 = pos
+        return [screen.blit(self.surface, (area.x + x0, area.y + y0), area) for area in areas]
+
+    def invalidate(self):
+        # forces a full redraw on the next frame, e.g. after the window was exposed
+        self.moved = True
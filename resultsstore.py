@@ -0,0 +1,111 @@
+import csv
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+
+# Columnar results store.
+# A store is a directory of .npz part files, one per write, with one array per
+# column. Parts are written under a temporary name and renamed into place, so
+# any number of worker processes can append to the same store concurrently and
+# readers never see a half-written part. Loading only decompresses the columns
+# that are asked for.
+#
+# Rows are dicts; ints, floats and strings become typed columns, anything else
+# (the p matrix, race counts) is stored as a JSON string.
+
+
+def _column(values):
+    if all(isinstance(v, (bool, np.bool_)) for v in values):
+        return np.array(values, dtype=bool)
+    if all(isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in values):
+        return np.array(values, dtype=np.int64)
+    if all(isinstance(v, (int, float, np.integer, np.floating)) for v in values):
+        return np.array(values, dtype=np.float64)
+    if all(isinstance(v, str) for v in values):
+        return np.array(values, dtype=str)
+    return np.array([json.dumps(v) for v in values], dtype=str)
+
+
+def write_rows(directory, rows, name=None):
+    # Writes rows as a new part and returns its path. If name is given the part
+    # is stored as <name>.npz, replacing any previous part with that name.
+    if not rows:
+        return None
+    keys = list(rows[0].keys())
+    for row in rows:
+        if list(row.keys()) != keys:
+            raise ValueError("All rows in a part must have the same columns")
+    os.makedirs(directory, exist_ok=True)
+    if name is None:
+        # time first so parts sort in write order
+        name = f"part-{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(directory, f"{name}.npz")
+    tmp = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **{k: _column([row[k] for row in rows]) for k in keys})
+    os.replace(tmp, path)
+    return path
+
+
+def list_parts(directory):
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                  if f.endswith(".npz") and not f.startswith("."))
+
+
+def _load_legacy_csv(path, columns):
+    # Old append-mode CSVs; header rows repeated between blocks are dropped
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = [r for r in reader if r and r != header]
+    if columns is None:
+        columns = header
+    data = {}
+    for c in columns:
+        values = [r[header.index(c)] for r in rows]
+        for dtype in (np.int64, np.float64, str):
+            try:
+                data[c] = np.array(values).astype(dtype)
+                break
+            except ValueError:
+                continue
+    return data
+
+
+def _missing(pieces, n):
+    # fill for n rows of a column a part lacks: NaN beside numeric columns, None otherwise
+    if all(p.dtype.kind in "biuf" for p in pieces if p is not None):
+        return np.full(n, np.nan)
+    return np.full(n, None, dtype=object)
+
+
+def load_results(path, columns=None):
+    # Returns a dict of column -> array for a store directory (or a legacy CSV
+    # file), concatenating all parts. Only the requested columns are read.
+    # Parts written with different columns (older stores, CLI and manifest
+    # rows) are aligned on the union of their columns: a column a part lacks
+    # is NaN (numeric columns) or None there.
+    if os.path.isfile(path) and path.endswith(".csv"):
+        return _load_legacy_csv(path, columns)
+    parts = []
+    names = list(columns or [])
+    for part in list_parts(path):
+        with np.load(part) as data:
+            if columns is None:
+                names.extend(c for c in data.files if c not in names)
+            loaded = {c: data[c] for c in names if c in data.files}
+            lengths = {len(v) for v in loaded.values()} or {len(data[data.files[0]]) if data.files else 0}
+            if len(lengths) > 1:
+                raise ValueError(f"Columns of {part} differ in length")
+            parts.append((loaded, lengths.pop()))
+    for c in names:
+        if not any(c in loaded for loaded, _ in parts):
+            raise KeyError(f"Column {c} missing from {path}")
+    result = {}
+    for c in names:
+        pieces = [loaded.get(c) for loaded, _ in parts]
+        result[c] = np.concatenate([p if p is not None else _missing(pieces, n) for p, (_, n) in zip(pieces, parts)])
+    return result
@@ -0,0 +1,137 @@
+import random
+import time
+
+import numpy as np
+
+import metriccomputations
+from policies import POLICIES
+from zhang import Grid, run
+
+# Headless single runs shared by the CLI and the sweep workers.
+# A run is described by a plain config dict:
+#   N       grid size
+#   colors  race -> number of agents, in color_dict order
+#   p       p_ij matrix indexed like colors
+#   K       radius for the K-neighborhood metrics
+#   seed    seed for the initial placement
+#   dynamics move-selection policy (see policies.py): "best" (the global
+#            best improving move, the default), "first", "random", "sampled"
+#            or "vacancy" (zhang-segregation-threshold.py's dynamics)
+#   topology board geometry (see topology.py), "bounded" by default
+#   graph    optional graph spec (see graph.build); runs a graph.GraphModel
+#            on that network instead of an N x N Grid
+#   backend  optional Grid backend ("python", "numpy" or "numba"); results
+#            do not depend on it
+# and produces one result row per race with the same metric columns as the
+# experiment scripts.
+
+# stored column -> compute_metrics key
+METRIC_COLUMNS = {
+    "avg_dist": "avg_distance",
+    "K_div": "diversity",
+    "multi_racial_fraction": "edge_fraction",
+    "dist_to_furthest": "WORST_avg_distance",
+    "fraction_of_rarest": "WORST_diversity",
+}
+
+
+DYNAMICS = tuple(POLICIES)
+
+
+def make_grid(config, telemetry=None):
+    if config.get("dynamics", "best") not in DYNAMICS:
+        raise ValueError(f"Unknown dynamics {config['dynamics']}")
+    colors = config["colors"]
+    color_dict = {c: i for i, c in enumerate(colors)}
+    random.seed(config["seed"])
+    if config.get("graph") is not None:
+        # telemetry records grid cells; GraphModel has no telemetry hook
+        if telemetry is not None:
+            raise ValueError("Telemetry is not supported for graph runs")
+        from graph import GraphModel, build
+        backend = "numba" if config.get("backend") == "numba" else "numpy"
+        return GraphModel(build(config["graph"]), config["p"], color_dict, dict(colors), backend=backend,
+                          policy=config.get("dynamics", "best"))
+    return Grid(N=config["N"], p=config["p"], color_dict=color_dict, colors=dict(colors), telemetry=telemetry,
+                backend=config.get("backend", "python"), topology=config.get("topology", "bounded"),
+                policy=config.get("dynamics", "best"), start=config.get("start", "shuffle"))
+
+
+def result_rows(config, metrics, steps, wall_time, extra=None, N=None):
+    # N overrides config["N"]: simulate passes the model's, the number of
+    # nodes for graph runs
+    rows = []
+    for race in config["colors"]:
+        row = dict(extra or {})
+        row["race"] = race
+        for column, key in METRIC_COLUMNS.items():
+            row[column] = metrics[race][key]
+        row.update({"seed": config["seed"], "N": config.get("N") if N is None else N, "K": config["K"], "p": config["p"],
+                    "race_counts": dict(config["colors"]), "steps": steps, "wall_time": wall_time})
+        rows.append(row)
+    return rows
+
+
+def adjust_population(types, old_colors, new_colors, seed=0):
+    # Turns a board of types for old_colors into one for new_colors (same
+    # races in the same order): agents of races that shrink are picked at
+    # random and relabeled to races that grow, then leftover growth is added
+    # on random vacancies and leftover shrinkage vacated. Returns the new
+    # types and {"relabeled", "added", "removed"} counts.
+    if list(old_colors) != list(new_colors):
+        raise ValueError("Populations must have the same races in the same order")
+    rng = np.random.default_rng(seed)
+    types = np.array(types, dtype=np.int8)
+    flat = types.reshape(-1)
+    freed = []
+    for idx, race in enumerate(new_colors):
+        surplus = old_colors[race] - new_colors[race]
+        if surplus > 0:
+            freed.extend(rng.choice(np.flatnonzero(flat == idx + 1), surplus, replace=False).tolist())
+    vacant = rng.permutation(np.flatnonzero(flat == 0)).tolist()
+    counts = {"relabeled": 0, "added": 0, "removed": 0}
+    for idx, race in enumerate(new_colors):
+        for _ in range(new_colors[race] - old_colors[race]):
+            if freed:
+                flat[freed.pop(0)] = idx + 1
+                counts["relabeled"] += 1
+            elif vacant:
+                flat[vacant.pop()] = idx + 1
+                counts["added"] += 1
+            else:
+                raise ValueError("There are no vacant cells!")
+    flat[freed] = 0
+    counts["removed"] = len(freed)
+    return types, counts
+
+
+def simulate(config, extra=None, max_steps=None, capture=None, record=None, telemetry=None, start=None,
+             state=None, metric_workers=None):
+    # Runs one configuration to convergence and returns its result rows.
+    # record is an optional path to save the trajectory to (see trajectory.py),
+    # telemetry an optional telemetry.Telemetry fed every move; record,
+    # capture and telemetry are for grid runs only. start is an optional
+    # board of types to begin from instead of the random placement (see
+    # adjust_population), state an optional .npy path for the final types.
+    # metric_workers computes the final metrics in that many processes
+    # (metriccomputations.parallel_metrics, same result).
+    if config.get("graph") is not None and (record is not None or capture is not None):
+        # trajectories and frames are N x N boards of cells
+        raise ValueError("Trajectory recording and frame capture are not supported for graph runs")
+    begin = time.perf_counter()
+    g = make_grid(config, telemetry)
+    if start is not None:
+        g.set_types(start)
+    if record is not None:
+        from trajectory import record_run
+        steps = record_run(g, record, max_steps=max_steps)
+    else:
+        steps = run(g, max_steps=max_steps, capture=capture)
+    wall_time = time.perf_counter() - begin
+    if state is not None:
+        np.save(state, g.types)
+    if metric_workers:
+        metrics = metriccomputations.parallel_metrics(g, list(config["colors"]), config["K"], workers=metric_workers)
+    else:
+        metrics = metriccomputations.compute_metrics(g, list(config["colors"]), config["K"])
+    return result_rows(config, metrics, steps, wall_time, extra, N=g.N)
@@ -0,0 +1,289 @@
+import argparse
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import runner
+from policies import POLICIES
+from topology import TOPOLOGIES
+
+# Headless command line entry point:
+#   python -m segregation run      one run to convergence, metrics printed or stored
+#                                  (--profile writes per-phase timings, see profiling.py)
+#   python -m segregation sweep    many runs across worker processes into a results store,
+#                                  either --vary/--values or a sweep manifest (see sweepmanifest.py)
+#   python -m segregation metrics  metric time series from a recorded trajectory
+#   python -m segregation tipping  where a metric of the threshold script's model
+#                                  tips as one of its parameters varies (see tipping.py)
+#   python -m segregation phase    phase diagram over those parameters (see phasediagram.py)
+#   python -m segregation plot     render the experiment figures
+# Only the simulation core is imported up front; pygame, the frame writer and
+# matplotlib are imported by the subcommands that need them.
+
+DEFAULT_COLORS = {"white": 200, "black": 200, "orange": 50}
+DEFAULT_P = [[1, 1, 1], [1, 1, -1], [1, -1, 2]]
+
+
+def parse_colors(items):
+    colors = {}
+    for item in items:
+        race, _, count = item.partition("=")
+        colors[race] = int(count)
+    return colors
+
+
+def base_config(args):
+    colors = parse_colors(args.colors) if args.colors else dict(DEFAULT_COLORS)
+    if args.p is not None:
+        p = json.loads(args.p)
+    elif list(colors) == list(DEFAULT_COLORS):
+        p = DEFAULT_P
+    else:
+        raise SystemExit("--p is required when --colors differs from the default races")
+    if len(p) != len(colors) or any(len(row) != len(colors) for row in p):
+        raise SystemExit("--p must be a square matrix with one row per race")
+    config = {"N": args.N, "colors": colors, "p": p, "K": args.K, "seed": args.seed, "backend": args.backend,
+              "topology": args.topology, "dynamics": args.dynamics, "graph": json.loads(args.graph) if args.graph else None}
+    # only a non-default start goes into the config, so cache keys of shuffled starts are unchanged
+    if args.start:
+        config["start"] = json.loads(args.start) if args.start.startswith("{") else args.start
+    return config
+
+
+def add_config_args(parser):
+    parser.add_argument("--N", type=int, default=25, help="grid size")
+    parser.add_argument("--colors", nargs="*", metavar="RACE=COUNT", help="agents per race (default white=200 black=200 orange=50)")
+    parser.add_argument("--p", help="p_ij matrix as JSON, one row per race")
+    parser.add_argument("--K", type=int, default=5, help="radius for the K-neighborhood metrics")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-steps", type=int)
+    parser.add_argument("--topology", choices=list(TOPOLOGIES), default="bounded", help="board geometry")
+    parser.add_argument("--dynamics", choices=list(POLICIES), default="best",
+                        help="move-selection policy (see policies.py)")
+    parser.add_argument("--start", help='initial placement (see placement.py), a kind or JSON, e.g. {"kind": "blocks", "size": 5}')
+    parser.add_argument("--graph", help='run on a network instead of the grid, as JSON, e.g. {"geometric": 10000, "radius": 0.02}')
+    parser.add_argument("--backend", choices=["python", "numpy", "numba"], default="python",
+                        help="step and metric implementation (numba falls back to numpy when not installed)")
+
+
+def write_or_print(rows, results):
+    if results:
+        import resultsstore
+        resultsstore.write_rows(results, rows)
+    else:
+        for row in rows:
+            print(json.dumps(row))
+
+
+def cmd_run(args):
+    config = base_config(args)
+    if config["graph"] is not None and (args.view or args.capture or args.record or args.telemetry):
+        raise SystemExit("--view, --capture, --record and --telemetry need an N x N grid, not a --graph run")
+    if args.view:
+        from zhang import view
+        g = runner.make_grid(config)
+        steps = view(g)
+        print(f"{steps} moves")
+        return
+
+    capture = None
+    if args.capture:
+        from framecapture import FrameCapture
+        palette = None
+        if args.capture_mode == "png":
+            from zhang import palette as grid_palette
+            palette = grid_palette({c: i for i, c in enumerate(config["colors"])})
+        capture = FrameCapture(args.capture, every=args.capture_every, mode=args.capture_mode, palette=palette)
+    telemetry = None
+    if args.telemetry:
+        from telemetry import Telemetry
+        telemetry = Telemetry(args.telemetry, format=args.telemetry_format, level=args.telemetry_level,
+                              every=args.telemetry_every)
+    prof = None
+    if args.profile:
+        import profiling
+        prof = profiling.Profiler(trace_memory=args.profile_memory).start()
+    try:
+        rows = runner.simulate(config, max_steps=args.max_steps, capture=capture, record=args.record,
+                               telemetry=telemetry, metric_workers=args.metric_workers)
+    finally:
+        if capture is not None:
+            capture.close()
+        if telemetry is not None:
+            telemetry.close()
+        if prof is not None:
+            prof.stop()
+    if prof is not None:
+        prof.dump(args.profile)
+        print(prof.report(), file=sys.stderr)
+    write_or_print(rows, args.results)
+
+
+def _sweep_job(job):
+    # runs in a worker process; rows go straight to the store when there is one
+    config, extra, max_steps, results = job
+    rows = runner.simulate(config, extra=extra, max_steps=max_steps)
+    if results:
+        import resultsstore
+        resultsstore.write_rows(results, rows)
+        return []
+    return rows
+
+
+def cmd_sweep(args):
+    if args.manifest:
+        import sweepmanifest
+        ran, reused = sweepmanifest.run_manifest(args.manifest, workers=args.workers)
+        print(f"{ran} runs, {reused} reused from cache")
+        return
+    if not args.vary or not args.values:
+        raise SystemExit("sweep needs either --manifest or --vary and --values")
+    base = base_config(args)
+    jobs = []
+    for value in args.values:
+        for replica in range(args.replicas):
+            config = dict(base, colors=dict(base["colors"]))
+            config["colors"][args.vary] = value
+            config["seed"] = base["seed"] + replica
+            jobs.append((config, {f"num_{args.vary}": value}, args.max_steps, args.results))
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for rows in pool.map(_sweep_job, jobs):
+            write_or_print(rows, None)
+
+
+def cmd_metrics(args):
+    import numpy as np
+    from offlinemetrics import compute_metric_series
+    series = compute_metric_series(args.trajectory, args.K, steps=args.steps, every=args.every, workers=args.workers)
+    np.savez(args.out, **series)
+    print(f"Wrote {len(series['step'])} rows to {args.out}")
+
+
+def cmd_tipping(args):
+    import tipping
+    base = {"alpha": args.alpha, "beta": args.beta, "preference": args.preference, "N": args.N, "K": args.K,
+            "seed": args.seed, "backend": args.backend}
+    result = tipping.find_threshold(args.param, args.lo, args.hi, args.target, metric=args.metric, base=base,
+                                    replicas=args.replicas, max_replicas=args.max_replicas, tol=args.tol,
+                                    workers=args.workers, max_steps=args.max_steps)
+    for value, mean, error, n in result["points"]:
+        print(f"{args.param}={value:.4g}: {args.metric} {mean:.4f} +- {error:.4f} ({n} runs)", file=sys.stderr)
+    print(json.dumps(result))
+
+
+def cmd_phase(args):
+    import phasediagram
+    axes = {}
+    for item in args.axes:
+        name, _, span = item.partition("=")
+        lo, _, hi = span.partition(":")
+        axes[name] = (float(lo), float(hi))
+    base = {"alpha": args.alpha, "beta": args.beta, "preference": args.preference, "N": args.N, "K": args.K,
+            "backend": args.backend}
+    for name in axes:
+        base.pop(name, None)
+    diagram = phasediagram.PhaseDiagram(axes, metric=args.metric, base=base, coarse=args.coarse,
+                                        max_depth=args.depth, threshold=args.threshold, replicas=args.replicas,
+                                        seed=args.seed)
+    points = diagram.build(workers=args.workers)
+    diagram.save(args.out)
+    print(f"{points} points, {len(diagram.leaves)} cells, written to {args.out}")
+
+
+def cmd_plot(args):
+    import plotpipeline
+    for path in plotpipeline.render_all(args.experiments or None):
+        print(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m segregation")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="run one simulation to convergence")
+    add_config_args(p_run)
+    p_run.add_argument("--results", help="results store directory (default: print rows as JSON)")
+    p_run.add_argument("--record", help="save the trajectory to this .npz")
+    p_run.add_argument("--capture", help="capture frames to this archive (npz) or directory (png)")
+    p_run.add_argument("--capture-every", type=int, default=1)
+    p_run.add_argument("--capture-mode", choices=["npz", "png"], default="npz")
+    p_run.add_argument("--view", action="store_true", help="show the run in a pygame window")
+    p_run.add_argument("--metric-workers", type=int, help="compute the final metrics in this many processes")
+    p_run.add_argument("--telemetry", metavar="PATH", help="write structured run telemetry (see telemetry.py)")
+    p_run.add_argument("--telemetry-format", choices=["jsonl", "binary"], default="jsonl")
+    p_run.add_argument("--telemetry-level", choices=["debug", "info"], default="info",
+                       help="debug adds a record per move")
+    p_run.add_argument("--telemetry-every", type=int, default=100, help="moves between progress records")
+    p_run.add_argument("--profile", metavar="PATH", help="time the step and metric phases and write a JSON summary")
+    p_run.add_argument("--profile-memory", action="store_true", help="also record tracemalloc peaks per phase")
+    p_run.set_defaults(func=cmd_run)
+
+    p_sweep = sub.add_parser("sweep", help="run a parameter sweep in worker processes")
+    add_config_args(p_sweep)
+    p_sweep.add_argument("--manifest", help="JSON/TOML sweep manifest; the config arguments are ignored")
+    p_sweep.add_argument("--vary", metavar="RACE", help="race whose count is swept")
+    p_sweep.add_argument("--values", type=int, nargs="+")
+    p_sweep.add_argument("--replicas", type=int, default=1)
+    p_sweep.add_argument("--workers", type=int)
+    p_sweep.add_argument("--results", help="results store directory (default: print rows as JSON)")
+    p_sweep.set_defaults(func=cmd_sweep)
+
+    p_metrics = sub.add_parser("metrics", help="metric time series from a recorded trajectory")
+    p_metrics.add_argument("trajectory")
+    p_metrics.add_argument("--K", type=int, default=5)
+    p_metrics.add_argument("--every", type=int, default=1)
+    p_metrics.add_argument("--steps", type=int, nargs="*")
+    p_metrics.add_argument("--workers", type=int, default=1)
+    p_metrics.add_argument("--out", default="metric_series.npz")
+    p_metrics.set_defaults(func=cmd_metrics)
+
+    p_tip = sub.add_parser("tipping", help="find where a metric of the threshold script's model crosses a level as a parameter varies")
+    p_tip.add_argument("--param", choices=["alpha", "beta", "preference"], default="preference")
+    p_tip.add_argument("--lo", type=float, required=True)
+    p_tip.add_argument("--hi", type=float, required=True)
+    p_tip.add_argument("--target", type=float, required=True, help="metric level that marks the tipping point")
+    p_tip.add_argument("--metric", default="interracial",
+                       help='"interracial" or a result column, optionally for one race (e.g. K_div:orange)')
+    p_tip.add_argument("--alpha", type=float, default=0.25, help="orange share of white + orange")
+    p_tip.add_argument("--beta", type=float, default=0.1, help="vacant fraction")
+    p_tip.add_argument("--preference", type=float, default=10, help="orange preference for white/orange neighbors")
+    p_tip.add_argument("--N", type=int, default=25, help="grid size")
+    p_tip.add_argument("--K", type=int, default=5)
+    p_tip.add_argument("--seed", type=int, default=0, help="seed of the first replica")
+    p_tip.add_argument("--replicas", type=int, default=4, help="replicas per batch")
+    p_tip.add_argument("--max-replicas", type=int, default=32)
+    p_tip.add_argument("--tol", type=float, default=0.05, help="stop once the bracket is this narrow")
+    p_tip.add_argument("--max-steps", type=int)
+    p_tip.add_argument("--backend", choices=["python", "numpy", "numba"], default="numpy")
+    p_tip.add_argument("--workers", type=int)
+    p_tip.set_defaults(func=cmd_tipping)
+
+    p_phase = sub.add_parser("phase", help="adaptively refined phase diagram of the threshold script's model over its parameters")
+    p_phase.add_argument("--axes", nargs="+", required=True, metavar="PARAM=LO:HI",
+                         help="two or three of alpha, beta, preference with their ranges")
+    p_phase.add_argument("--metric", default="K_div", help="metric that drives refinement, e.g. K_div or K_div:orange")
+    p_phase.add_argument("--threshold", type=float, default=0.05, help="split cells whose metric varies more than this")
+    p_phase.add_argument("--coarse", type=int, default=5, help="points per axis of the starting lattice")
+    p_phase.add_argument("--depth", type=int, default=3, help="maximum refinement levels")
+    p_phase.add_argument("--replicas", type=int, default=2)
+    p_phase.add_argument("--alpha", type=float, default=0.25)
+    p_phase.add_argument("--beta", type=float, default=0.1)
+    p_phase.add_argument("--preference", type=float, default=10)
+    p_phase.add_argument("--N", type=int, default=25)
+    p_phase.add_argument("--K", type=int, default=5)
+    p_phase.add_argument("--seed", type=int, default=0)
+    p_phase.add_argument("--backend", choices=["python", "numpy", "numba"], default="numpy")
+    p_phase.add_argument("--workers", type=int)
+    p_phase.add_argument("--out", default="phase.npz")
+    p_phase.set_defaults(func=cmd_phase)
+
+    p_plot = sub.add_parser("plot", help="render the experiment figures")
+    p_plot.add_argument("experiments", nargs="*")
+    p_plot.set_defaults(func=cmd_plot)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,94 @@
+import threading
+import time
+
+# Runs a simulation in a background thread so the pygame front ends no longer
+# advance one move per displayed frame. The thread steps as fast as it can (or
+# at a capped rate) and publishes a snapshot after every move; the render loop
+# draws whatever snapshot is newest, skipping the ones in between.
+
+
+class SimulationThread(threading.Thread):
+    def __init__(self, step, snapshot, rate=None):
+        # step() advances one move and returns False once the run has converged,
+        # snapshot() returns a copy of the state to draw.
+        # rate caps the number of moves per second, None means unlimited.
+        super().__init__(daemon=True)
+        self.step = step
+        self.snapshot = snapshot
+        self.rate = rate
+        self.steps = 0
+        self.finished = False
+        self._lock = threading.Lock()
+        self._latest = snapshot()
+        self._resume = threading.Event()
+        self._resume.set()
+        self._halt = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._halt.is_set():
+            self._resume.wait()
+            if self._halt.is_set():
+                break
+            moved = self.step()
+            state = self.snapshot()
+            with self._lock:
+                self._latest = state
+                if moved:
+                    self.steps += 1
+            if not moved:
+                self.finished = True
+                break
+            if self.rate:
+                last += 1.0 / self.rate
+                delay = last - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    last = time.perf_counter()
+
+    def latest(self):
+        # (snapshot, number of moves made so far)
+        with self._lock:
+            return self._latest, self.steps
+
+    @property
+    def paused(self):
+        return not self._resume.is_set()
+
+    def toggle_pause(self):
+        if self.paused:
+            self._resume.set()
+        else:
+            self._resume.clear()
+
+    def stop(self):
+        self._halt.set()
+        self._resume.set()
+
+
+def handle_key(sim, key, base_rate):
+    # Shared controls: space pauses, +/- double or halve the speed multiplier
+    # (relative to base_rate moves per second), 0 removes the rate cap.
+    import pygame
+    if key == pygame.K_SPACE:
+        sim.toggle_pause()
+    elif key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+        if sim.rate is not None:
+            sim.rate *= 2
+    elif key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+        sim.rate = sim.rate / 2 if sim.rate is not None else 64 * base_rate
+    elif key in (pygame.K_0, pygame.K_KP0):
+        sim.rate = None
+
+
+def status(sim, base_rate):
+    if sim.paused:
+        state = "paused"
+    elif sim.finished:
+        state = "converged"
+    elif sim.rate is None:
+        state = "max speed"
+    else:
+        state = f"x{sim.rate / base_rate:g}"
+    return f"step {sim.steps} | {state}"
@@ -0,0 +1,343 @@
+import hashlib
+import itertools
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import resultsstore
+import runner
+
+# Parameter sweeps described by a manifest file (JSON or TOML) instead of
+# constants in the scripts. A manifest looks like
+#
+#   {
+#     "results": "results1",
+#     "base": {"N": 30, "colors": {"white": 300, "black": 300, "orange": 30},
+#              "p": [[-1, -1, -1], [-1, -1, -1], [0, -1, 0]], "K": 5, "seed": 0},
+#     "vary": {"colors.orange": [30, 60, 90], "seed": [0, 1, 2]},
+#     "columns": {"num_orange": "colors.orange"}
+#   }
+#
+# "vary" maps dotted config paths to value lists and expands to their product;
+# "cases" (optional) is a list of override dicts crossed with that product, for
+# parameters that change together. Each case may carry an "extra" dict of
+# constant result columns; "columns" copies config values into result columns.
+#
+# Every job is keyed by a hash of its full config (N, colors in order, p, K,
+# seed, dynamics, max_steps, topology, start when given; not the backend). Finished jobs live in a content-addressed cache
+# as <key>.npz and are linked into the manifest's results store, so rerunning
+# a manifest only runs the jobs that are new.
+#
+# An optional "replicas" section runs each parameter point until its metrics
+# are pinned down instead of once:
+#   "replicas": {"metrics": ["avg_dist", "K_div"], "halfwidth": 0.01,
+#                "min": 3, "max": 50, "z": 1.96}
+# Replica r of a point is the point's config with seed + r. Every point gets
+# min replicas; after that a point keeps getting replicas while the
+# confidence half-width z * sd / sqrt(n) of any listed metric for any race
+# (result columns or compute_metrics names, all metric columns by default)
+# is above halfwidth, up to max. Free workers always go to the point with the
+# widest interval, so low-variance points stop early and the compute goes to
+# the noisy ones (see run_replicas).
+#
+# "continuation": true warm-starts each job from the equilibrium of the job
+# before it in expansion order, when both run on the same board (N, topology)
+# with the same races: the previous final board is adjusted to the new
+# populations by runner.adjust_population (relabeling agents of shrinking
+# races to growing ones, e.g. white to orange as num_orange grows) and run
+# from there. Such a job's key includes the key it continued from, its
+# final board is cached next to its results (<key>.state.npy), and its rows
+# carry warm_start (that key, "" for a fresh start) and the relabeled, added
+# and removed counts. Chains of consecutive jobs run in order, different
+# chains in parallel.
+
+CACHE_DIR = ".sweepcache"
+
+CONFIG_DEFAULTS = {"dynamics": "best", "max_steps": None, "topology": "bounded"}
+
+
+def load_manifest(path):
+    if path.endswith(".toml"):
+        import tomllib
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+
+def _set_path(config, path, value):
+    keys = path.split(".")
+    target = config
+    for key in keys[:-1]:
+        target = target[key]
+    target[keys[-1]] = value
+
+
+def _get_path(config, path):
+    value = config
+    for key in path.split("."):
+        value = value[key]
+    return value
+
+
+def normalize(config):
+    config = dict(CONFIG_DEFAULTS, **config)
+    config["colors"] = dict(config["colors"])
+    return config
+
+
+def job_key(config):
+    # colors are hashed as an ordered list, since their order sets color_dict and
+    # the rows of p; the backend is left out since it does not change results
+    canonical = dict(normalize(config), colors=list(config["colors"].items()))
+    canonical.pop("backend", None)
+    text = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()[:24]
+
+
+def expand(manifest):
+    # Returns the manifest's jobs as (key, config, extra) tuples
+    vary = manifest.get("vary", {})
+    paths = list(vary)
+    cases = manifest.get("cases", [{}])
+    jobs = []
+    seen = set()
+    for case in cases:
+        for values in itertools.product(*(vary[p] for p in paths)):
+            config = json.loads(json.dumps(manifest["base"]))
+            extra = dict(case.get("extra", {}))
+            for key, value in case.items():
+                if key != "extra":
+                    _set_path(config, key, value)
+            for path, value in zip(paths, values):
+                _set_path(config, path, value)
+            config = normalize(config)
+            for column, path in manifest.get("columns", {}).items():
+                extra[column] = _get_path(config, path)
+            key = job_key(config)
+            if key not in seen:
+                seen.add(key)
+                jobs.append((key, config, extra))
+    return jobs
+
+
+def _run_job(job, start=None):
+    key, config, extra, cache_dir, frames = job
+    extra = dict(extra, job=key)
+    state = None
+    if "continue_from" in config:
+        state = os.path.join(cache_dir, f"{key}.state.npy")
+    capture = None
+    if frames:
+        from framecapture import FrameCapture
+        os.makedirs(frames["dir"], exist_ok=True)
+        capture = FrameCapture(os.path.join(frames["dir"], f"{key}.npz"), every=frames["every"])
+    try:
+        rows = runner.simulate(config, extra=extra, max_steps=config["max_steps"], capture=capture, start=start,
+                               state=state)
+    finally:
+        if capture is not None:
+            capture.close()
+    resultsstore.write_rows(cache_dir, rows, name=key)
+    return key
+
+
+def _link(src, dst):
+    if os.path.exists(dst):
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def run_manifest(manifest, workers=None, cache_dir=CACHE_DIR):
+    # Runs the jobs of manifest (a dict or a path) that are not cached yet and
+    # links every job into the results store. Returns (jobs run, jobs reused).
+    if isinstance(manifest, str):
+        manifest = load_manifest(manifest)
+    results = manifest["results"]
+    frames = manifest.get("frames")
+    os.makedirs(results, exist_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    jobs = expand(manifest)
+    done = lambda key: _link(os.path.join(cache_dir, f"{key}.npz"), os.path.join(results, f"{key}.npz"))
+    if manifest.get("continuation"):
+        if "replicas" in manifest:
+            raise ValueError("continuation and replicas cannot be combined")
+        return run_chains(continuation_chains(jobs), workers, cache_dir, frames, done)
+    if "replicas" in manifest:
+        return run_replicas(jobs, manifest["replicas"], workers, cache_dir, frames, done)
+    ran = run_cached(jobs, workers, cache_dir, frames, done=done)
+    for key, _, _ in jobs:
+        _link(os.path.join(cache_dir, f"{key}.npz"), os.path.join(results, f"{key}.npz"))
+    return ran, len(jobs) - ran
+
+
+def run_cached(jobs, workers=None, cache_dir=CACHE_DIR, frames=None, done=None, pool=None):
+    # Runs the (key, config, extra) jobs that are not in the cache yet, calling
+    # done(key) as each finishes, and returns how many ran. pool is an optional
+    # executor to reuse across calls.
+    os.makedirs(cache_dir, exist_ok=True)
+    todo = [job for job in jobs if not os.path.exists(os.path.join(cache_dir, f"{job[0]}.npz"))]
+    if not todo:
+        return 0
+    own = pool is None
+    if own:
+        pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for key in pool.map(_run_job, [(key, config, extra, cache_dir, frames) for key, config, extra in todo]):
+            if done is not None:
+                done(key)
+    finally:
+        if own:
+            pool.shutdown()
+    return len(todo)
+
+
+def load_job(key, cache_dir=CACHE_DIR):
+    # the cached result columns of one job
+    with np.load(os.path.join(cache_dir, f"{key}.npz")) as data:
+        return {c: data[c] for c in data.files}
+
+
+class ReplicaPoint:
+    # the replicas of one parameter point and their metric values
+    def __init__(self, config, extra, series):
+        self.config = config
+        self.extra = extra
+        self.values = {name: [] for name in series}
+        self.started = 0
+        self.finished = 0
+
+    def replica(self, r):
+        config = dict(self.config, seed=self.config["seed"] + r)
+        return job_key(config), config, self.extra
+
+    def record(self, data):
+        for column, race in self.values:
+            self.values[column, race].append(float(data[column][list(data["race"]).index(race)]))
+        self.finished += 1
+
+    def halfwidth(self, z, projected=False):
+        # widest confidence half-width over the metrics of the finished
+        # replicas; projected, at the replica count the point will have once
+        # its running replicas finish
+        if self.finished < 2:
+            return float("inf")
+        widest = max(float(np.std(v, ddof=1)) for v in self.values.values())
+        return z * widest / np.sqrt(self.started if projected else self.finished)
+
+
+def run_replicas(jobs, spec, workers=None, cache_dir=CACHE_DIR, frames=None, done=None):
+    # Sequential replica scheduling for the manifest's "replicas" section;
+    # returns (replicas run, replicas reused from the cache)
+    from concurrent.futures import FIRST_COMPLETED, wait
+    keys = {value: column for column, value in runner.METRIC_COLUMNS.items()}
+    columns = [keys.get(m, m) for m in spec.get("metrics", list(runner.METRIC_COLUMNS))]
+    target, z = spec["halfwidth"], spec.get("z", 1.96)
+    low, high = spec.get("min", 3), spec.get("max", 50)
+    points = [ReplicaPoint(config, extra, [(c, race) for c in columns for race in config["colors"]])
+              for _, config, extra in jobs]
+
+    def next_point():
+        # points short of min first, then the widest interval still above
+        # target. A point is done once its finished replicas are under target;
+        # one whose running replicas are projected to get it there waits for
+        # them instead of taking another worker
+        short = [p for p in points if p.started < low]
+        if short:
+            return min(short, key=lambda p: p.started)
+        open_points = [p for p in points if p.started < high and p.halfwidth(z) > target
+                       and p.halfwidth(z, projected=True) > target]
+        return max(open_points, key=lambda p: p.halfwidth(z, projected=True), default=None)
+
+    ran = reused = 0
+    os.makedirs(cache_dir, exist_ok=True)
+    pool = ProcessPoolExecutor(max_workers=workers)
+    capacity = workers or os.cpu_count() or 1
+    running = {}
+    try:
+        while True:
+            while len(running) < capacity:
+                point = next_point()
+                if point is None:
+                    break
+                key, config, extra = point.replica(point.started)
+                point.started += 1
+                if os.path.exists(os.path.join(cache_dir, f"{key}.npz")):
+                    point.record(load_job(key, cache_dir))
+                    reused += 1
+                    if done is not None:
+                        done(key)
+                    continue
+                running[pool.submit(_run_job, (key, config, extra, cache_dir, frames))] = point
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                point = running.pop(future)
+                key = future.result()
+                point.record(load_job(key, cache_dir))
+                ran += 1
+                if done is not None:
+                    done(key)
+    finally:
+        pool.shutdown()
+    return ran, reused
+
+
+def continuation_chains(jobs):
+    # Splits jobs into chains of consecutive grid jobs on the same board with
+    # the same races; every job after the first in a chain continues from
+    # the one before it (its config gets continue_from, so its key changes)
+    chains = []
+    previous = None
+    for key, config, extra in jobs:
+        board = (config["N"], config["topology"], list(config["colors"])) if config.get("graph") is None else None
+        if board is not None and previous is not None and board == previous[0]:
+            config = dict(config, continue_from=previous[1])
+            key = job_key(config)
+            chains[-1].append((key, config, extra))
+        else:
+            config = dict(config, continue_from="")
+            key = job_key(config)
+            chains.append([(key, config, extra)])
+        previous = (board, key) if board is not None else None
+    return chains
+
+
+def _run_chain(args):
+    # runs one continuation chain in order, skipping jobs already cached
+    chain, cache_dir, frames = args
+    keys = []
+    previous = None
+    for key, config, extra in chain:
+        if not os.path.exists(os.path.join(cache_dir, f"{key}.npz")):
+            start, adjusted = None, {"relabeled": 0, "added": 0, "removed": 0}
+            if previous is not None:
+                start, adjusted = runner.adjust_population(np.load(os.path.join(cache_dir, f"{previous[0]}.state.npy")),
+                                                           previous[1]["colors"], config["colors"], config["seed"])
+            extra = dict(extra, warm_start=config["continue_from"], **adjusted)
+            _run_job((key, config, extra, cache_dir, frames), start=start)
+            keys.append(key)
+        previous = (key, config)
+    return keys
+
+
+def run_chains(chains, workers=None, cache_dir=CACHE_DIR, frames=None, done=None):
+    # Runs continuation chains in parallel; returns (jobs run, jobs reused)
+    os.makedirs(cache_dir, exist_ok=True)
+    ran = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chain, keys in zip(chains, pool.map(_run_chain, [(chain, cache_dir, frames) for chain in chains])):
+            ran += len(keys)
+            if done is not None:
+                for key, _, _ in chain:
+                    done(key)
+    total = sum(len(chain) for chain in chains)
+    return ran, total - ran
@@ -0,0 +1,159 @@
+import json
+import queue
+import threading
+import time
+
+import numpy as np
+
+# Structured telemetry for runs, replacing the per-move prints of Grid.
+# A Telemetry attached to a Grid (Grid(..., telemetry=t)) receives one call per
+# applied move and emits records of four kinds:
+#   start     grid size, vacant cells and agents per race                (info)
+#   move      step, from/to cells, delta u and candidate count          (debug)
+#   progress  every `every` moves: moves/sec since the last progress
+#             record, candidate count, total utility, delta u             (info)
+#   end       on close: moves, wall time, overall moves/sec, total utility (info)
+# Records below `level` are dropped before they are built. They are written by
+# a background thread through a buffered file, either as JSON lines or as
+# fixed-size binary records (RECORD_DTYPE after a one-line JSON header),
+# readable with load_telemetry.
+
+LEVELS = {"debug": 10, "info": 20}
+
+KINDS = ["start", "move", "progress", "end"]
+
+RECORD_DTYPE = np.dtype([
+    ("kind", np.uint8), ("step", np.uint32),
+    ("from_i", np.int16), ("from_j", np.int16), ("to_i", np.int16), ("to_j", np.int16),
+    ("candidates", np.int32), ("delta_u", np.float64), ("total_utility", np.float64),
+    ("moves_per_sec", np.float64), ("seconds", np.float64),
+])
+
+# missing fields in binary records
+BINARY_DEFAULTS = {"from_i": -1, "from_j": -1, "to_i": -1, "to_j": -1, "candidates": -1,
+                   "delta_u": np.nan, "total_utility": np.nan, "moves_per_sec": np.nan, "seconds": np.nan}
+
+
+class Telemetry:
+    def __init__(self, path, format="jsonl", level="info", every=100, buffer_size=1 << 16, max_queue=4096):
+        if format not in ("jsonl", "binary"):
+            raise ValueError(f"Unknown telemetry format {format}")
+        if level not in LEVELS:
+            raise ValueError(f"Unknown telemetry level {level}")
+        self.path = path
+        self.format = format
+        self.level = LEVELS[level]
+        self.every = every
+        self.steps = 0
+        self._debug = self.level <= LEVELS["debug"]
+        self._grid = None
+        self._started = None
+        self._last_time = None
+        self._last_step = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._error = None
+
+        self._file = open(path, "wb", buffering=buffer_size)
+        if format == "binary":
+            header = {"dtype": RECORD_DTYPE.descr, "kinds": KINDS}
+            self._file.write((json.dumps(header) + "\n").encode())
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _emit(self, record):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(record)
+
+    def start(self, g):
+        self._grid = g
+        self._started = self._last_time = time.perf_counter()
+        counts = {c: int((g.types == idx + 1).sum()) for c, idx in g.color_dict.items()}
+        self._emit({"kind": "start", "step": 0, "N": g.N, "vacant": int((g.types == 0).sum()), "counts": counts})
+
+    def move(self, g, move, delta_u, candidates):
+        # Called by Grid after every applied move
+        if self._started is None:
+            self.start(g)
+        self.steps += 1
+        if self._debug:
+            (fi, fj), (ti, tj) = move
+            self._emit({"kind": "move", "step": self.steps, "from_i": fi, "from_j": fj, "to_i": ti, "to_j": tj,
+                        "delta_u": float(delta_u), "candidates": candidates})
+        if self.steps % self.every == 0:
+            now = time.perf_counter()
+            rate = (self.steps - self._last_step) / (now - self._last_time) if now > self._last_time else float("inf")
+            self._last_time, self._last_step = now, self.steps
+            self._emit({"kind": "progress", "step": self.steps, "moves_per_sec": rate, "candidates": candidates,
+                        "total_utility": float(g.total_utility()), "delta_u": float(delta_u)})
+
+    def close(self):
+        if self._grid is not None:
+            seconds = time.perf_counter() - self._started
+            self._queue.put({"kind": "end", "step": self.steps, "seconds": seconds,
+                             "moves_per_sec": self.steps / seconds if seconds > 0 else float("inf"),
+                             "total_utility": float(self._grid.total_utility())})
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _encode(self, records):
+        if self.format == "jsonl":
+            return "".join(json.dumps(r) + "\n" for r in records).encode()
+        out = np.zeros(len(records), dtype=RECORD_DTYPE)
+        for k, r in enumerate(records):
+            for field, default in BINARY_DEFAULTS.items():
+                out[k][field] = r.get(field, default)
+            out[k]["kind"] = KINDS.index(r["kind"])
+            out[k]["step"] = r["step"]
+        return out.tobytes()
+
+    def _write_loop(self):
+        # drains whatever is queued in one go, so a burst of moves is one write
+        done = False
+        while not done:
+            records = [self._queue.get()]
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if records[-1] is None:
+                done = True
+                records.pop()
+            if records and self._error is None:
+                try:
+                    self._file.write(self._encode(records))
+                except Exception as e:
+                    self._error = e
+
+
+def load_telemetry(path):
+    # List of record dicts from a JSONL or binary telemetry file; binary
+    # records come back with only the fields their kind carries
+    with open(path, "rb") as f:
+        first = f.readline()
+        if not first:
+            return []
+        header = json.loads(first) if first.startswith(b'{"dtype"') else None
+        if header is None:
+            return [json.loads(first)] + [json.loads(line) for line in f if line.strip()]
+        dtype = np.dtype([tuple(field) for field in header["dtype"]])
+        data = np.frombuffer(f.read(), dtype=dtype)
+    records = []
+    for row in data:
+        record = {"kind": header["kinds"][row["kind"]], "step": int(row["step"])}
+        for field, default in BINARY_DEFAULTS.items():
+            value = row[field].item()
+            if not (value == default or (isinstance(value, float) and np.isnan(value))):
+                record[field] = value
+        records.append(record)
+    return records
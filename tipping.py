@@ -0,0 +1,141 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import metriccomputations
+import runner
+from zhang import run
+
+# Tipping-point search over the parameters of zhang-segregation-threshold.py.
+# The script's model (black and white agents dislike every occupied neighbor,
+# orange agents gain PREFERENCE per white or orange neighbor and lose 1 per
+# black one, on a GRID_SIZE torus) is the Grid model with
+#   p = [[-1, -1, -1], [-1, -1, -1], [-1, PREFERENCE, PREFERENCE]]
+# over black, white, orange, the populations the script derives from ALPHA
+# (orange share of white + orange) and BETA (vacant fraction), and the
+# "vacancy" dynamics (see policies.py): agents only move into vacancies and
+# the best move over every agent and vacancy wins, ties broken as the
+# script's simulate_step does. script_config builds that runner config; from
+# the same board a run makes the script's moves (up to rounding when
+# PREFERENCE is not exact in binary).
+#
+# find_threshold locates where a segregation metric crosses a target level as
+# one parameter varies, by bisection on replica means: each midpoint is run
+# in batches of replicas (in worker processes, replica k seeded seed + k at
+# every point) until the confidence interval of its mean excludes the target,
+# and the bracket halves toward the side the mean falls on. The search stops
+# once the bracket is narrower than tol, or when a midpoint's interval still
+# straddles the target after max_replicas runs (the metric is within noise
+# of the target there, so it is the threshold to the precision the replicas
+# allow).
+#
+# Metrics are "interracial" (metriccomputations.interracialneighborratio over
+# the whole grid) or a result column of runner.METRIC_COLUMNS, averaged over
+# the races or for one race as "column:race" (e.g. "K_div:orange").
+
+SCRIPT_DEFAULTS = {"alpha": 0.25, "beta": 0.1, "preference": 10, "N": 25}
+
+PARAMETERS = ("alpha", "beta", "preference")
+
+
+def script_config(alpha=0.25, beta=0.1, preference=10, N=25, K=5, seed=0, backend="numpy"):
+    cells = N * N
+    vacant = int(beta * cells)
+    black = (cells - vacant) // 2
+    orange = int(alpha * black)
+    colors = {"black": black, "white": black - orange, "orange": orange}
+    p = [[-1, -1, -1], [-1, -1, -1], [-1, preference, preference]]
+    return {"N": N, "colors": colors, "p": p, "K": K, "seed": seed, "topology": "torus", "backend": backend,
+            "dynamics": "vacancy"}
+
+
+def metric_value(g, config, metric):
+    if metric == "interracial":
+        return metriccomputations.interracialneighborratio(g)
+    column, _, race = metric.partition(":")
+    if column not in runner.METRIC_COLUMNS:
+        raise ValueError(f"Unknown metric {metric}")
+    races = list(config["colors"])
+    metrics = metriccomputations.compute_metrics(g, races, config["K"])
+    key = runner.METRIC_COLUMNS[column]
+    if race:
+        return metrics[race][key]
+    return sum(metrics[r][key] for r in races) / len(races)
+
+
+def run_replica(job):
+    # one run to convergence in a worker process: (config, metric, max_steps) -> metric value
+    config, metric, max_steps = job
+    g = runner.make_grid(config)
+    run(g, max_steps=max_steps)
+    return metric_value(g, config, metric)
+
+
+def mean_and_error(values):
+    n = len(values)
+    mean = sum(values) / n
+    if n < 2:
+        return mean, math.inf
+    variance = sum((v - mean) ** 2 for v in values) / (n - 1)
+    return mean, math.sqrt(variance / n)
+
+
+class ReplicaPoint:
+    # replica values of the metric at one parameter value
+    def __init__(self, value):
+        self.value = value
+        self.values = []
+
+    def stats(self):
+        return mean_and_error(self.values)
+
+    def straddles(self, target, z):
+        mean, error = self.stats()
+        return abs(mean - target) <= z * error
+
+
+def find_threshold(param, lo, hi, target, metric="interracial", base=None, replicas=4, max_replicas=32,
+                   tol=0.05, z=1.96, workers=None, max_steps=None):
+    # Returns {"threshold", "bracket", "resolved", "runs", "points"}: resolved
+    # is False when the search stopped at a midpoint within noise of the
+    # target, points are (value, mean, standard error, replicas) in the order
+    # they were run
+    if param not in PARAMETERS:
+        raise ValueError(f"Unknown parameter {param}")
+    base = dict(SCRIPT_DEFAULTS, **(base or {}))
+    seed = base.pop("seed", 0)
+    points = []
+
+    def evaluate(pool, point, count):
+        start = len(point.values)
+        jobs = [(script_config(**dict(base, **{param: point.value}), seed=seed + k), metric, max_steps)
+                for k in range(start, start + count)]
+        point.values.extend(pool.map(run_replica, jobs))
+
+    def resolve(pool, value):
+        point = ReplicaPoint(value)
+        evaluate(pool, point, replicas)
+        while point.straddles(target, z) and len(point.values) < max_replicas:
+            evaluate(pool, point, min(len(point.values), max_replicas - len(point.values)))
+        points.append(point)
+        return point
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        low, high = resolve(pool, lo), resolve(pool, hi)
+        below = low.stats()[0] < target
+        if below == (high.stats()[0] < target):
+            raise ValueError(f"{metric} does not cross {target} between {param}={lo} and {param}={hi}")
+        threshold = None
+        while hi - lo > tol:
+            mid = resolve(pool, (lo + hi) / 2)
+            if mid.straddles(target, z):
+                threshold = mid.value
+                break
+            if (mid.stats()[0] < target) == below:
+                lo = mid.value
+            else:
+                hi = mid.value
+
+    return {"threshold": (lo + hi) / 2 if threshold is None else threshold, "bracket": (lo, hi),
+            "resolved": threshold is None,
+            "runs": sum(len(p.values) for p in points),
+            "points": [(p.value,) + p.stats() + (len(p.values),) for p in points]}
@@ -0,0 +1,118 @@
+import functools
+
+import numpy as np
+
+# Board geometries shared by Grid (utilities) and metriccomputations (metrics).
+# Cells are indexed (i, j) on an N x N board, or flat as i * N + j. A topology
+# is a neighbor offset set, whether the board wraps around (torus) and a
+# metric for distances:
+#   bounded            Moore neighborhood (8), edges are edges (Grid's default)
+#   torus              Moore neighborhood on a torus
+#   von_neumann        4 orthogonal neighbors, bounded
+#   torus_von_neumann  4 orthogonal neighbors on a torus
+#   hex                6 neighbors on a rhombus of hexagons (axial coordinates:
+#                      (i, j) sits at (j + i / 2, i * sqrt(3) / 2)), bounded
+#   torus_hex          the same rhombus wrapped around
+# Neighbor lists are precomputed once per (N, name) as CSR arrays (indptr,
+# indices over flat cells); the per-cell lists of (i, j) tuples the pure
+# Python loops use are built from them on first use. get_topology caches them.
+
+NEIGHBORHOODS = {
+    "moore": [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy],
+    "von_neumann": [(-1, 0), (0, -1), (0, 1), (1, 0)],
+    "hex": [(-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0)],
+}
+
+TOPOLOGIES = {
+    "bounded": ("moore", False),
+    "torus": ("moore", True),
+    "von_neumann": ("von_neumann", False),
+    "torus_von_neumann": ("von_neumann", True),
+    "hex": ("hex", False),
+    "torus_hex": ("hex", True),
+}
+
+
+class Topology:
+    def __init__(self, N, name="bounded"):
+        if name not in TOPOLOGIES:
+            raise ValueError(f"Unknown topology {name}")
+        self.N = N
+        self.name = name
+        self.neighborhood, self.wrap = TOPOLOGIES[name]
+        self.offsets = NEIGHBORHOODS[self.neighborhood]
+
+        # neighbor k of every cell in offset order, -1 off a bounded board
+        i, j = np.divmod(np.arange(N * N, dtype=np.int64), N)
+        neighbors = np.empty((N * N, len(self.offsets)), dtype=np.int64)
+        for k, (dx, dy) in enumerate(self.offsets):
+            ni, nj = i + dx, j + dy
+            if self.wrap:
+                neighbors[:, k] = (ni % N) * N + nj % N
+            else:
+                inside = (ni >= 0) & (ni < N) & (nj >= 0) & (nj < N)
+                neighbors[:, k] = np.where(inside, ni * N + nj, -1)
+        has = neighbors >= 0
+        self.indptr = np.zeros(N * N + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum(has.sum(axis=1))
+        self.indices = neighbors[has]
+        self._cells = None
+        self._distance_offsets = None
+
+    @property
+    def cells(self):
+        # cells[i * N + j] lists the (i, j) neighbors of cell (i, j); built on
+        # first use (the pure Python loops)
+        if self._cells is None:
+            pairs = list(zip(*(a.tolist() for a in np.divmod(self.indices, self.N))))
+            ptr = self.indptr.tolist()
+            self._cells = [pairs[ptr[c]:ptr[c + 1]] for c in range(self.N * self.N)]
+        return self._cells
+
+    def shift(self, x, y, dx, dy):
+        # cell at offset (dx, dy) from (x, y), or None off a bounded board
+        nx, ny = x + dx, y + dy
+        if self.wrap:
+            return nx % self.N, ny % self.N
+        if 0 <= nx < self.N and 0 <= ny < self.N:
+            return nx, ny
+        return None
+
+    def distance(self, dx, dy):
+        # length of offset (dx, dy) in the plane, ignoring wrap-around
+        if self.neighborhood == "hex":
+            return (dx * dx + dx * dy + dy * dy) ** 0.5
+        return (dx**2 + dy**2)**0.5
+
+    def offset_distance(self, dx, dy):
+        # distance between cells offset by (dx, dy); on a torus the shortest way round
+        if not self.wrap:
+            return self.distance(dx, dy)
+        if self.neighborhood == "hex":
+            return min(self.distance(dx + a * self.N, dy + b * self.N) for a in (-1, 0, 1) for b in (-1, 0, 1))
+        min_dx = min(abs(dx), self.N - abs(dx))
+        min_dy = min(abs(dy), self.N - abs(dy))
+        return (min_dx**2 + min_dy**2)**0.5
+
+    def distance_offsets(self):
+        # (dx, dy, distance) for every offset to another cell, nearest first
+        # (ties in dx, dy order); the search order of the distance metrics
+        if self._distance_offsets is None:
+            if self.wrap:
+                span = range(-self.N // 2, self.N // 2 + 1)
+            else:
+                span = range(-(self.N - 1), self.N)
+            offsets = [(dx, dy, self.offset_distance(dx, dy)) for dx in span for dy in span if dx or dy]
+            offsets.sort(key=lambda x: x[2])
+            self._distance_offsets = offsets
+        return self._distance_offsets
+
+    def k_offsets(self, K):
+        # offsets within distance K, the K-neighborhood of the diversity metrics
+        return [(dx, dy) for dx in range(-K, K + 1) for dy in range(-K, K + 1)
+                if (dx or dy) and self.distance(dx, dy) <= K]
+
+
+@functools.lru_cache(maxsize=None)
+def get_topology(N, name="bounded"):
+    return Topology(N, name)
@@ -0,0 +1,121 @@
+import numpy as np
+
+from topology import get_topology
+from zhang import board_repeated
+
+# Recording and replay of zhang.Grid runs.
+# A trajectory file (.npz) holds keyframes of the grid as type codes plus every
+# swap applied by next_step, so the grid at any step can be rebuilt by starting
+# from the nearest earlier keyframe and replaying the swaps after it.
+# Keyframes are copies of Grid.types (0 = vacant, color_dict index + 1 = race).
+# The grid's topology is stored by name so replayed metrics use the same geometry.
+
+VACANT = 'vacant'
+
+def type_names(color_dict):
+    names = [VACANT] * (len(color_dict) + 1)
+    for race, idx in color_dict.items():
+        names[idx + 1] = race
+    return names
+
+def decode_grid(codes, names):
+    return [[names[c] for c in row] for row in codes.tolist()]
+
+
+class Snapshot:
+    # Minimal stand-in for Grid with the attributes metriccomputations reads
+    def __init__(self, N, grid, topology=None):
+        self.N = N
+        self.grid = grid
+        self.topology = topology
+
+    def swap_cells(self, pos1, pos2):
+        i1, j1 = pos1
+        i2, j2 = pos2
+        self.grid[i1][j1], self.grid[i2][j2] = self.grid[i2][j2], self.grid[i1][j1]
+
+
+class TrajectoryRecorder:
+    def __init__(self, g, keyframe_every=100):
+        self.g = g
+        self.keyframe_every = keyframe_every
+        self.keyframes = [g.types.copy()]
+        self.keyframe_steps = [0]
+        self.moves = []
+
+    def record_move(self):
+        (from_x, from_y), (to_x, to_y) = self.g.last_move
+        self.moves.append((from_x, from_y, to_x, to_y))
+        if len(self.moves) % self.keyframe_every == 0:
+            self.keyframes.append(self.g.types.copy())
+            self.keyframe_steps.append(len(self.moves))
+
+    def save(self, path):
+        np.savez_compressed(path,
+                            N=self.g.N,
+                            topology=self.g.topology.name,
+                            names=np.array(type_names(self.g.color_dict)),
+                            races=np.array(list(self.g.colors.keys())),
+                            keyframes=np.stack(self.keyframes),
+                            keyframe_steps=np.array(self.keyframe_steps, dtype=np.int64),
+                            moves=np.array(self.moves, dtype=np.int32).reshape(-1, 4))
+
+
+def record_run(g, path, keyframe_every=100, max_steps=None):
+    # Runs g as zhang.run does and saves the trajectory to path
+    recorder = TrajectoryRecorder(g, keyframe_every)
+    steps = 0
+    seen = set()
+    board_repeated(g, seen)
+    while (max_steps is None or steps < max_steps) and g.next_step():
+        recorder.record_move()
+        steps += 1
+        if board_repeated(g, seen):
+            break
+    recorder.save(path)
+    return steps
+
+
+class Trajectory:
+    def __init__(self, path):
+        data = np.load(path)
+        self.N = int(data['N'])
+        # recordings from before topologies were stored ran on Grid's default
+        self.topology = get_topology(self.N, str(data['topology']) if 'topology' in data else "bounded")
+        self.names = [str(n) for n in data['names']]
+        self.races = [str(r) for r in data['races']]
+        self.keyframes = data['keyframes']
+        self.keyframe_steps = data['keyframe_steps']
+        self.moves = data['moves']
+        self.num_steps = len(self.moves)
+
+    def _start(self, step):
+        # index of the last keyframe at or before step
+        return int(np.searchsorted(self.keyframe_steps, step, side='right')) - 1
+
+    def grid_at(self, step):
+        return next(self.replay([step]))[1]
+
+    def replay(self, steps):
+        # Yields (step, Snapshot) for each requested step in increasing order,
+        # rolling forward from a single keyframe. The snapshot is updated in
+        # place, so copy it if it has to outlive the next iteration.
+        steps = sorted(steps)
+        if not steps:
+            return
+        if steps[0] < 0 or steps[-1] > self.num_steps:
+            raise ValueError(f"Steps must lie in [0, {self.num_steps}]")
+        k = self._start(steps[0])
+        current = int(self.keyframe_steps[k])
+        snap = Snapshot(self.N, decode_grid(self.keyframes[k], self.names), self.topology)
+        for step in steps:
+            k = self._start(step)
+            if self.keyframe_steps[k] > current:
+                # a later keyframe is closer than rolling forward
+                current = int(self.keyframe_steps[k])
+                snap = Snapshot(self.N, decode_grid(self.keyframes[k], self.names), self.topology)
+            while current < step:
+                from_x, from_y, to_x, to_y = self.moves[current].tolist()
+                snap.swap_cells((from_x, from_y), (to_x, to_y))
+                current += 1
+            yield step, snap
@@ -0,0 +1,123 @@
+import heapq
+
+import numpy as np
+
+# Vacant cells of a board or graph, kept up to date by swap_cells instead of
+# rescanning every cell for them.
+#   VacancySet     the vacant cells in an array, with O(1) add, remove and
+#                  membership through a cell -> slot index (removal moves the
+#                  last cell into the freed slot, so the order is arbitrary)
+#   VacancyHeaps   per type, a heap of the vacancies by the utility an agent of
+#                  that type would have there. A swap changes the utility of
+#                  every neighbor of the two cells; refresh(cells) pushes new
+#                  entries for the vacant ones and older entries are skipped
+#                  lazily when they reach the top, so best(a) is O(log V)
+#                  amortized.
+# Cells are flat indices (i * N + j on a grid, node ids on a graph) and types
+# are the type codes of kernels.py (1.. for the races).
+
+
+class VacancySet:
+    def __init__(self, types):
+        types = np.asarray(types).ravel()
+        self._cells = np.zeros(len(types), dtype=np.int64)
+        # slot of each vacant cell in _cells, -1 for occupied cells
+        self._slot = np.full(len(types), -1, dtype=np.int64)
+        self._size = 0
+        for c in np.flatnonzero(types == 0):
+            self.add(c)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, c):
+        return self._slot[c] >= 0
+
+    def __iter__(self):
+        return iter(self.cells().tolist())
+
+    def cells(self):
+        # the vacant cells (a view, valid until the next add or remove)
+        return self._cells[:self._size]
+
+    def add(self, c):
+        if self._slot[c] >= 0:
+            return
+        self._cells[self._size] = c
+        self._slot[c] = self._size
+        self._size += 1
+
+    def remove(self, c):
+        k = self._slot[c]
+        if k < 0:
+            return
+        self._size -= 1
+        last = self._cells[self._size]
+        self._cells[k] = last
+        self._slot[last] = k
+        self._slot[c] = -1
+
+    def update(self, c, new_type):
+        # cell c now holds new_type
+        if new_type == 0:
+            self.add(c)
+        else:
+            self.remove(c)
+
+
+class VacancyHeaps:
+    def __init__(self, vacancies, num_types, utilities):
+        # utilities(cells) -> array (num_types, len(cells)) of the utility of
+        # each type at each cell, like kernels.utilities on those columns
+        self.vacancies = vacancies
+        self.num_types = num_types
+        self.utilities = utilities
+        # entries are (-utility, cell, stamp); an entry is current while the
+        # cell is vacant and stamp[cell] has not moved on
+        self._stamp = np.zeros(len(vacancies._slot), dtype=np.int64)
+        self._heaps = [[] for _ in range(num_types)]
+        self.rebuild()
+
+    def rebuild(self):
+        cells = self.vacancies.cells().copy()
+        U = self.utilities(cells)
+        for a in range(1, self.num_types):
+            heap = [(-float(u), int(c), int(self._stamp[c])) for u, c in zip(U[a], cells)]
+            heapq.heapify(heap)
+            self._heaps[a] = heap
+
+    def refresh(self, cells):
+        # cells whose utilities (or vacancy) changed
+        cells = np.unique(np.asarray(cells, dtype=np.int64))
+        self._stamp[cells] += 1
+        cells = cells[self.vacancies._slot[cells] >= 0]
+        if not len(cells):
+            return
+        U = self.utilities(cells)
+        for a in range(1, self.num_types):
+            heap = self._heaps[a]
+            for u, c in zip(U[a], cells):
+                heapq.heappush(heap, (-float(u), int(c), int(self._stamp[c])))
+        # stale entries pile up; start over once they outnumber the current ones
+        if len(self._heaps[1]) > 4 * len(self.vacancies) + 64:
+            self.rebuild()
+
+    def best(self, a):
+        # (utility, cell) of the best vacancy for type a, ties to the lowest
+        # cell, or None when there are no vacancies
+        heap = self._heaps[a]
+        while heap:
+            u, c, stamp = heap[0]
+            if stamp == self._stamp[c] and c in self.vacancies:
+                return -u, c
+            heapq.heappop(heap)
+        return None
+
+    def best_utilities(self):
+        # best vacancy utility per type (index 0 unused), -inf without vacancies
+        out = np.full(self.num_types, -np.inf)
+        for a in range(1, self.num_types):
+            top = self.best(a)
+            if top is not None:
+                out[a] = top[0]
+        return out
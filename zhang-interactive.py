@@ -1,11 +1,20 @@
+import threading
+import time
 import pygame
 import numpy as np
+from renderer import MAX_WINDOW, Viewport
+from simthread import handle_key, status
 
 # Constants
 GRID_SIZE = 20
 CELL_SIZE = 30
-WIDTH = HEIGHT = GRID_SIZE * CELL_SIZE
+WIDTH = HEIGHT = min(GRID_SIZE * CELL_SIZE, MAX_WINDOW)
 FPS = 30
+# auto-play moves per second (space toggles auto-play, +/- and 0 as in the
+# other front ends), None runs as fast as possible
+SPEED = FPS
+# print every move applied
+VERBOSE = True
 PREFERENCE = 1.0  # y = p - 1 in Zhang's model
 BETA = 2.0
 
@@ -53,65 +62,188 @@ def move_decision(delta_u):
 def initialize_grid():
     return [[VACANT for _ in range(GRID_SIZE)] for _ in range(GRID_SIZE)]
 
-def simulate_step(grid):
-    candidates = []
-    for i in range(GRID_SIZE):
-        for j in range(GRID_SIZE):
-            agent = grid[i][j]
-            if agent in (BLACK, WHITE):
-                u_old = utility_black(i, j, grid) if agent == BLACK else utility_white(i, j, grid)
-                for ni in range(GRID_SIZE):
-                    for nj in range(GRID_SIZE):
-                        if grid[ni][nj] == VACANT:
-                            grid_copy = [row[:] for row in grid]
-                            grid_copy[ni][nj] = agent
-                            grid_copy[i][j] = VACANT
-                            u_new = utility_black(ni, nj, grid_copy) if agent == BLACK else utility_white(ni, nj, grid_copy)
-                            delta_u = u_new - u_old
-                            if delta_u > 0:
-                                candidates.append((delta_u, u_old, u_new, (i, j), (ni, nj)))
-
-    if candidates:
-        candidates.sort(reverse=True, key=lambda x: x[0])  # Prioritize biggest utility gain
-        delta_u, u_old, u_new, (from_x, from_y), (to_x, to_y) = candidates[0]
-        print(f"Move from ({from_x}, {from_y}) to ({to_x}, {to_y}) | Previous Utility: {u_old:.2f}, New Utility: {u_new:.2f}, Change: {delta_u:.2f}")
-        grid[to_x][to_y] = grid[from_x][from_y]
-        grid[from_x][from_y] = VACANT
-
-    return grid
-
-def draw_grid(screen, grid):
-    for i in range(GRID_SIZE):
-        for j in range(GRID_SIZE):
-            pygame.draw.rect(screen, COLORS[grid[i][j]], (j * CELL_SIZE, i * CELL_SIZE, CELL_SIZE, CELL_SIZE))
-            pygame.draw.rect(screen, (100, 100, 100), (j * CELL_SIZE, i * CELL_SIZE, CELL_SIZE, CELL_SIZE), 1)
+# Vectorized utilities of agent at cells with the given neighbor counts
+def utility(agent, black_neighbors, white_neighbors):
+    if agent == BLACK:
+        return 10 - (black_neighbors + white_neighbors)
+    return 10 + PREFERENCE * white_neighbors - black_neighbors
+
+# Moore neighbors of every flat cell on the torus, as an (N*N, 8) array
+def neighbor_table():
+    i, j = np.divmod(np.arange(GRID_SIZE * GRID_SIZE), GRID_SIZE)
+    return np.stack([((i + dx) % GRID_SIZE) * GRID_SIZE + (j + dy) % GRID_SIZE
+                     for dx in [-1, 0, 1] for dy in [-1, 0, 1] if dx or dy], axis=1)
+
+# The model's move: of every agent tried in every vacancy, the largest gain,
+# ties to the first agent and then the first vacancy in row-major order; as
+# (delta_u, u_old, u_new, from, to) over flat cells, or None. counts[t, c] is
+# the number of neighbors of c with type t. Moving an agent vacates its cell,
+# so a vacancy next to it counts one agent of its type less; every other
+# vacancy keeps its counts, and the best of those is among the 9 best
+# vacancies overall (at most 8 are neighbors). Each agent is scored against
+# those 9 and its vacant neighbors: O(N^2) per step instead of agents x
+# vacancies utility evaluations.
+def best_move(types, counts, neighbors):
+    vacant = np.flatnonzero(types == VACANT)
+    best = None
+    if not len(vacant):
+        return None
+    for agent in (BLACK, WHITE):
+        cells = np.flatnonzero(types == agent)
+        if not len(cells):
+            continue
+        u_old = utility(agent, counts[BLACK, cells], counts[WHITE, cells])
+        u_vacant = utility(agent, counts[BLACK, vacant], counts[WHITE, vacant])
+        order = np.lexsort((vacant, -u_vacant))[:9]
+        top = vacant[order]
+        near = neighbors[cells]
+        adjacent = (near[:, :, None] == top[None, None, :]).any(axis=1)
+        u_near = utility(agent, counts[BLACK, near] - (agent == BLACK), counts[WHITE, near] - (agent == WHITE))
+        values = np.concatenate([np.where(adjacent, -np.inf, u_vacant[order]),
+                                 np.where(types[near] == VACANT, u_near, -np.inf)], axis=1)
+        targets = np.concatenate([np.broadcast_to(top, adjacent.shape), near], axis=1)
+        u_new = values.max(axis=1)
+        to = np.where(values == u_new[:, None], targets, len(types)).min(axis=1)
+        delta = u_new - u_old
+        k = int(np.argmax(delta))
+        if delta[k] > 0 and (best is None or delta[k] > best[0] or (delta[k] == best[0] and cells[k] < best[3])):
+            best = (float(delta[k]), float(u_old[k]), float(u_new[k]), int(cells[k]), int(to[k]))
+    return best
+
+class Solver(threading.Thread):
+    # The board as type codes with every cell's neighbor counts, updated in
+    # O(1) as cells are painted or moved. A background thread recomputes the
+    # best move whenever the board changes, so the -> key applies a move that
+    # is already known; with auto-play on (not paused) the thread also applies
+    # moves at rate per second. rate, steps, finished, paused and
+    # toggle_pause follow simthread.SimulationThread, for handle_key and status.
+    def __init__(self, rate=SPEED):
+        super().__init__(daemon=True)
+        self.types = np.full(GRID_SIZE * GRID_SIZE, VACANT, dtype=np.int8)
+        self.neighbors = neighbor_table()
+        self.counts = np.zeros((len(COLORS), GRID_SIZE * GRID_SIZE), dtype=np.int32)
+        self.counts[VACANT] = 8
+        self.rate = rate
+        self.steps = 0
+        self.autoplay = False
+        # the board changes version on every paint and move; move is the best
+        # move of board known
+        self.version = 0
+        self.known = -1
+        self.move = None
+        self.changed = threading.Condition()
+        self.halted = False
+
+    @property
+    def finished(self):
+        return self.known == self.version and self.move is None
+
+    @property
+    def paused(self):
+        return not self.autoplay
+
+    def toggle_pause(self):
+        with self.changed:
+            self.autoplay = not self.autoplay
+            self.changed.notify()
+
+    def stop(self):
+        with self.changed:
+            self.halted = True
+            self.changed.notify()
+
+    def snapshot(self):
+        with self.changed:
+            return self.types.reshape(GRID_SIZE, GRID_SIZE).copy()
+
+    def _set(self, cell, agent):
+        self.counts[self.types[cell], self.neighbors[cell]] -= 1
+        self.counts[agent, self.neighbors[cell]] += 1
+        self.types[cell] = agent
+
+    def paint(self, x, y, agent):
+        with self.changed:
+            cell = x * GRID_SIZE + y
+            if self.types[cell] != agent:
+                self._set(cell, agent)
+                self.version += 1
+                self.changed.notify()
+
+    def step(self):
+        # applies the best move (computing it here if the thread has not yet);
+        # returns False when no agent can improve
+        with self.changed:
+            if self.known != self.version:
+                self.move, self.known = best_move(self.types, self.counts, self.neighbors), self.version
+            if self.move is None:
+                return False
+            delta_u, u_old, u_new, source, target = self.move
+            if VERBOSE:
+                (from_x, from_y), (to_x, to_y) = divmod(source, GRID_SIZE), divmod(target, GRID_SIZE)
+                print(f"Move from ({from_x}, {from_y}) to ({to_x}, {to_y}) | Previous Utility: {u_old:.2f}, New Utility: {u_new:.2f}, Change: {delta_u:.2f}")
+            self._set(target, self.types[source])
+            self._set(source, VACANT)
+            self.version += 1
+            self.steps += 1
+            self.changed.notify()
+            return True
+
+    def run(self):
+        due = time.perf_counter()
+        while True:
+            with self.changed:
+                while not self.halted and self.known == self.version and (not self.autoplay or self.move is None):
+                    self.changed.wait()
+                if self.halted:
+                    return
+                version = self.version
+                board = None
+                if self.known != version:
+                    board = (self.types.copy(), self.counts.copy())
+            if board is not None:
+                move = best_move(*board, self.neighbors)
+                with self.changed:
+                    if self.version == version:
+                        self.move, self.known = move, version
+                continue
+            if self.rate:
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    # painting or pausing meanwhile wakes the thread early
+                    with self.changed:
+                        self.changed.wait(delay)
+                    continue
+                due = max(due + 1.0 / self.rate, time.perf_counter())
+            self.step()
 
 def main():
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
     pygame.display.set_caption("Zhang's Segregation Model")
     clock = pygame.time.Clock()
+    renderer = Viewport(GRID_SIZE, [COLORS[c] for c in sorted(COLORS)], (WIDTH, HEIGHT), zoom=CELL_SIZE)
 
-    grid = initialize_grid()
+    solver = Solver()
+    solver.start()
     running = True
     paint_mode = None  # None, WHITE, or BLACK
 
     while running:
-        screen.fill((0, 0, 0))
-        draw_grid(screen, grid)
-        pygame.display.flip()
+        pygame.display.update(renderer.draw(screen, solver.snapshot()))
+        pygame.display.set_caption(f"Zhang's Segregation Model | {status(solver, FPS)}")
         clock.tick(FPS)
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif renderer.handle_event(event):
+                pass
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_RIGHT:
-                    grid = simulate_step(grid)
+                    solver.step()
+                else:
+                    handle_key(solver, event.key, FPS)
             elif event.type == pygame.MOUSEBUTTONDOWN:
-                x, y = pygame.mouse.get_pos()
-                grid_x = y // CELL_SIZE
-                grid_y = x // CELL_SIZE
                 if event.button == 1:  # Left click starts white paint
                     paint_mode = WHITE
                 elif event.button == 3:  # Right click starts black paint
@@ -121,12 +253,13 @@ def main():
                 paint_mode = None
 
             elif event.type == pygame.MOUSEMOTION and paint_mode is not None:
-                x, y = pygame.mouse.get_pos()
-                grid_x = y // CELL_SIZE
-                grid_y = x // CELL_SIZE
-                if 0 <= grid_x < GRID_SIZE and 0 <= grid_y < GRID_SIZE:
-                    grid[grid_x][grid_y] = paint_mode
+                # the viewport zooms and pans (wheel, middle-drag), so cells
+                # come from it rather than from CELL_SIZE
+                cell = renderer.cell_at(*pygame.mouse.get_pos())
+                if cell is not None:
+                    solver.paint(*cell, paint_mode)
 
+    solver.stop()
     pygame.quit()
 
 if __name__ == '__main__':
@@ -1,13 +1,19 @@
 import pygame
 import numpy as np
 import random
+from renderer import MAX_WINDOW, Viewport
+from simthread import SimulationThread, handle_key, status
 
 # Constants
 FPS = 30
+# moves per second, None runs as fast as possible
+SPEED = None
+# print every move and the interracial ratio after it (recomputed over the whole grid)
+VERBOSE = False
 
 GRID_SIZE = 25
 CELL_SIZE = 20
-WIDTH = HEIGHT = GRID_SIZE * CELL_SIZE
+WIDTH = HEIGHT = min(GRID_SIZE * CELL_SIZE, MAX_WINDOW)
 
 PREFERENCE = 10  # homophilic preference for orange agents
 
@@ -105,30 +111,23 @@ def utility_orange(x, y, grid):
     black_neighbors = sum(1 for n in neighbors if n == BLACK)
     return 10 + PREFERENCE * white_neighbors - black_neighbors
 
-# Initialize grid with random agent placement
+# Initialize grid with random agent placement: the agents in order (black,
+# white, orange) go to the cells of a shuffled list of flat indices, the same
+# cells a shuffled list of (i, j) positions would give
 def initialize_grid():
-    total_agents = NUM_BLACK + NUM_WHITE + NUM_ORANGE
-    positions = [(i, j) for i in range(GRID_SIZE) for j in range(GRID_SIZE)]
+    positions = list(range(GRID_SIZE * GRID_SIZE))
     random.shuffle(positions)
 
-    grid = [[VACANT for _ in range(GRID_SIZE)] for _ in range(GRID_SIZE)]
-    idx = 0
-    for _ in range(NUM_BLACK):
-        x, y = positions[idx]
-        grid[x][y] = BLACK
-        idx += 1
-    for _ in range(NUM_WHITE):
-        x, y = positions[idx]
-        grid[x][y] = WHITE
-        idx += 1
-    for _ in range(NUM_ORANGE):
-        x, y = positions[idx]
-        grid[x][y] = ORANGE
-        idx += 1
-    return grid
+    cells = np.full(GRID_SIZE * GRID_SIZE, VACANT, dtype=np.int8)
+    agents = np.repeat(np.array([BLACK, WHITE, ORANGE], dtype=np.int8), [NUM_BLACK, NUM_WHITE, NUM_ORANGE])
+    cells[positions[:len(agents)]] = agents
+    return cells.reshape(GRID_SIZE, GRID_SIZE).tolist()
 
 def simulate_step(grid):
     candidates = []
+    # the vacant cells, found once per step; each agent is tried in each of
+    # them in place and put back
+    vacancies = [(i, j) for i in range(GRID_SIZE) for j in range(GRID_SIZE) if grid[i][j] == VACANT]
     for i in range(GRID_SIZE):
         for j in range(GRID_SIZE):
             agent = grid[i][j]
@@ -140,59 +139,60 @@ def simulate_step(grid):
                 else:
                     u_old = utility_orange(i, j, grid)
 
-                for ni in range(GRID_SIZE):
-                    for nj in range(GRID_SIZE):
-                        if grid[ni][nj] == VACANT:
-                            grid_copy = [row[:] for row in grid]
-                            grid_copy[ni][nj] = agent
-                            grid_copy[i][j] = VACANT
-                            if agent == BLACK:
-                                u_new = utility_black(ni, nj, grid_copy)
-                            elif agent == WHITE:
-                                u_new = utility_white(ni, nj, grid_copy)
-                            else:
-                                u_new = utility_orange(ni, nj, grid_copy)
-                            delta_u = u_new - u_old
-                            if delta_u > 0:
-                                candidates.append((delta_u, u_old, u_new, (i, j), (ni, nj)))
+                grid[i][j] = VACANT
+                for ni, nj in vacancies:
+                    grid[ni][nj] = agent
+                    if agent == BLACK:
+                        u_new = utility_black(ni, nj, grid)
+                    elif agent == WHITE:
+                        u_new = utility_white(ni, nj, grid)
+                    else:
+                        u_new = utility_orange(ni, nj, grid)
+                    grid[ni][nj] = VACANT
+                    delta_u = u_new - u_old
+                    if delta_u > 0:
+                        candidates.append((delta_u, u_old, u_new, (i, j), (ni, nj)))
+                grid[i][j] = agent
 
     if candidates:
         candidates.sort(reverse=True, key=lambda x: x[0])
         delta_u, u_old, u_new, (from_x, from_y), (to_x, to_y) = candidates[0]
-        print(f"Move from ({from_x}, {from_y}) to ({to_x}, {to_y}) | Previous Utility: {u_old:.2f}, New Utility: {u_new:.2f}, Change: {delta_u:.2f}")
-        print('RATIO OF INTERRACIAL NEIGHBORS:' + str(interracialneighborratio(grid)))
+        if VERBOSE:
+            print(f"Move from ({from_x}, {from_y}) to ({to_x}, {to_y}) | Previous Utility: {u_old:.2f}, New Utility: {u_new:.2f}, Change: {delta_u:.2f}")
+            print('RATIO OF INTERRACIAL NEIGHBORS:' + str(interracialneighborratio(grid)))
         grid[to_x][to_y] = grid[from_x][from_y]
         grid[from_x][from_y] = VACANT
         return True
     return False
 
-def draw_grid(screen, grid):
-    for i in range(GRID_SIZE):
-        for j in range(GRID_SIZE):
-            pygame.draw.rect(screen, COLORS[grid[i][j]], (j * CELL_SIZE, i * CELL_SIZE, CELL_SIZE, CELL_SIZE))
-            pygame.draw.rect(screen, (100, 100, 100), (j * CELL_SIZE, i * CELL_SIZE, CELL_SIZE, CELL_SIZE), 1)
-
 def main():
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
     pygame.display.set_caption("Zhang's Segregation Model")
     clock = pygame.time.Clock()
+    renderer = Viewport(GRID_SIZE, [COLORS[c] for c in sorted(COLORS)], (WIDTH, HEIGHT), zoom=CELL_SIZE)
 
     grid = initialize_grid()
+    # the simulation runs on its own thread; FPS only paces the display
+    sim = SimulationThread(lambda: simulate_step(grid), lambda: np.array(grid, dtype=np.int8), rate=SPEED)
+    sim.start()
     running = True
 
     while running:
-        screen.fill((0, 0, 0))
-        draw_grid(screen, grid)
-        pygame.display.flip()
+        snapshot, _ = sim.latest()
+        pygame.display.update(renderer.draw(screen, snapshot))
+        pygame.display.set_caption(f"Zhang's Segregation Model | {status(sim, FPS)}")
         clock.tick(FPS)
 
-        simulate_step(grid)
-
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif renderer.handle_event(event):
+                pass
+            elif event.type == pygame.KEYDOWN:
+                handle_key(sim, event.key, FPS)
 
+    sim.stop()
     pygame.quit()
 
 if __name__ == '__main__':
@@ -1,49 +1,106 @@
-from enum import Enum
-from itertools import product
-import random
-import math
-import pygame
+import numpy as np
+import kernels
+import placement
+import policies
+import profiling
+from policies import FirstImproving
+from vacancies import VacancySet, VacancyHeaps
+from topology import get_topology
+# pygame and the renderer are imported inside the drawing functions, so headless
+# runs and sweep workers import only the simulation core
 
 # Simulating Zhang's model of segregation https://wordpress.clarku.edu/wp-content/uploads/sites/423/2016/03/segregation.pdf
 
 
 
 
+# step and metric implementations a Grid can be built with, see Grid.__init__
+BACKENDS = ("python", "numpy", "numba")
+
 class Grid:
-    def __init__(self, N,p,color_dict,colors):
+    def __init__(self, N,p,color_dict,colors, verbose=False, telemetry=None, backend="python", topology="bounded", prune=True,
+                 policy="best", start="shuffle"):
         self.N = N
-        self.grid = [[None for _ in range(N)] for _ in range(N)]
+        # board geometry for utilities and metrics, see topology.py
+        self.topology = get_topology(N, topology) if isinstance(topology, str) else topology
         self.p = p
         self.color_dict = color_dict
         self.colors = colors
+        # (from, to) of the last swap applied by next_step, used by trajectory recording
+        self.last_move = None
+        # print counts and every move to stdout (the old behavior); structured
+        # records go to telemetry, a telemetry.Telemetry or None
+        self.verbose = verbose
+        self.telemetry = telemetry
+        # "python" runs the scan below over the string grid; "numba" and "numpy"
+        # run the kernels.py versions over type codes and neighbor counts kept
+        # up to date by swap_cells ("numba" falls back to "numpy" when numba is
+        # not installed)
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend}")
+        if backend == "numba" and not kernels.HAVE_NUMBA:
+            backend = "numpy"
+        self.backend = backend
+        # kernel backends find the best move by branch and bound (kernels.best_move)
+        # unless prune is False; both give the same move
+        self.prune = prune
 
         total_cells = N * N
         num_vacant = total_cells - sum(colors.values())
-        print(num_vacant)
+        if verbose:
+            print(num_vacant)
         if num_vacant < 0:
             raise ValueError("There are no vacant cells!")
-        
-        # create cell types
-        vacancies = ["vacant"]*num_vacant
-        l = [[i]*colors[i] for i in colors.keys()]
-        cells = [x for sublist in l for x in sublist]
-        cells.extend(vacancies)
-        
 
-        random.shuffle(cells)
-        count = 0
-        for i in cells:
-            if i == "orange":
-                count += 1
-        print(count)
-
-        # Assign types and deltas
-        idx = 0
-        for i in range(N):
-            for j in range(N):
-                cell_type = cells[idx]
-                self.grid[i][j] = cell_type
-                idx += 1
+        # types holds the board as integer codes: 0 = vacant, color_dict[c] + 1 = color c,
+        # drawn by placement.place from start (a kind name or {"kind": ..., options},
+        # see placement.py); grid mirrors it as color names
+        counts = [0] * len(color_dict)
+        for c, n in colors.items():
+            counts[color_dict[c]] = n
+        self.start = start
+        self.types = placement.place(start, N, counts)
+        if verbose:
+            print(int(np.count_nonzero(self.types == color_dict["orange"] + 1)) if "orange" in color_dict else 0)
+        self.grid = self._names()[self.types].tolist()
+        self.counts = None
+        self.P = kernels.padded_p(p)
+        if backend != "python":
+            self.counts = kernels.neighbor_counts(self.types.ravel(), self.topology.indptr, self.topology.indices,
+                                                  len(color_dict) + 1)
+        # vacant cells (flat indices), kept by swap_cells; the per-type heaps of
+        # the best vacancies are built on first use (best_vacancy, or the pruned
+        # kernel scan) and kept from then on
+        self.vacancies = VacancySet(self.types)
+        # which improving move a step applies, see policies.py (seeded after
+        # the placement, so every policy starts from the same board)
+        self.policy = policies.get_policy(policy)
+        self.vacancy_heaps = None
+        if backend != "python" and prune:
+            self._vacancy_heaps()
+        if telemetry is not None:
+            telemetry.start(self)
+
+    def set_types(self, types):
+        # Replaces the board with the given type codes (N x N or flat), e.g. the
+        # equilibrium of an earlier run to continue from
+        self.types = np.array(types, dtype=np.int8).reshape(self.N, self.N)
+        self.grid = self._names()[self.types].tolist()
+        if self.counts is not None:
+            self.counts = kernels.neighbor_counts(self.types.ravel(), self.topology.indptr, self.topology.indices,
+                                                  len(self.color_dict) + 1)
+        self.vacancies = VacancySet(self.types)
+        if self.vacancy_heaps is not None:
+            self.vacancy_heaps = None
+            self._vacancy_heaps()
+
+    def _names(self):
+        # color name of every type code, indexable by the types array
+        names = np.empty(len(self.color_dict) + 1, dtype=object)
+        names[0] = "vacant"
+        for c, idx in self.color_dict.items():
+            names[idx + 1] = c
+        return names
 
     def get_deltas_for_type(self, cell_type):
         if cell_type == "vacant":
@@ -54,33 +111,54 @@ class Grid:
         i1, j1 = pos1
         i2, j2 = pos2
         self.grid[i1][j1], self.grid[i2][j2] = self.grid[i2][j2], self.grid[i1][j1]
-
-    def get_neighborhood(self, pos, neigh_type = "vn"):
+        self.types[i1, j1], self.types[i2, j2] = self.types[i2, j2], self.types[i1, j1]
+        if self.types[i1, j1] == self.types[i2, j2]:
+            return
+        c1, c2 = i1 * self.N + j1, i2 * self.N + j2
+        indptr, indices = self.topology.indptr, self.topology.indices
+        if self.counts is not None:
+            kernels.update_counts(self.counts, indptr, indices, c1, int(self.types[i2, j2]), int(self.types[i1, j1]))
+            kernels.update_counts(self.counts, indptr, indices, c2, int(self.types[i1, j1]), int(self.types[i2, j2]))
+        self.vacancies.update(c1, self.types[i1, j1])
+        self.vacancies.update(c2, self.types[i2, j2])
+        if self.vacancy_heaps is not None:
+            self.vacancy_heaps.refresh(np.concatenate([[c1, c2], indices[indptr[c1]:indptr[c1 + 1]],
+                                                       indices[indptr[c2]:indptr[c2 + 1]]]))
+
+    def _vacancy_utilities(self, cells):
+        # utility of every type at the given flat cells
+        if self.counts is not None:
+            return self.P @ self.counts[:, cells]
+        types = self.types.ravel()
+        indptr, indices = self.topology.indptr, self.topology.indices
+        counts = np.zeros((len(self.P), len(cells)), dtype=np.int32)
+        for k, c in enumerate(cells):
+            counts[:, k] = np.bincount(types[indices[indptr[c]:indptr[c + 1]]], minlength=len(self.P))
+        return self.P @ counts
+
+    def _vacancy_heaps(self):
+        if self.vacancy_heaps is None:
+            self.vacancy_heaps = VacancyHeaps(self.vacancies, len(self.P), self._vacancy_utilities)
+        return self.vacancy_heaps
+
+    def best_vacancy(self, cell_type):
+        # (utility, (i, j)) of the vacancy where an agent of cell_type would have
+        # the highest utility (ties to the first cell in row-major order), or
+        # None without vacancies. An agent already next to that vacancy would
+        # not count itself there.
+        top = self._vacancy_heaps().best(self.color_dict[cell_type] + 1)
+        if top is None:
+            return None
+        return top[0], divmod(top[1], self.N)
+
+    def get_neighborhood(self, pos):
+        # neighbor cells of pos under self.topology (a shared list, do not modify)
         x_pos,y_pos = pos
-        neigh = []
-        temp_x = []
-        temp_y = []
-        if x_pos != 0:
-            neigh.append((x_pos - 1,y_pos))
-            temp_x.append(x_pos - 1)
-        if x_pos != N-1:
-            neigh.append((x_pos + 1, y_pos))
-            temp_x.append(x_pos + 1)
-        if y_pos != 0:
-            neigh.append((x_pos, y_pos - 1))
-            temp_y.append(y_pos - 1)
-        if y_pos != N-1:
-            neigh.append((x_pos,y_pos + 1))
-            temp_y.append(y_pos + 1)
-        if neigh_type == "moore":
-            res = list(product(temp_x,temp_y))
-            neigh.extend(res)
-    
-        return neigh
+        return self.topology.cells[x_pos * self.N + y_pos]
 
     def get_utility(self, cell_type,pos):
         deltas = self.get_deltas_for_type(cell_type)
-        neigh = self.get_neighborhood(pos, neigh_type="moore")
+        neigh = self.get_neighborhood(pos)
         utility = 0
         for (i,j) in neigh:
             if self.grid[i][j] == "vacant":
@@ -98,39 +176,146 @@ class Grid:
         
 
     
-    def improving_move_then_swap(self):
-        u_move = 0
-        u_stay = 0
-        flag = False
-        candidates = []
+    def total_utility(self):
+        # Sum of get_utility over all agents, computed from the type codes
+        P = kernels.padded_p(self.p)
+        types = self.types.ravel().astype(np.intp)
+        owners = np.repeat(types, np.diff(self.topology.indptr))
+        return P[owners, types[self.topology.indices]].sum()
+
+    def _scan_pair_count(self):
+        # Number of pairs the scan in improving_move_then_swap evaluates:
+        # every (i, j) with every (k, l), k >= i and l > j, except
+        # vacant/vacant pairs
+        N = self.N
+        vacant = (self.types == 0).astype(np.int64)
+        # vacancies at k >= i, l > j of each cell
+        after = np.zeros((N + 1, N + 1), dtype=np.int64)
+        after[:N, :N] = vacant[::-1, ::-1].cumsum(axis=0).cumsum(axis=1)[::-1, ::-1]
+        vacant_pairs = int((vacant * after[:N, 1:N + 1]).sum())
+        return (N * (N + 1) // 2) * (N * (N - 1) // 2) - vacant_pairs
+
+    def _scan_pairs(self):
+        # the scan order: every (i, j) with every (k, l), k >= i and l > j,
+        # skipping pairs of vacancies
+        N = self.N
         for i in range(N):
             for j in range(N):
-                cell_type_1 = self.grid[i][j]
-                for k in range(i,N):
-                    for l in range(j+1, N):
-                        cell_type_2 = self.grid[k][l]
+                vacant = self.grid[i][j] == "vacant"
+                for k in range(i, N):
+                    for l in range(j + 1, N):
+                        if vacant and self.grid[k][l] == "vacant":
+                            continue
+                        yield (i, j), (k, l)
 
+    def _vacancy_pairs(self):
+        # the "vacancy" policy's order: every agent in row-major order with
+        # every vacancy in row-major order
+        N = self.N
+        vacancies = [(k, l) for k in range(N) for l in range(N) if self.grid[k][l] == "vacant"]
+        for i in range(N):
+            for j in range(N):
+                if self.grid[i][j] != "vacant":
+                    for pos2 in vacancies:
+                        yield (i, j), pos2
+
+    def pair_move(self, pos1, pos2):
+        # (delta, u_stay, u_move) when the pair pos1 before pos2 in the scan is
+        # an improving move: an agent moving into a vacancy, or two agents
+        # trading places where both improve (the delta is that of pos1);
+        # None otherwise
+        cell_type_1 = self.get_type(pos1)
+        cell_type_2 = self.get_type(pos2)
+        if (cell_type_1 == "vacant" and cell_type_2 == "vacant"):
+            return None
+        elif (cell_type_1 != "vacant" and cell_type_2 == "vacant"):
+            u_stay, u_move = self.improving_utility(pos1, pos2)
+        elif (cell_type_1 == "vacant" and cell_type_2 != "vacant"):
+            u_stay, u_move = self.improving_utility(pos2, pos1)
+        else:
+            u_stay, u_move = self.improving_utility(pos1, pos2)
+            u_stay_2, u_move_2 = self.improving_utility(pos2, pos1)
+            if not u_move_2 > u_stay_2:
+                return None
+        if (u_move > u_stay):
+            return (u_move - u_stay, u_stay, u_move)
+        return None
 
-                        if (cell_type_1 == "vacant" and cell_type_2 == "vacant"):
-                            continue
-                        elif (cell_type_1 != "vacant" and cell_type_2 == "vacant"):
-                            u_stay, u_move = self.improving_utility((i,j),(k,l))
-                        elif (cell_type_1 == "vacant" and cell_type_2 != "vacant"):
-                            u_stay, u_move = self.improving_utility((k,l),(i,j))
-                        if (u_move > u_stay):
-                            candidates.append((u_move-u_stay, u_stay, u_move, (i, j), (k, l)))
-                        if(cell_type_1 != "vacant" and cell_type_2 != "vacant"):
-                            u_stay_1,u_move_1 = self.improving_utility((i,j), (k,l))
-                            u_stay_2,u_move_2 = self.improving_utility((k,l), (i,j))
-                            if(u_move_1 > u_stay_1 and u_move_2 > u_stay_2):
-                                candidates.append((u_move_1-u_stay_1,u_stay_1, u_move_1, (i, j), (k, l)))
-        if candidates:
-            candidates.sort(reverse=True, key=lambda x: x[0])
-            delta_u, u_old, u_new, (from_x, from_y), (to_x, to_y) = candidates[0]
+    def improving_move_then_swap(self):
+        if self.backend != "python":
+            return self._kernel_move_then_swap()
+        prof = profiling.active
+        if prof is not None:
+            t = prof.begin()
+        policy = self.policy
+        policy.start()
+        evaluated = 0
+        pairs = policy.sample_pairs(self.N * self.N, self.N)
+        if pairs is not None:
+            for p, q in pairs:
+                pos1, pos2 = divmod(int(p), self.N), divmod(int(q), self.N)
+                evaluated += 1
+                move = self.pair_move(pos1, pos2)
+                if move is not None:
+                    policy.offer(*move, pos1, pos2)
+            if policy.move is None:
+                # no sampled pair improves: settle it with a full scan
+                policy = FirstImproving()
+        if policy.move is None:
+            # the pairs of _scan_pairs (_vacancy_pairs for the "vacancy"
+            # policy), offered to the policy until it stops the scan
+            pairs = self._vacancy_pairs() if policy.name == "vacancy" else self._scan_pairs()
+            for pos1, pos2 in pairs:
+                evaluated += 1
+                move = self.pair_move(pos1, pos2)
+                if move is not None and policy.offer(*move, pos1, pos2):
+                    break
+        if prof is not None:
+            prof.lap("step.scan", t)
+            prof.count("step.calls")
+            prof.count("step.pairs_evaluated", evaluated)
+            prof.count("step.candidates", policy.count)
+        if policy.move is None:
+            return False
+        delta_u, u_old, u_new, move_from, move_to = policy.move
+        self._apply_move(delta_u, u_old, u_new, move_from, move_to, policy.count)
+        return True
+
+    def _kernel_move_then_swap(self):
+        # Same move as the scan above, from kernels.py over the type codes
+        prof = profiling.active
+        if prof is not None:
+            t = prof.begin()
+        U = kernels.utilities(self.counts, self.P)
+        args = (self.types.ravel(), U, self.P, self.topology.indptr, self.topology.indices, self.backend == "numba")
+        if self.policy.name != "best":
+            count, delta_u, u_old, u_new, move_from, move_to = policies.kernel_select(self.policy, *args[:5], width=self.N)
+        elif self.prune:
+            count, delta_u, u_old, u_new, move_from, move_to, evaluated = kernels.best_move(
+                *args, vacant=self.vacancies.cells(), vacancy_best=self._vacancy_heaps().best_utilities(), width=self.N)
+        else:
+            count, delta_u, u_old, u_new, move_from, move_to = kernels.scan(*args, width=self.N)
+        if prof is not None:
+            prof.lap("step.scan", t)
+            prof.count("step.calls")
+            prof.count("step.candidates", count)
+            if self.policy.name == "best" and self.prune:
+                prof.count("step.agents_evaluated", evaluated)
+            elif self.policy.name == "best":
+                prof.count("step.pairs_evaluated", self._scan_pair_count())
+        if move_from < 0:
+            return False
+        self._apply_move(delta_u, u_old, u_new, divmod(move_from, self.N), divmod(move_to, self.N), count)
+        return True
+
+    def _apply_move(self, delta_u, u_old, u_new, move_from, move_to, num_candidates):
+        (from_x, from_y), (to_x, to_y) = move_from, move_to
+        if self.verbose:
             print(f"Move from ({from_x}, {from_y}) to ({to_x}, {to_y}) | Previous Utility: {u_old:.2f}, New Utility: {u_new:.2f}, Change: {delta_u:.2f}")
-            self.swap_cells( (to_x,to_y), (from_x,from_y) )
-            flag = True
-        return flag
+        self.swap_cells( (to_x,to_y), (from_x,from_y) )
+        self.last_move = ((from_x, from_y), (to_x, to_y))
+        if self.telemetry is not None:
+            self.telemetry.move(self, self.last_move, delta_u, num_candidates)
 
     def next_step(self):
        return self.improving_move_then_swap()
@@ -144,6 +329,38 @@ class Grid:
 
     
 
+def board_repeated(g, seen):
+    # True once the board of g repeats under a deterministic policy, whose
+    # moves from there cycle forever (the "vacancy" dynamics can); seen holds
+    # the hashes of the boards so far
+    if g.policy.randomized:
+        return False
+    key = hash(g.types.tobytes())
+    if key in seen:
+        return True
+    seen.add(key)
+    return False
+
+
+def run(g, max_steps=None, capture=None):
+    # Runs g headless until no improving move is left, the board repeats (see
+    # board_repeated) or max_steps moves were made, and returns the number of
+    # moves. capture is an optional framecapture.FrameCapture that is offered
+    # the grid at step 0 and after every move.
+    steps = 0
+    seen = set()
+    board_repeated(g, seen)
+    if capture is not None:
+        capture.capture(0, g.types)
+    while (max_steps is None or steps < max_steps) and g.next_step():
+        steps += 1
+        if capture is not None:
+            capture.capture(steps, g.types)
+        if board_repeated(g, seen):
+            break
+    return steps
+
+
                                             # fixed income
 N = 25                                      # N x N grid size
 
@@ -158,6 +375,10 @@ color_dict = {c:l.index(c) for c in l}
 p = [[1,1,1], [1,1,-1], [1,-1,2]]
 
 FPS = 30
+# moves per second in the visual mode, None runs as fast as possible
+SPEED = None
+# print the initial counts and every move, as the script always used to
+VERBOSE = False
 
 CELL_SIZE = 20
 WIDTH = HEIGHT = N * CELL_SIZE
@@ -169,37 +390,63 @@ WIDTH = HEIGHT = N * CELL_SIZE
    # prob = math.exp(beta * u2) / (math.exp(beta * u1) + math.exp(beta * u2))
    # return prob
 
-def draw_grid(screen, grid):
-    for i in range(N):
-        for j in range(N):
-            if grid[i][j] == "vacant":
-                color = pygame.color.THECOLORS["gray"]
-            else:
-                color = pygame.color.THECOLORS[grid[i][j]]
-            pygame.draw.rect(screen,color , (j * CELL_SIZE, i * CELL_SIZE, CELL_SIZE, CELL_SIZE))
-            pygame.draw.rect(screen, (100, 100, 100), (j * CELL_SIZE, i * CELL_SIZE, CELL_SIZE, CELL_SIZE), 1)
+def palette(color_dict):
+    # RGB color per type code, in the order of Grid.types: the pygame color of
+    # that name, or for races that are not color names a hue spread by the
+    # golden ratio over the race index, so they stay apart
+    import colorsys
+    import pygame
+    colors = [pygame.color.THECOLORS["gray"]] * (len(color_dict) + 1)
+    for c, idx in color_dict.items():
+        name = str(c).lower().replace(" ", "")
+        if name in pygame.color.THECOLORS:
+            colors[idx + 1] = pygame.color.THECOLORS[name]
+        else:
+            colors[idx + 1] = [int(round(255 * v)) for v in colorsys.hsv_to_rgb((idx * 0.618034) % 1.0, 0.7, 0.9)]
+    return [tuple(c)[:3] for c in colors]
+
+def view(g, cell_size=CELL_SIZE, rate=SPEED):
+    # Runs g in a pygame window until it converges or the window is closed
+    import pygame
+    from renderer import MAX_WINDOW, Viewport
+    from simthread import SimulationThread, handle_key, status
 
-def main():
     pygame.init()
-    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    size = min(g.N * cell_size, MAX_WINDOW)
+    screen = pygame.display.set_mode((size, size))
     pygame.display.set_caption("Zhang's Segregation Model")
     clock = pygame.time.Clock()
 
-    g = Grid(N=N,p=p,color_dict=color_dict,colors=colors)
+    renderer = Viewport(g.N, palette(g.color_dict), (size, size), zoom=cell_size)
+    # the simulation runs on its own thread; FPS only paces the display
+    sim = SimulationThread(g.next_step, g.types.copy, rate=rate)
+    sim.start()
     running = True
 
     while running:
-        screen.fill((0, 0, 0))
-        draw_grid(screen, g.grid)
-        pygame.display.flip()
+        # read finished first so the final snapshot is drawn before exiting
+        finished = sim.finished
+        types, _ = sim.latest()
+        pygame.display.update(renderer.draw(screen, types))
+        pygame.display.set_caption(f"Zhang's Segregation Model | {status(sim, FPS)}")
         clock.tick(FPS)
-        running = g.next_step()
+        running = not finished
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif renderer.handle_event(event):
+                pass
+            elif event.type == pygame.KEYDOWN:
+                handle_key(sim, event.key, FPS)
 
+    sim.stop()
     pygame.quit()
+    return sim.steps
+
+def main():
+    g = Grid(N=N,p=p,color_dict=color_dict,colors=colors,verbose=VERBOSE)
+    view(g)
 
 if __name__ == '__main__':
     main()